@@ -1,26 +1,38 @@
 from math import atan2, floor, pi, dist, cos, sin, copysign, radians
-import beacon_detection.camera_Api as camera
 from functools import partial
-import requests
+from contextlib import contextmanager
 import threading
 import time
 import logging
 
-from movement_control.positioning_system import TargetDistance
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+from simulation import backend_name
+if backend_name() == "sim":
+    from simulation import TargetDistance  # positionnement simulé : même interface
+else:
+    from movement_control.positioning_system import TargetDistance
+from frame_bus import FrameBus
+from detection import DetectionCache, DetectionWorker
+from eval_client import EvalClient, PositionReporter
+from localization import PoseFilter
+import planning
+from pipeline import Pipeline, StageCancelled
+from log_config import setup_logging, HOT
+import metrics
+
+# Configure logging (shared with remake.py when run from the server)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-
-logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
-
 addrCompl = "/api"
 InnerRadius = 80
+ADVANCE_DISTANCE = 1300     # avance initiale vers le centre du terrain (mm)
+APPROACH_STANDOFF = 200     # distance d'arrêt devant une balise à valider (mm)
+DETECTION_TIMEOUT = 0.5  # attente maximale d'un résultat du processus de détection (s)
+SCAN_STEPS = 18             # nombre de pas d'un balayage complet
+SCAN_STEP_DEG = 20          # rotation entre deux pas (degrés)
+SCAN_DWELL = 1.0            # attente maximale d'une image fraîche à chaque pas (s)
+SCAN_FRAMES_PER_STEP = 1    # images fraîches examinées avant de tourner
+FIXED_BEACONS = {1, 2, 3, 4}
 pos1 = (0, 150)
 pos2 = (150, 0)
 pos3 = (0, -150)
@@ -34,112 +46,373 @@ def deg_to_rad(d):
     return d * pi / 180
 
 
+def timed_phase(name):
+    '''
+    mesure la durée d'une étape de AutoProgramme.active (histogramme auto_phase_seconds)
+
+    arg : name = str
+    '''
+    return metrics.timed("auto_phase_seconds", "AutoProgramme.active phase duration", phase=name)
+
+
+class ScanGoal():
+    '''
+    Condition d'arrêt d'un balayage : au moins count balises distinctes acceptées par accept,
+    ou done(résultat) vrai si done est fourni
+
+    arg : accept = function (dictionnaire balise -> bool)
+          count = int
+          description = string
+          done = function (ScanResult -> bool)
+    '''
+    def __init__(self,accept,count=1,description="goal",done=None):
+        self.accept = accept
+        self.count = count
+        self.description = description
+        self.done = done
+
+    @classmethod
+    def any_of(cls,ids,count=1):
+        ids = frozenset(ids)
+        return cls(lambda m: m['id'] in ids, count, f"any {count} of {sorted(ids)}")
+
+    @classmethod
+    def marker(cls,k):
+        return cls(lambda m: m['id'] == k, 1, f"id {k}")
+
+    @classmethod
+    def excluding(cls,ids):
+        ids = frozenset(ids)
+        return cls(lambda m: m['id'] not in ids, 1, f"any id not in {sorted(ids)}")
+
+
+class ScanResult():
+    '''
+    Résultat d'un balayage
+
+    matched : balises satisfaisant le but, dans l'ordre de découverte (dernière observation de chacune)
+    seen : toutes les balises vues pendant le balayage, id -> dernière observation
+    '''
+    def __init__(self,goal):
+        self.goal = goal
+        self.matched = {}
+        self.seen = {}
+        self.steps = 0
+        self.frames = 0
+
+    @property
+    def found(self):
+        if self.goal.done is not None and self.goal.done(self):
+            return True
+        return len(self.matched) >= self.goal.count
+
+    @property
+    def last(self):
+        '''
+        Dernière balise découverte satisfaisant le but, ou None
+        '''
+        return list(self.matched.values())[-1] if self.matched else None
+
+
 
 class AutoProgramme:
-    def __init__(self,robot,position):
+    def __init__(self,robot,position,frame_bus,detection_worker=None,eval_client=None,telemetry=None):
         logger.info("Initializing AutoProgramme")
         self.capture = 0
         self.run =False
         self.position = position
         self.robot = robot
+        self.frame_bus = frame_bus  # images partagées avec le flux web
+        self.eval = eval_client if eval_client is not None else EvalClient(f"http://proj103.r2.enst.fr{addrCompl}")
+        self.detection_worker = detection_worker  # détection hors processus, si disponible
+        # une seule détection par image, partagée avec les résultats du processus de détection
+        self.detections = detection_worker.cache if detection_worker is not None else DetectionCache()
+        self.latest_markers = None  # dernier MarkerEvent reçu du processus de détection
+        self.markers_condition = threading.Condition()
+        self.heading = 0.0   # rotation cumulée commandée depuis le dernier déplacement (rad)
+        self.sightings = {}  # id -> (balise, heading au moment de l'observation), oublié à chaque déplacement
+        self.localizer = PoseFilter()  # pose estimée en continu (odométrie + balises fixes)
+        # limites utilisées par le planificateur ; les arcs seulement si le robot sait les suivre
+        self.limits = planning.DEFAULT_LIMITS._replace(arcs=hasattr(robot, "move_arc"))
+        self.reporter = None  # PositionReporter, créé par send_position_periodic
+        self.pipeline = None  # graphe d'étapes du dernier active, consultable après coup
+        self.telemetry = telemetry  # état publié aux clients (telemetry.Telemetry), si fourni
+        self.stages = set()  # étapes du pipeline en cours
+        self.stages_lock = threading.Lock()
         self.stop_rotation_event = threading.Event()
-        self.latest_frame = None
         self.stop_rotation = threading.Event()
         logger.debug(f"AutoProgramme initialized - capture: {self.capture}, run: {self.run}")
 
+    def publish(self):
+        '''
+        Écrit l'état du mode auto dans la télémétrie
+        '''
+        if self.telemetry is not None:
+            with self.stages_lock:
+                stages = sorted(self.stages)
+            self.telemetry.update(auto={"active": self.run, "stages": stages, "captures": self.capture})
 
+    @contextmanager
+    def phase(self,name):
+        '''
+        Chronomètre une étape du pipeline (timed_phase) et la publie tant qu'elle tourne
 
-    def update_pos(self):
+        arg : name = str
         '''
+        with self.stages_lock:
+            self.stages.add(name)
+        self.publish()
+        try:
+            with timed_phase(name) as metric:
+                yield metric
+        finally:
+            with self.stages_lock:
+                self.stages.discard(name)
+            self.publish()
+
+    @property
+    def latest_frame(self):
+        '''
+        Dernière image brute publiée par le bus, ou None si la caméra n'a encore rien envoyé
+        '''
+        frame = self.frame_bus.latest
+        return frame.raw if frame is not None else None
 
-        Fait tourner le robot jusqu'à avoir 3 Balises fixe (entre 1 et 4) dans le champ
+    def on_markers(self,event):
+        '''
+        Abonné du DetectionWorker : garde le dernier résultat de détection
 
+        arg : event = MarkerEvent
         '''
-        # Wait for camera to be ready
-        logger.info("Starting position update - waiting for camera to be ready")
+        with self.markers_condition:
+            if self.latest_markers is None or event.seq > self.latest_markers.seq:
+                self.latest_markers = event
+            self.markers_condition.notify_all()
+        self.localizer.observe(event.markers, event.timestamp, event.seq)
 
-        while self.latest_frame is None:
-            logger.debug("Waiting for camera frame...")
-            time.sleep(0.05)
-        logger.info("Camera ready - starting beacon detection rotation")
-
-        self.stop_rotation_event.clear()
-        # rotate_thread = threading.Thread(target=self.rotate_robot_c_times,args=[18], daemon=True)
-        # rotate_thread.start()
-        logger.debug("Rotation thread started (18 iterations)")
-
-        # markers = camera.detect_markers(self.latest_frame)
-        dispo = []
-        viewed = []
-        last_angle = 0
-        # dispo = [TargetDistance(m['id'],m['distance']*10,m['id']==1) for m in markers if 0 < m['id'] < 5] if markers else []
-        # viewed = [m['id'] for m in markers if 0 < m['id'] < 5]
-        logger.info(f"Initial markers detected: {len(dispo)}, IDs: {viewed}")
-
-        for i in range(18):
-            for k in range (10):
-                markers = camera.detect_markers(self.latest_frame)
-                # print (markers)
-                for m in markers :
-                    if not m['id'] in viewed and 0 < m['id'] < 5 :
-                        logger.debug(f"New beacon found - ID: {m['id']}, distance: {m['distance']*10}")
-                        dispo.append(TargetDistance(m['id'],m['distance']*10,False))
-                        viewed.append(m['id'])
-                        last_angle = m['horizontal_angle']
-                time.sleep(0.10)
-            if len(dispo) < 3:
-                if self.robot is not None:
-                    self.robot.turn_precise(deg_to_rad(20))
-            else:
-                break
-
-            # markers = camera.detect_markers(self.latest_frame)
-            # for m in markers :
-            #     if not m['id'] in viewed and 0 < m['id'] < 5 :
-            #         logger.debug(f"New beacon found - ID: {m['id']}, distance: {m['distance']*10}")
-            #         dispo.append(TargetDistance(m['id'],m['distance']*10,m['id']==1))
-            #         viewed.append(m['id'])
-            # if index % 50 ==0:
-            #     logger.debug(f"Still searching for beacons - iteration: {index}, found: {len(dispo)}/3")
-
-        # self.stop_rotation_event.set()
-        # rotate_thread.join(timeout=0.1)
-        logger.info(f"Found 3 beacons - stopping rotation. Beacons: {[d.id for d in dispo]}")
-
-        # Center on the last beacon located (should be beacon 1)
-        angle = last_angle
-        
+    def attach_detection(self):
+        '''
+        Branche le processus de détection sur le bus d'images pour la durée du mode auto
+        '''
+        if self.detection_worker is not None:
+            self.detection_worker.subscribe(self.on_markers)
+            self.frame_bus.subscribe(self.detection_worker.submit)
+
+    def detach_detection(self):
+        if self.detection_worker is not None:
+            self.frame_bus.unsubscribe(self.detection_worker.submit)
+            self.detection_worker.unsubscribe(self.on_markers)
+
+    @contextmanager
+    def tracking(self,marker):
+        '''
+        Suit la balise marker dans le processus de détection le temps du bloc (centrage,
+        approche) : seule une zone autour d'elle est examinée tant qu'elle n'est pas perdue
+
+        arg : marker = dictionnaire balise
+        '''
+        if self.detection_worker is None or not marker:
+            yield
+            return
+        self.detection_worker.track(marker)
+        try:
+            yield
+        finally:
+            self.detection_worker.track(None)
+
+    def detect_frame(self,frame):
+        '''
+        Balises visibles sur une image du bus
+
+        Avec un DetectionWorker, attend le résultat du processus de détection pour une image
+        au moins aussi récente ; sinon (ou s'il ne répond pas à temps) détecte sur place.
+
+        arg : frame = Frame
+
+        output : liste de dictionnaires ( 'id', 'distance', 'horizontal_angle', ...)
+        '''
+        if self.detection_worker is not None:
+            with self.markers_condition:
+                fresh = lambda: self.latest_markers is not None and self.latest_markers.seq >= frame.seq
+                if self.markers_condition.wait_for(fresh, DETECTION_TIMEOUT):
+                    return self.latest_markers.markers
+            logger.warning("No detection result for frame %d after %ss - detecting inline", frame.seq, DETECTION_TIMEOUT, extra=HOT)
+        markers = self.detections.detect(frame)
+        self.localizer.observe(markers, frame.timestamp, frame.seq)
+        return markers
+
+    def pose(self):
+        '''
+        Pose estimée par le filtre de localisation
+
+        output : (x mm, y mm, theta rad)
+        '''
+        return self.localizer.pose()
+
+
+    def turn(self,angle):
+        '''
+        Tourne le robot sur place en suivant la rotation cumulée
+
+        arg : angle = float (rad)
+        '''
+        self.heading += angle
+        if self.detection_worker is not None:
+            self.detection_worker.tracker.rotate(angle)  # la balise suivie se décale d'autant dans l'image
+        self.localizer.begin_motion()
         if self.robot is not None:
-            self.robot.turn_precise(-deg_to_rad(angle))
+            self.robot.turn_precise(angle)
+        self.localizer.predict_turn(angle)
+
+    def move(self,distance):
+        '''
+        Avance le robot en ligne droite ; les balises mémorisées ne sont plus valables
+
+        arg : distance = float (mm)
+        '''
+        self.sightings.clear()
+        self.heading = 0.0
+        self.localizer.begin_motion()
+        if self.robot is not None:
+            self.robot.move_precise(distance)
+        self.localizer.predict_move(distance)
+
+    def arc(self,angle,radius):
+        '''
+        Avance sur un arc de cercle ; les balises mémorisées ne sont plus valables
+
+        arg : angle = float (rad)
+              radius = float (mm)
+        '''
+        self.sightings.clear()
+        self.heading = 0.0
+        self.localizer.begin_motion()
+        self.robot.move_arc(angle, radius)
+        self.localizer.predict_arc(angle, radius)
+
+    def follow(self,motions):
+        '''
+        Exécute un plan de planning.plan
+
+        arg : motions = liste de planning.Motion
+        '''
+        for motion in motions:
+            if motion.kind == "turn":
+                self.turn(motion.value)
+            elif motion.kind == "move":
+                self.move(motion.value)
+            else:
+                self.arc(motion.value, motion.radius)
+
+    def face(self,marker):
+        '''
+        Centre le robot sur une balise qui vient d'être observée
+
+        arg : marker = dictionnaire balise
+        '''
+        self.turn(-deg_to_rad(marker['horizontal_angle']))
+
+    def wait_camera(self):
+        while self.frame_bus.latest is None:
+            logger.debug("Waiting for camera frame...", extra=HOT)
+            time.sleep(0.05)
+
+    def scan(self,goal,steps=SCAN_STEPS,step_angle=deg_to_rad(SCAN_STEP_DEG),dwell=SCAN_DWELL,frames_per_step=SCAN_FRAMES_PER_STEP,cancel=None):
+        '''
+        Balayage commun à toutes les recherches de balises
+
+        Si une balise satisfaisant le but a déjà été vue depuis le dernier déplacement, le robot
+        se tourne d'abord vers elle. Ensuite, à chaque pas, il examine les images fraîches
+        (capturées après la dernière rotation) et s'arrête dès que le but est atteint ;
+        sinon il tourne de step_angle après frames_per_step images ou dwell secondes.
+        Le balayage s'interrompt entre deux pas si cancel est levé.
+
+        arg : goal = ScanGoal
+              steps = int
+              step_angle = float (rad)
+              dwell = float (s)
+              frames_per_step = int
+              cancel = threading.Event
+
+        output : ScanResult
+        '''
+        self.wait_camera()
+        result = ScanResult(goal)
+        remembered = [(m, h) for m, h in self.sightings.values() if goal.accept(m)]
+        if remembered:
+            marker, heading = remembered[-1]
+            logger.info(f"Scan for {goal.description} - turning toward remembered beacon {marker['id']}")
+            self.turn(heading - self.heading - deg_to_rad(marker['horizontal_angle']))
+
+        for step in range(steps):
+            if cancel is not None and cancel.is_set():
+                logger.info(f"Scan for {goal.description} cancelled after {result.steps} steps")
+                return result
+            result.steps = step + 1
+            # une image prise depuis la fin du dernier mouvement est déjà fraîche : une caméra
+            # immobile ne publie pas de nouvelle image tant que la scène ne change pas
+            latest = self.frame_bus.latest
+            last_seq = latest.seq - 1 if latest.timestamp >= self.localizer.settled_at else latest.seq
+            deadline = time.time() + dwell
+            for _ in range(frames_per_step):
+                frame = self.frame_bus.wait_for_frame(last_seq, max(0.0, deadline - time.time()))
+                if frame is None:
+                    break
+                last_seq = frame.seq
+                result.frames += 1
+                for m in self.detect_frame(frame):
+                    result.seen[m['id']] = m
+                    self.sightings[m['id']] = (m, self.heading)
+                    if goal.accept(m):
+                        if m['id'] not in result.matched:
+                            logger.debug("Scan match for %s - ID: %s, distance: %s", goal.description, m['id'], m['distance']*10)
+                        result.matched[m['id']] = m
+                if result.found:
+                    logger.info(f"Scan for {goal.description} done - steps: {result.steps}, frames: {result.frames}")
+                    return result
+            self.turn(step_angle)
+        logger.warning(f"Scan for {goal.description} incomplete - found {len(result.matched)}/{goal.count} after {result.steps} steps, seen: {sorted(result.seen)}")
+        return result
+
+    def update_pos(self):
+        '''
+
+        Fait tourner le robot jusqu'à avoir 3 Balises fixe (entre 1 et 4) dans le champ
+
+        Le balayage est sauté si le filtre de localisation connaît déjà la pose, et s'arrête
+        dès qu'elle est connue (souvent au premier coup d'oeil)
 
+        '''
+        if self.localizer.confident():
+            logger.info("Position already known - skipping relocalization sweep (std: %.0f mm, %.1f deg)", self.localizer.std()[0], self.localizer.std()[1] * 180 / pi)
+            return
+        logger.info("Starting position update - scanning for 3 fixed beacons")
+        goal = ScanGoal(lambda m: m['id'] in FIXED_BEACONS, 3, "3 fixed beacons or known pose", done=lambda result: self.localizer.confident())
+        result = self.scan(goal)
+        if self.localizer.confident() and len(result.matched) < 3:
+            logger.info(f"Pose known after {result.steps} scan steps - beacons: {sorted(result.matched)}")
+            return
+        dispo = [TargetDistance(m['id'],m['distance']*10,False) for m in result.matched.values()]
+        if not dispo:
+            logger.error("No fixed beacon found - position not updated")
+            return
+        logger.info(f"Found {len(dispo)} beacons - stopping rotation. Beacons: {[d.id for d in dispo]}")
+
+        # Center on the last beacon located
+        with self.tracking(result.last):
+            self.face(result.last)
         dispo[-1].facing = True
 
         logger.info("Calculating new position based on detected beacons")
         self.position.find_target(dispo)
         logger.info("Position updated successfully")
         x, y, theta = self.position.get_position()
+        self.localizer.fix(x, y, theta)
         logger.debug(f"New position - x: {x:.2f}, y: {y:.2f}, theta: {theta:.2f}")
         time.sleep(1)
 
         return 
 
-    def camera_loop(self):
-
-        '''
-
-        Envoie la caméra toutes les x frames
-
-        '''
-        logger.info("Camera loop started for AutoProgramme")
-        frame_count = 0
-        while self.run:
-            frame = camera.get_camera_frame()
-            if frame is not None:
-                self.latest_frame = frame
-                frame_count += 1
-            time.sleep(0.02)
-        logger.info(f"Camera loop stopped - total frames: {frame_count}")
-
     def rotate_robot_continuously(self):
 
         '''
@@ -178,120 +451,56 @@ class AutoProgramme:
                 t = 0
                 self.robot.turn_precise(deg_to_rad(20))
 
-    def locate_balise(self,k):
+    def locate_balise(self,k,cancel=None):
 
         '''
         Recherche la balise k en regardant autour de lui
 
+        Le robot reste dans la direction où il l'a vue : valide_balise planifie l'approche
+        depuis cette pose, sans rotation préalable vers la balise.
+
         arg : k = int
-        timeout =int
+              cancel = threading.Event
 
         output : Dictionary ( 'id' : int, ' distance' : int, 'angle': int)
 
         '''
         logger.info(f"Starting search for beacon ID: {k}")
-        while self.latest_frame is None:
-            logger.debug("Waiting for camera frame...")
-            time.sleep(0.05)
-            logger.info("Camera ready - starting beacon detection rotation")
-        dispo =None
-
-
-        for i in range(18):
-            for j in range (10):
-                markers = camera.detect_markers(self.latest_frame)
-                # print(markers)
-                for m in markers :
-                    if m['id'] ==k :
-                        logger.debug(f"Balise found - ID: {m['id']}, distance: {m['distance']*10}")
-                        dispo = m
-                time.sleep(0.10)
-            if dispo == None:
-                if self.robot is not None:
-                        self.robot.turn_precise(deg_to_rad(20))
-            else:
-                break
-
-        if dispo != None:
+        dispo = self.scan(ScanGoal.marker(k), cancel=cancel).last
+        if dispo is not None:
             logger.info(f"Found balise {k}")
-
-        # Center on the last beacon located (should be beacon 1)
-            angle = dispo['horizontal_angle']
-            if self.robot is not None:
-                self.robot.turn_precise(-deg_to_rad(angle))
-
-
         return dispo
 
-    def locate_balise_next(self):
+    def locate_balise_next(self,cancel=None):
         '''
 
         Recherche la prochaine balise dans son champs de vision qui n'est pas dans [|1,4|] en regardant autour de lui
 
-        arg :
-        timeout =int
+        arg : cancel = threading.Event
 
         output : Dictionary
 
         '''
         logger.info(f"Starting search for next beacon ")
-        while self.latest_frame is None:
-            logger.debug("Waiting for camera frame...")
-            time.sleep(0.05)
-            logger.info("Camera ready - starting beacon detection rotation")
-        dispo =None
-        for i in range(18):
-            for j in range (10):
-                markers = camera.detect_markers(self.latest_frame)
-                # print(markers)
-                for m in markers :
-                    if m['id'] not in {0,1,2,3,4} :
-                        logger.debug(f"Balise found - ID: {m['id']}, distance: {m['distance']*10}")
-                        dispo = m
-                time.sleep(0.10)
-            if dispo == None:
-                if self.robot is not None:
-                        self.robot.turn_precise(deg_to_rad(20))
-            else:
-                break
-
-        if dispo != None:
+        dispo = self.scan(ScanGoal.excluding({0} | FIXED_BEACONS), cancel=cancel).last
+        if dispo is not None:
             logger.info(f"Found balise next")
-
-        # Center on the last beacon located (should be beacon 1)
-            angle = dispo['horizontal_angle']
-            if self.robot is not None:
-                self.robot.turn_precise(-deg_to_rad(angle))
-
-
-        return dispo 
+        return dispo
 
 
     def send_position_periodic(self):
         '''
 
-        Envoie la position au serveur d'éval toutes les secondes
+        Envoie la position au serveur d'éval toutes les secondes, tant que le mode auto tourne
 
         '''
-        global addrCompl
         logger.info("Starting periodic position reporting to evaluation server")
-        send_count = 0
-        while self.run:
-            x,y,theta = self.position.get_position()
-            x = x/10
-            y = y/10
-
-            url = f"http://proj103.r2.enst.fr{addrCompl}/pos?x={x}&y={y}"
-            # print(x,y)
-            send_count += 1
-            try:
-                response = requests.post(url, timeout=5)
-                if send_count % 10 == 0:
-                    logger.debug(f"Position send status: {response.status_code}")
-            except Exception as e:
-                logger.error(f"Failed to send position to server: {e}")
-            time.sleep(1.0)
-        logger.info(f"Stopped periodic position reporting - total sends: {send_count}")
+        self.reporter = PositionReporter(self.eval, self.position_cm, running=lambda: self.run)
+        self.reporter.run()
+
+    def position_cm(self):
+        x,y,theta = self.pose()
+        return x/10, y/10
 
     def watcher(self,send_callback):
 
@@ -310,71 +519,130 @@ class AutoProgramme:
         self.run = False
         send_callback({"type": "finished", "msg": "Course complete"})
 
-    def valide_balise(self,balise,send_callback):
+    def approach_balise(self,balise,send_callback):
         '''
 
-        A partir des info d'une balise trouvée par ka caméra,
-        effectue le calcul de sa position, s'en rapproche et le renvoie au serveur
+        A partir des info d'une balise trouvée par ka caméra (observée depuis la pose courante),
+        effectue le calcul de sa position et s'en rapproche
 
+        arg : balise = dictionnaire balise
+              send_callback = function
 
-        arg : send_callback = function
+        output : (id, secteur, intérieur) à envoyer au serveur, ou None si pas de balise
 
         '''
-        if balise:
-            beacon_id = balise["id"]
-            beacon_distance = balise["distance"]
-            logger.info(f"Validating beacon - ID: {beacon_id}, distance: {beacon_distance}")
-            send_callback({
-                "type": "found",
-                "msg": "balise trouvee a une distance",
-                "distance": beacon_distance
-            })
-
-            x,y,theta = self.position.get_position()
-            x=x/10
-            y=y/10
-            logger.debug(f"Robot position before approach - x: {x:.2f}, y: {y:.2f}, theta: {theta:.2f}")
-            xbal = x+ beacon_distance*cos(theta)
-            ybal = y+ beacon_distance*sin(theta)
-            logger.debug(f"Calculated beacon position - x: {xbal:.2f}, y: {ybal:.2f}")
-            #Oriente le robot vers le centre de la balise
-
-            move_distance = beacon_distance * 10 - 200
-            logger.info(f"Moving toward beacon - distance: {move_distance}")
-            self.robot.move_precise(move_distance)
-
-            '''  trouver l'orientation'''
-            theta = atan2(ybal, xbal)
-            theta_clock = (pi/2 - theta) % (2*pi) 
-            sector_index = int(theta_clock // (pi/4)) 
-            sector_index = (sector_index + 1) % 8
-            sector = chr(65 + sector_index) 
-            isInside = ( dist ((0 , 0) , ( xbal , ybal ) ) <=InnerRadius )
-            logger.info(f"Beacon validation - ID: {beacon_id}, sector: {sector}, inside: {isInside}, position: ({x:.2f}, {y:.2f})")
-
-            try:
-                url = f"http://proj103.r2.enst.fr{addrCompl}/marker?id={beacon_id}&sector={sector}&inner={1 if isInside else 0}"
-                logger.debug(f"Sending validation request: {url}")
-                a = requests.post(url, timeout=10)
-                logger.info(f"Validation response - status: {a.status_code}")
-
-                if a.status_code==200:
-                    self.capture +=1
-                    logger.info(f"Beacon {beacon_id} VALIDATED - total captures: {self.capture}/2")
-                    self.robot.turn_precise(deg_to_rad(180))
-                    self.robot.turn_precise(deg_to_rad(180))
-                elif a.status_code==503:
-                    self.capture +=1
-                    self.robot.turn_precise(deg_to_rad(180))
-                    self.robot.turn_precise(deg_to_rad(180))
-                    logger.info(f"Beacon {beacon_id} VALIDATED OUT OF COURSE - total captures: {self.capture}/2")
-                else :
-                    logger.error(f"Beacon {beacon_id} VALIDATION FAILED - status: {a.status_code}, response: {a.text}")
-            except Exception as e:
-                logger.error(f"Error during beacon validation API call: {e}", exc_info=True)
-        else:
+        if not balise:
             logger.warning("Beacon validation called with None/empty beacon")
             send_callback({"type": "not_found", "msg": "balise non trouvée"})
+            return None
+        beacon_id = balise["id"]
+        beacon_distance = balise["distance"]
+        logger.info(f"Validating beacon - ID: {beacon_id}, distance: {beacon_distance}")
+        send_callback({
+            "type": "found",
+            "msg": "balise trouvee a une distance",
+            "distance": beacon_distance
+        })
+
+        pose = self.pose()
+        x,y,theta = pose
+        x=x/10
+        y=y/10
+        logger.debug(f"Robot position before approach - x: {x:.2f}, y: {y:.2f}, theta: {theta:.2f}")
+        bearing = theta - deg_to_rad(balise["horizontal_angle"])
+        xbal = x+ beacon_distance*cos(bearing)
+        ybal = y+ beacon_distance*sin(bearing)
+        logger.debug(f"Calculated beacon position - x: {xbal:.2f}, y: {ybal:.2f}")
+
+        # S'arrête à APPROACH_STANDOFF de la balise, par le chemin le plus rapide
+        motions = planning.plan(pose, (xbal * 10, ybal * 10), standoff=APPROACH_STANDOFF, limits=self.limits)
+        logger.info(f"Approaching beacon - plan: {motions}, estimated: {planning.plan_duration(motions, self.limits):.2f}s")
+        with self.tracking(balise):
+            self.follow(motions)
+
+        '''  trouver l'orientation'''
+        theta = atan2(ybal, xbal)
+        theta_clock = (pi/2 - theta) % (2*pi) 
+        sector_index = int(theta_clock // (pi/4)) 
+        sector_index = (sector_index + 1) % 8
+        sector = chr(65 + sector_index) 
+        isInside = ( dist ((0 , 0) , ( xbal , ybal ) ) <=InnerRadius )
+        logger.info(f"Beacon validation - ID: {beacon_id}, sector: {sector}, inside: {isInside}, position: ({x:.2f}, {y:.2f})")
+        return beacon_id, sector, isInside
+
+    def submit_balise(self,beacon_id,sector,isInside):
+        '''
+
+        Envoie la balise au serveur et attend sa réponse ; le robot peut bouger pendant ce temps
+
+        arg : beacon_id = int
+              sector = string
+              isInside = bool
+
+        output : bool, vrai si le serveur a accepté la balise
+
+        '''
+        try:
+            logger.debug(f"Sending validation request - id: {beacon_id}, sector: {sector}, inner: {isInside}")
+            a = self.eval.post_marker(beacon_id, sector, isInside).result()
+            logger.info(f"Validation response - status: {a.status_code}")
+
+            if a.status_code==200:
+                self.capture +=1
+                logger.info(f"Beacon {beacon_id} VALIDATED - total captures: {self.capture}/2")
+            elif a.status_code==503:
+                self.capture +=1
+                logger.info(f"Beacon {beacon_id} VALIDATED OUT OF COURSE - total captures: {self.capture}/2")
+            else :
+                logger.error(f"Beacon {beacon_id} VALIDATION FAILED - status: {a.status_code}, response: {a.text}")
+                return False
+            self.publish()
+            return True
+        except Exception as e:
+            logger.error(f"Error during beacon validation API call: {e}", exc_info=True)
+            return False
+
+    def valide_balise(self,balise,send_callback):
+        '''
+
+        S'approche d'une balise trouvée par la caméra et la renvoie au serveur
+
+        arg : balise = dictionnaire balise
+              send_callback = function
+
+        output : bool, vrai si le serveur a accepté la balise
+
+        '''
+        claim = self.approach_balise(balise, send_callback)
+        return claim is not None and self.submit_balise(*claim)
+
+    def check_status(self,beacon_id):
+        '''
+
+        Demande au serveur si la balise beacon_id fait partie des balises validées
+
+        arg : beacon_id = int
+
+        output : bool
+
+        '''
+        valide = self.eval.get_status().result().json()
+        absent = not any(m["id"] == beacon_id for m in valide["markers"])
+        if absent :
+            logger.error(f"FIRST BEACON VALIDATION REJECTED BY SERVER - ID: {beacon_id}")
+        else :
+            logger.info(f"First beacon validated by server - proceeding to second beacon")
+        return not absent
+
+    def fetch_list(self):
+        '''
+
+        Liste des balises restant à capturer, dans l'ordre du serveur
+
+        output : liste d'int
+
+        '''
+        return self.eval.get_list().result().json()["markers"]
 
 
     def active(self,send_callback):
@@ -388,21 +656,47 @@ class AutoProgramme:
         - Si c'est correcte, cherche le prochain drapeau à capturer
         - va s'approcher de ce nouveau drapeau
 
+        Les étapes forment un graphe de tâches (pipeline.Pipeline) : la liste des balises est
+        demandée pendant l'avance initiale, la recherche de la balise suivante commence pendant
+        que la validation de la première est envoyée (elle est annulée si le serveur refuse ou
+        en désigne une autre), et le retour commence pendant l'envoi de la seconde.
 
         arg : send_callback = function
 
         '''
 
         logger.info("=== Starting automatic beacon capture sequence ===")
+        self.pipeline = Pipeline("auto", timer=self.phase)
+        try:
+            self.run_pipeline(self.pipeline, send_callback)
+        finally:
+            self.pipeline.close()
+            logger.info(self.pipeline.summary())
+            send_callback({"type": "auto_plan", "critical_path": self.pipeline.critical_path(), "stages": self.pipeline.describe()})
+
+    def run_pipeline(self,p,send_callback):
+        '''
+
+        Construit et exécute le graphe d'étapes de active
 
-        logger.info("Initial movement - advancing 1500 units")
-        self.robot.move_precise(1300)
+        arg : p = Pipeline
+              send_callback = function
+
+        '''
+        # les étapes qui bougent le robot forment une seule chaîne ; les requêtes se greffent dessus
+        prefetch = p.add("prefetch_list", lambda cancel: self.fetch_list())
+
+        logger.info(f"Initial movement - advancing {ADVANCE_DISTANCE} mm")
+        def advance(cancel):
+            x, y, theta = self.pose()
+            self.go_to(x + ADVANCE_DISTANCE * cos(theta), y + ADVANCE_DISTANCE * sin(theta))
+        p.add("advance", advance)
 
         logger.info("Updating position using beacon triangulation")
-        self.update_pos()
+        p.add("update_pos", lambda cancel: self.update_pos(), after=["advance"])
 
         logger.info("Locating first target beacon (not in [1-4])")
-        m = self.locate_balise_next() # récupère la balise centrale
+        m = p.add("locate_first", self.locate_balise_next, after=["update_pos"]).result() # récupère la balise centrale
 
         if m is None:
             logger.error("First target beacon not found - aborting")
@@ -412,36 +706,68 @@ class AutoProgramme:
         logger.info(f"First target beacon located - ID: {first_id}")
 
         logger.info(f"Attempting to validate first beacon (ID: {first_id})")
-        self.valide_balise(m,send_callback)
-        
-        #regarde si le serveur de test valide la prise de balise
-        logger.info("Checking validation status with server")
+        # m et approach sont réaffectés pour la seconde balise : liés à la création de chaque étape
+        approach = p.add("approach_first", lambda cancel, m=m: self.approach_balise(m, send_callback), after=["locate_first"])
+        post = p.add("validate_first", lambda cancel, approach=approach: self.submit_balise(*approach.result()), after=["approach_first"])
+
+        #regarde si le serveur de test valide la prise de balise, la liste des balises restantes est demandée en même temps
+        status = p.add("check_status", lambda cancel: self.check_status(first_id), after=["validate_first"])
+        todo = p.add("fetch_list", lambda cancel: self.fetch_list(), after=["validate_first"])
+
+        # Spéculation : la balise suivante de la liste demandée au départ, cherchée pendant la validation
         try:
-            valide = requests.get(f"http://proj103.r2.enst.fr{addrCompl}/status", timeout=10).json()
-            absent = not any(m["id"] == first_id for m in valide["markers"])
-            if absent :
-                logger.error(f"FIRST BEACON VALIDATION REJECTED BY SERVER - ID: {first_id}")
-                # return
-            else :
-                logger.info(f"First beacon validated by server - proceeding to second beacon")
+            guess = next((k for k in prefetch.result() if k != first_id), None)
+        except Exception as e:
+            logger.warning(f"Prefetched list unavailable - no speculative search: {e}")
+            guess = None
+        search = None
+        if guess is not None:
+            logger.info(f"Speculatively locating beacon {guess} while validation is in flight")
+            search = p.add("locate_next", partial(self.locate_balise, guess), after=["approach_first"], speculative=True)
+
+        try:
+            accepted = post.result() and status.result()
         except Exception as e:
             logger.error(f"Failed to check validation status: {e}")
-            # return
+            accepted = False
 
         logger.info("Fetching list of remaining beacons to capture")
         try:
-            todo = requests.get(f"http://proj103.r2.enst.fr{addrCompl}/list", timeout=10).json()
-            next_id = todo["markers"][0]
+            next_id = todo.result()[0]
+        except Exception as e:
+            logger.error(f"Failed to get next beacon or validate: {e}", exc_info=True)
+            next_id = None
+        if next_id is not None:
             logger.info(f"Next beacon to capture - ID: {next_id}")
-            m = self.locate_balise(next_id)
 
+        locate = "locate_next"
+        if search is not None and (not accepted or next_id != guess):
+            logger.info(f"Speculative search for {guess} discarded - accepted: {accepted}, next: {next_id}")
+            p.cancel("locate_next")
+            # le robot est libre une fois le balayage interrompu
+            try:
+                search.result()
+            except Exception:
+                pass
+            search = None
+            locate = "locate_confirmed"
+        if next_id is not None and search is None:
+            search = p.add(locate, partial(self.locate_balise, next_id), after=["approach_first"])
+
+        last = "approach_first"
+        if search is not None:
+            try:
+                m = search.result()
+            except StageCancelled:
+                m = None
             logger.info(f"Attempting to validate second beacon (ID: {next_id})")
-            self.valide_balise(m,send_callback)
-            logger.info("=== Automatic beacon capture sequence complete ===")
-        except Exception as e:
-            logger.error(f"Failed to get next beacon or validate: {e}", exc_info=True)
-        self.go_to(0,0)
+            approach = p.add("approach_next", lambda cancel, m=m: self.approach_balise(m, send_callback), after=[locate])
+            p.add("validate_next", lambda cancel, approach=approach: approach.result() is not None and self.submit_balise(*approach.result()), after=["approach_next"])
+            last = "approach_next"
 
+        # le retour n'attend pas la réponse du serveur pour la seconde balise
+        p.add("return_home", lambda cancel: self.go_to(0,0), after=[last]).result()
+        logger.info("=== Automatic beacon capture sequence complete ===")
 
     def go_to(self, x_target, y_target):
         """
@@ -456,47 +782,47 @@ class AutoProgramme:
             return
 
         # Récupère la position actuelle
-        x_current, y_current, theta_current = self.position.get_position()
+        x_current, y_current, theta_current = self.pose()
         logger.info(f"Current position - x: {x_current:.2f} mm, y: {y_current:.2f} mm, theta: {theta_current:.2f} rad")
 
-        # Calcule la distance et l'angle vers la cible
-        dx = x_target - x_current
-        dy = y_target - y_current
-        distance_to_target = dist((0, 0), (dx, dy))  # déjà en mm
-        angle_to_target = atan2(dy, dx)
-
-        # Calcule l'angle relatif à l'orientation actuelle du robot
-        relative_angle = angle_to_target - theta_current
-        # Normalise entre -pi et pi
-        relative_angle = (relative_angle + pi) % (2 * pi) - pi
-
+        # Plan le plus rapide : rotation puis ligne droite, marche arrière ou arc
+        motions = planning.plan((x_current, y_current, theta_current), (x_target, y_target), reverse=True, limits=self.limits)
         logger.info(f"Moving to target - x: {x_target:.2f} mm, y: {y_target:.2f} mm")
-        logger.debug(f"Computed relative angle: {relative_angle:.2f} rad, distance: {distance_to_target:.2f} mm")
-
-        # Tourne le robot vers la cible
-        self.robot.turn_precise(relative_angle)
-
-        # Avance vers la cible
-        self.robot.move_precise(distance_to_target)
+        logger.debug(f"Planned motions: {motions}, estimated: {planning.plan_duration(motions, self.limits):.2f}s")
+        self.follow(motions)
 
         # Met à jour la position interne
-        self.position.set_position(x_target, y_target, angle_to_target)
-        logger.info(f"Arrived at target - x: {x_target:.2f} mm, y: {y_target:.2f} mm, theta: {angle_to_target:.2f} rad")
+        x, y, theta = self.pose()
+        self.position.set_position(x, y, theta)
+        logger.info(f"Arrived at target - x: {x:.2f} mm, y: {y:.2f} mm, theta: {theta:.2f} rad")
 
 
 
-def run_second_algo(send_callback, x1, y1, rbt):
+def run_second_algo(send_callback, x1, y1, rbt, frame_bus=None, detection_worker=None, eval_client=None, telemetry=None):
     logger.info(f"=== run_second_algo STARTED === Initial position: x={x1}, y={y1}")
-    alt = AutoProgramme(rbt,rbt.get_positioning_system())
+    own_worker = detection_worker is None
+    if own_worker:
+        # Le processus de détection est créé avant les threads de capture
+        detection_worker = DetectionWorker()
+        detection_worker.start()
+    own_bus = frame_bus is None
+    if own_bus:
+        # Lancé hors du serveur : le mode auto possède sa propre capture
+        logger.info("Starting frame bus capture thread for auto mode")
+        frame_bus = FrameBus()
+        frame_bus.start()
+    frame_bus.acquire("auto")  # la caméra tourne pendant tout le mode auto, même sans client
+    alt = AutoProgramme(rbt,rbt.get_positioning_system(),frame_bus,detection_worker,eval_client,telemetry)
+    alt.attach_detection()
 
     logger.info(f"Setting initial robot position - x: {x1}, y: {y1}, theta: 0")
     alt.position.set_position(x1,y1,0)
+    alt.localizer.reset(x1,y1,0)
     alt.run = True
-
-    # Start camera loop thread
-    logger.info("Starting camera loop thread for auto mode")
-    camera_thread = threading.Thread(target=alt.camera_loop, daemon=True)
-    camera_thread.start()
+    alt.publish()
+    if telemetry is not None:
+        # pose estimée relevée à chaque tick de télémétrie, le temps du mode auto
+        telemetry.sampler("pose", alt.pose)
 
     # Start position periodic thread
     logger.info("Starting periodic position reporting thread")
@@ -516,4 +842,19 @@ def run_second_algo(send_callback, x1, y1, rbt):
     except Exception as e:
         logger.error(f"=== run_second_algo FAILED === Error: {e}", exc_info=True)
         alt.run = False
+    finally:
+        alt.run = False  # arrête aussi l'envoi périodique de la position
+        if alt.reporter is not None:
+            alt.reporter.stop()
+        if telemetry is not None:
+            telemetry.sampler("pose", None)  # la dernière pose reste dans l'état
+        alt.publish()
+        alt.detach_detection()
+        frame_bus.release("auto")
+        logger.info(f"Marker detection cache stats: {alt.detections.stats()}")
+        logger.info(f"Localization stats: {alt.localizer.stats()}")
+        if own_bus:
+            frame_bus.stop()
+        if own_worker:
+            detection_worker.stop()
     
\ No newline at end of file
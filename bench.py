@@ -0,0 +1,283 @@
+'''
+Banc de performance sans matériel, sur le robot et la caméra simulés (simulation.py)
+
+    course :  parcours complet de run_second_algo face à un LocalEvalServer
+    fanout :  diffusion du flux caméra par le Server à plusieurs clients WebSocket
+
+Chaque exécution ajoute une ligne JSON à l'historique et se compare à la médiane des
+dernières exécutions faites avec les mêmes réglages (protocole compris) : le code de sortie
+vaut 1 si une mesure suivie se dégrade de plus du seuil, pour faire échouer la CI.
+L'historique est bench_history.jsonl à côté de ce fichier, à versionner avec le code,
+ou ARTEFACT_BENCH_HISTORY / --history (par exemple un cache conservé par la CI).
+
+Seuls les modules de ce dépôt et les backends simulés sont nécessaires.
+
+    python bench.py
+    python bench.py --clients 8 --duration 10 --threshold 0.3
+    python bench.py --only course --no-record
+'''
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+from statistics import median
+from math import hypot
+
+from log_config import setup_logging
+
+# Les bancs ne veulent que les avertissements, sauf demande explicite
+setup_logging(os.environ.get("ARTEFACT_LOG_LEVEL", "WARNING"))
+# Les bancs tournent toujours sur la simulation, positionnement compris
+os.environ["ARTEFACT_BACKEND"] = "sim"
+
+import websockets
+import metrics
+import remake
+try:
+    import control_logic_tracking.auto as auto
+except ModuleNotFoundError as e:
+    if e.name != "control_logic_tracking":
+        raise
+    import auto  # arbre de ce dépôt seul : auto.py est à la racine
+from frame_bus import FrameBus
+from detection import DetectionWorker, MODE_FULL, MODE_ROI
+from eval_client import EvalClient, LocalEvalServer
+from simulation import SimulatedRobot, SimulatedCamera, SIM_TARGETS
+from protocol import PROTOCOL_JSON, PROTOCOL_BINARY, encode_command
+
+HISTORY_FILE = os.environ.get("ARTEFACT_BENCH_HISTORY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_history.jsonl"))
+THRESHOLD = 0.2  # dégradation relative tolérée par rapport à la médiane de l'historique
+WINDOW = 5       # nombre d'exécutions précédentes prises en compte
+
+# Mesures suivies dans l'historique et sens dans lequel elles s'améliorent
+TRACKED = {
+    "course.duration": "lower",
+    "course.captures": "higher",
+    "fanout.fps": "higher",
+    "fanout.latency_p95": "lower",
+    "fanout.command_latency_p95": "lower",
+}
+
+
+def _percentile(values,q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_course(time_scale,detect_cost):
+    '''
+        Chronomètre un parcours complet du mode auto (run_second_algo)
+    '''
+    robot = SimulatedRobot(time_scale=time_scale)
+    camera = SimulatedCamera(robot, detect_cost=detect_cost)
+    # le processus de détection est créé avant tout thread
+    worker = DetectionWorker(camera.detect_markers)
+    worker.start()
+    eval_server = LocalEvalServer(todo=SIM_TARGETS).start()
+    client = EvalClient(eval_server.url)
+    bus = FrameBus(camera.get_camera_frame)
+    bus.start()
+    messages = []
+    started = time.perf_counter()
+    try:
+        auto.run_second_algo(messages.append, 0, 0, robot, bus, worker, client)
+        duration = time.perf_counter() - started
+    finally:
+        bus.stop()
+        worker.stop()
+        client.close()
+        eval_server.stop()
+    x, y, _ = robot.pose()
+    stats = robot.stats()
+    phases = {key.split('"')[1]: value["avg"] for key, value in metrics.snapshot().items() if key.startswith("auto_phase_seconds")}
+    return {
+        "duration": duration,
+        "captures": len(eval_server.validated),
+        "home_error": hypot(x, y),
+        "turns": stats["turns"],
+        "arcs": stats["arcs"],
+        "rotation": stats["rotation"],
+        "distance": stats["distance"],
+        "frames": camera.frames,
+        "detection": {mode: metrics.histogram("detect_markers_seconds", where="worker", mode=mode).summary() for mode in (MODE_FULL, MODE_ROI)},
+        "tracking": worker.stats()["tracking"],
+        "phases": phases,
+    }
+
+
+async def _stream_client(port,deadline,latencies,commands,protocol):
+    async with websockets.connect(f"ws://127.0.0.1:{port}") as ws:
+        await ws.send(json.dumps({"type": "key", "value": "1234", "protocol": protocol}))
+        frames = 0
+        seq = 0
+        next_command = time.monotonic()
+        while time.monotonic() < deadline:
+            if commands and time.monotonic() >= next_command:
+                # joystick à 20 Hz pour charger le chemin des commandes en même temps
+                if protocol == PROTOCOL_BINARY:
+                    seq += 1
+                    await ws.send(encode_command(seq, 45, 50, 0.3, 0.3))
+                else:
+                    await ws.send(json.dumps({"type": "command", "angle": 45, "distance": 50, "x": 0.3, "y": 0.3, "mode": 1}))
+                next_command += 0.05
+            try:
+                message = await asyncio.wait_for(ws.recv(), 0.05)
+            except asyncio.TimeoutError:
+                continue
+            if isinstance(message, bytes) and message[0] == remake.FRAME_KIND_JPEG:
+                kind, frame_seq, timestamp, size = remake.FRAME_HEADER.unpack_from(message)
+                latencies.append(time.time() - timestamp)
+                frames += 1
+        return frames
+
+
+async def _run_clients(port,clients,duration,protocol):
+    deadline = time.monotonic() + duration
+    latencies = []
+    frames = await asyncio.gather(*[_stream_client(port, deadline, latencies, (i == 0), protocol) for i in range(clients)])
+    async with websockets.connect(f"ws://127.0.0.1:{port}") as ws:
+        await ws.send(json.dumps({"type": "key", "value": "1234"}))
+        await ws.send(json.dumps({"type": "stop_server"}))
+        await ws.wait_closed()
+    return frames, latencies
+
+
+def bench_fanout(clients,duration,time_scale,protocol=PROTOCOL_JSON):
+    '''
+        Mesure le débit et la latence du flux caméra reçu par plusieurs clients
+    '''
+    robot = SimulatedRobot(time_scale=time_scale)
+    camera = SimulatedCamera(robot)
+    bus = FrameBus(camera.get_camera_frame)
+    server = remake.Server()
+    session = server.add_session(remake.RobotSession(remake.DEFAULT_ROBOT, robot, bus))
+    bus.subscribe(session.on_frame)
+    bus.start()
+    server.start()
+    port = _free_port()
+    thread = threading.Thread(target=remake.websocket_server_thread, args=(server, "127.0.0.1", port), daemon=True)
+    thread.start()
+    while server.loop is None:
+        time.sleep(0.01)
+    try:
+        frames, latencies = asyncio.run(_run_clients(port, clients, duration, protocol))
+    finally:
+        server.stop_event.set()
+        thread.join(timeout=5)
+        bus.stop()
+        server.shutdown()
+        server.eval_client.close()
+    command = metrics.histogram("motor_command_latency_seconds")
+    return {
+        "clients": clients,
+        "protocol": protocol,
+        "frames": sum(frames),
+        "fps": sum(frames) / clients / duration,
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_max": max(latencies, default=0.0),
+        "command_latency_p95": command.quantile(0.95),
+    }
+
+
+def _lookup(results,key):
+    value = results
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results,history,threshold=THRESHOLD,window=WINDOW):
+    '''
+        Compare les mesures suivies à la médiane des window dernières exécutions
+
+        retourne la liste des régressions (STRING)
+    '''
+    regressions = []
+    for key, better in TRACKED.items():
+        value = _lookup(results, key)
+        previous = [v for v in (_lookup(entry["results"], key) for entry in history[-window:]) if v is not None]
+        if value is None or not previous:
+            continue
+        baseline = median(previous)
+        if better == "lower":
+            worse = value > baseline * (1 + threshold)
+        else:
+            worse = value < baseline * (1 - threshold)
+        if worse:
+            regressions.append(f"{key}: {value:.4g} (baseline {baseline:.4g}, {better} is better)")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hardware-free benchmarks on the simulated robot and camera")
+    parser.add_argument("--only", choices=("course", "fanout"), help="run a single benchmark")
+    parser.add_argument("--clients", type=int, default=4, help="WebSocket clients for the fan-out benchmark")
+    parser.add_argument("--protocol", choices=(PROTOCOL_JSON, PROTOCOL_BINARY), default=PROTOCOL_JSON, help="control protocol of the fan-out clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="fan-out measurement duration (s)")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="simulated motion time factor")
+    parser.add_argument("--detect-cost", type=float, default=0.02, help="simulated marker detection time (s)")
+    parser.add_argument("--history", default=HISTORY_FILE, help="JSON lines file with previous results")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="tolerated relative regression")
+    parser.add_argument("--window", type=int, default=WINDOW, help="previous runs used as baseline")
+    parser.add_argument("--no-record", action="store_true", help="do not append this run to the history")
+    args = parser.parse_args(argv)
+
+    settings = {"clients": args.clients, "protocol": args.protocol, "duration": args.duration, "time_scale": args.time_scale, "detect_cost": args.detect_cost}
+    results = {}
+    if args.only in (None, "course"):
+        results["course"] = bench_course(args.time_scale, args.detect_cost)
+    if args.only in (None, "fanout"):
+        results["fanout"] = bench_fanout(args.clients, args.duration, args.time_scale, args.protocol)
+    print(json.dumps(results, indent=2))
+
+    history = [entry for entry in load_history(args.history) if entry.get("settings") == settings]
+    regressions = compare(results, history, args.threshold, args.window)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+
+    if not args.no_record:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "settings": settings,
+            "results": results,
+        }
+        with open(args.history, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+'''
+Détection des balises ArUco sur les images du FrameBus
+
+La détection est mémorisée par numéro de séquence d'image : tous les appelants
+qui interrogent la même image partagent un seul passage de camera.detect_markers.
+DetectionWorker déporte ce calcul dans un processus séparé pour ne plus prendre
+le GIL aux threads de contrôle.
+
+Pendant qu'on se centre sur une balise ou qu'on s'en approche, le DetectionWorker peut la
+suivre (MarkerTracker) : les images suivantes ne sont examinées que dans une zone autour de
+sa position attendue, à résolution réduite quand elle est assez grande, et l'image entière
+n'est reprise que si la balise est perdue. Le processus de détection découpe lui-même la
+bande de l'image, la passe au détecteur habituel puis ramène les mesures dans le repère de
+l'image entière (to_frame), en supposant, comme camera.detect_markers, un angle mesuré
+depuis le centre de l'image reçue avec la focale de la caméra et une distance tirée de la
+taille apparente. Chaque MarkerEvent indique le mode (MODE_FULL ou MODE_ROI) qui l'a produit.
+'''
+import time
+import threading
+import logging
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from collections import OrderedDict, namedtuple, Counter
+from math import atan, tan, degrees, radians
+import numpy as np
+import cv2
+import metrics
+from log_config import LOG_FORMAT, DATE_FORMAT, paused
+
+logger = logging.getLogger(__name__)
+
+
+def _default_detector():
+    import beacon_detection.camera_Api as camera  # matériel : importé seulement s'il sert
+    return camera.detect_markers
+
+DETECTION_CACHE_SIZE = 8
+WORKER_SLOTS = 2  # images en mémoire partagée : une en cours de détection, une prête
+
+MODE_FULL = "full"  # image entière
+MODE_ROI = "roi"    # zone autour de la balise suivie
+
+CAMERA_FOV = 62.0         # champ horizontal de la caméra (degrés)
+MARKER_SIZE = 10.0        # côté d'une balise (cm)
+TRACK_WINDOW = 6.0        # déplacement toléré de la balise d'une image à l'autre (degrés)
+TRACK_MARGIN = 1.5        # largeur de la zone, en tailles apparentes de la balise
+TRACK_SCALE = 0.5         # réduction de la zone quand la balise y reste assez grande
+TRACK_MIN_PIXELS = 24     # taille apparente minimale de la balise après réduction (px)
+TRACK_MAX_FRACTION = 0.6  # au-delà de cette part des pixels de l'image, autant prendre l'image entière
+TRACK_LOST_AFTER = 2      # images sans la balise dans la zone avant de repasser en image entière
+
+# Résultat publié par le DetectionWorker pour une image du bus
+MarkerEvent = namedtuple("MarkerEvent", "seq timestamp detected_at markers mode")
+# Zone examinée : colonnes [x0, x1[ sur toute la hauteur, réduites d'un facteur scale
+# (bornes paires, pour qu'une réduction de moitié regroupe des paires de colonnes de l'image)
+Region = namedtuple("Region", "x0 x1 scale")
+
+DETECT_INLINE = metrics.histogram("detect_markers_seconds", "camera.detect_markers duration", where="inline")
+DETECT_WORKER = {mode: metrics.histogram("detect_markers_seconds", "camera.detect_markers duration", where="worker", mode=mode) for mode in (MODE_FULL, MODE_ROI)}
+DETECT_DELAY = metrics.histogram("detection_delay_seconds", "Frame capture to marker event published")
+
+
+class DetectionCache():
+    '''
+        Cache borné (LRU) des résultats de détection, indexé par Frame.seq
+
+        arguments
+            detector:  fonction de détection appelée sur l'image brute (camera.detect_markers par défaut)
+            maxsize:  nombre maximal d'images gardées en cache INT
+    '''
+    def __init__(self,detector=None,maxsize=DETECTION_CACHE_SIZE):
+        self.detector = detector if detector is not None else _default_detector()
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._detect_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self,seq):
+        with self._lock:
+            if seq in self._results:
+                self._results.move_to_end(seq)
+                self.hits += 1
+                return True, self._results[seq]
+        return False, None
+
+    def detect(self,frame):
+        '''
+            Renvoie les balises visibles sur l'image, en ne lançant la détection
+            qu'une fois par image
+
+            arguments
+                frame:  image publiée par le FrameBus (Frame)
+
+            output : liste de dictionnaires renvoyés par camera.detect_markers
+        '''
+        found, markers = self._lookup(frame.seq)
+        if found:
+            return markers
+        # Un seul calcul à la fois : un second appelant sur la même image attend puis lit le cache
+        with self._detect_lock:
+            found, markers = self._lookup(frame.seq)
+            if found:
+                return markers
+            started = time.perf_counter()
+            markers = self.detector(frame.raw) or []
+            DETECT_INLINE.observe(time.perf_counter() - started)
+            with self._lock:
+                self.misses += 1
+                self._results[frame.seq] = markers
+                while len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+                    self.evictions += 1
+        return markers
+
+    def store(self,seq,markers):
+        '''
+            Enregistre un résultat calculé ailleurs (par le DetectionWorker)
+        '''
+        with self._lock:
+            self._results[seq] = markers
+            self._results.move_to_end(seq)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._results),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def focal(width,fov=CAMERA_FOV):
+    '''
+        Focale en pixels d'une image de width colonnes couvrant fov degrés
+    '''
+    return width / 2 / tan(radians(fov) / 2)
+
+
+def column(angle,width,fov=CAMERA_FOV):
+    '''
+        Colonne (px) où apparaît une direction horizontal_angle (degrés, positif vers la droite)
+    '''
+    return width / 2 + focal(width, fov) * tan(radians(max(-89.0, min(89.0, angle))))
+
+
+def crop(raw,region):
+    '''
+        Bande de l'image à passer au détecteur : colonnes de la zone, réduites de region.scale
+    '''
+    band = raw[:, region.x0:region.x1]
+    if region.scale == 1.0:
+        return np.ascontiguousarray(band)
+    return cv2.resize(band, None, fx=region.scale, fy=region.scale, interpolation=cv2.INTER_AREA)
+
+
+def to_frame(markers,region,width,fov=CAMERA_FOV):
+    '''
+        Mesures faites sur la bande de region -> mesures dans l'image entière de width colonnes
+
+        Le détecteur mesure l'angle depuis le centre de la bande avec la focale de l'image
+        entière, et la distance d'après une taille apparente réduite de region.scale.
+    '''
+    f = focal(width, fov)
+    s = region.scale
+    result = []
+    for m in markers:
+        u = region.x0 + ((region.x1 - region.x0) * s / 2 + f * tan(radians(m["horizontal_angle"]))) / s
+        m = dict(m, horizontal_angle=degrees(atan((u - width / 2) / f)), distance=m["distance"] * s)
+        if "corners" in m:
+            m["corners"] = [(x / s + region.x0, y / s) for x, y in m["corners"]]
+        result.append(m)
+    return result
+
+
+def to_region(markers,region,width,fov=CAMERA_FOV):
+    '''
+        Inverse de to_frame : ce qu'un détecteur verrait des balises markers (mesurées sur
+        l'image entière) dans la bande de region. Sert aux caméras simulées et rejouées.
+    '''
+    f = focal(width, fov)
+    s = region.scale
+    result = []
+    for m in markers:
+        u = column(m["horizontal_angle"], width, fov)
+        if not region.x0 <= u < region.x1:
+            continue
+        u_band = (u - region.x0) * s - (region.x1 - region.x0) * s / 2
+        result.append(dict(m, horizontal_angle=degrees(atan(u_band / f)), distance=m["distance"] / s))
+    return result
+
+
+class MarkerTracker():
+    '''
+        Suivi d'une balise d'une image à l'autre, pour le DetectionWorker
+
+        La zone attendue est centrée sur le dernier angle observé de la balise (corrigé des
+        rotations du robot), assez large pour la balise et son déplacement entre deux images.
+
+        arguments
+            fov:  champ horizontal de la caméra en degrés FLOAT
+    '''
+    def __init__(self,fov=CAMERA_FOV):
+        self.fov = fov
+        self._lock = threading.Lock()
+        self.target = None   # id de la balise suivie
+        self.last = None     # dernière observation de la balise (dictionnaire), None si perdue
+        self.misses = 0
+        self.frames = Counter()
+        self.lost = 0
+
+    def follow(self,marker):
+        '''
+            Suit la balise marker (dictionnaire renvoyé par la détection) à partir de l'image suivante
+        '''
+        with self._lock:
+            self.target = marker["id"]
+            self.last = marker
+            self.misses = 0
+
+    def stop(self):
+        with self._lock:
+            self.target = None
+            self.last = None
+
+    def rotate(self,angle):
+        '''
+            Le robot a tourné de angle (rad, sens trigonométrique) : la balise se décale d'autant dans l'image
+        '''
+        with self._lock:
+            if self.last is not None:
+                self.last = dict(self.last, horizontal_angle=self.last["horizontal_angle"] + degrees(angle))
+
+    def region(self,width):
+        '''
+            Zone à examiner dans une image de width colonnes
+
+            retourne une Region, ou None pour examiner l'image entière
+        '''
+        with self._lock:
+            last = self.last
+        if last is None:
+            return None
+        size = 2 * degrees(atan(MARKER_SIZE / 2 / max(last["distance"], 1.0)))  # taille apparente (degrés)
+        half = TRACK_WINDOW + TRACK_MARGIN * size
+        x0 = max(0, int(column(last["horizontal_angle"] - half, width, self.fov)) // 2 * 2)
+        x1 = min(width // 2 * 2, (int(column(last["horizontal_angle"] + half, width, self.fov)) + 2) // 2 * 2)
+        pixels = focal(width, self.fov) * MARKER_SIZE / max(last["distance"], 1.0)  # taille apparente (px)
+        scale = TRACK_SCALE if pixels * TRACK_SCALE >= TRACK_MIN_PIXELS else 1.0
+        if x1 - x0 <= 0 or (x1 - x0) / width * scale ** 2 > TRACK_MAX_FRACTION:
+            return None
+        return Region(x0, x1, scale)
+
+    def update(self,markers,mode):
+        '''
+            Résultat d'une détection : la balise suivie est recentrée, ou comptée manquante
+        '''
+        with self._lock:
+            self.frames[mode] += 1
+            if self.target is None:
+                return
+            found = [m for m in markers if m["id"] == self.target]
+            if found:
+                self.last = found[0]
+                self.misses = 0
+            elif mode == MODE_ROI and self.last is not None:
+                self.misses += 1
+                if self.misses >= TRACK_LOST_AFTER:
+                    logger.info("Marker %s lost in tracking region - back to full frame", self.target)
+                    self.last = None
+                    self.lost += 1
+
+    def stats(self):
+        with self._lock:
+            return {"target": self.target, "tracking": self.last is not None, "frames": dict(self.frames), "lost": self.lost}
+
+
+def _worker_main(tasks,results,detector):
+    '''
+        Boucle du processus de détection : lit l'image dans la mémoire partagée
+        sans la copier, détecte les balises et renvoie le résultat
+    '''
+    # le thread d'écriture des logs du parent n'existe pas dans ce processus
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    logging.getLogger().handlers[:] = [handler]
+    blocks = {}  # slot -> bloc attaché ; le parent remplace le bloc d'un slot devenu trop petit
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, seq, timestamp, name, shape, dtype, region = task
+            block = blocks.get(slot)
+            if block is None or block.name != name:
+                if block is not None:
+                    block.close()  # ancien bloc du slot, déjà libéré par le parent
+                block = blocks[slot] = shared_memory.SharedMemory(name=name)
+                # le bloc appartient au processus parent, qui se charge de le libérer
+                resource_tracker.unregister(block._name, "shared_memory")
+            view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            started = time.perf_counter()
+            try:
+                if region is None:
+                    markers = detector(view) or []
+                else:
+                    region = Region(*region)
+                    markers = to_frame(detector(crop(view, region)) or [], region, shape[1])
+            except Exception as e:
+                markers = []
+                logger.error(f"Marker detection failed in worker for frame {seq}: {e}")
+            duration = time.perf_counter() - started
+            del view
+            results.put((slot, seq, timestamp, time.time(), duration, markers, MODE_FULL if region is None else MODE_ROI))
+    finally:
+        for block in blocks.values():
+            block.close()
+
+
+class DetectionWorker():
+    '''
+        Détection des balises dans un processus séparé
+
+        Les images sont recopiées une fois dans des blocs de mémoire partagée ; le processus
+        les lit directement, sans sérialisation. Les résultats reviennent sous forme de
+        MarkerEvent horodatés, transmis aux abonnés depuis un thread de réception.
+        Si tous les blocs sont occupés, l'image est ignorée : le processus travaille
+        toujours sur l'image la plus récente possible. tracker suit la balise demandée
+        par track() en ne faisant examiner qu'une bande de l'image.
+
+        arguments
+            detector:  fonction de détection exécutée dans le processus (camera.detect_markers par défaut)
+            slots:  nombre de blocs de mémoire partagée INT
+    '''
+    def __init__(self,detector=None,slots=WORKER_SLOTS):
+        self.detector = detector if detector is not None else _default_detector()
+        self.slots = slots
+        self.subscribers = []
+        self.cache = DetectionCache(self.detector)
+        self.tracker = MarkerTracker()
+        self.frames_submitted = 0
+        self.frames_skipped = 0
+        self._lock = threading.Lock()
+        self._blocks = [None] * slots
+        self._free = list(range(slots))
+        self._process = None
+        self._reader = None
+        # "fork" évite de réimporter l'API caméra dans le processus fils
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+
+    def start(self):
+        '''
+            Lance le processus : à appeler avant de démarrer les autres threads
+        '''
+        if self._process is not None:
+            return
+        self._process = self._context.Process(target=_worker_main, args=(self._tasks, self._results, self.detector), daemon=True)
+        with paused():  # pas de thread d'écriture des logs pendant le fork
+            self._process.start()
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+        logger.info(f"Detection worker started - pid: {self._process.pid}")
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._tasks.put(None)
+        self._process.join(timeout=2)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._results.put(None)
+        self._process = None
+        for block in self._blocks:
+            if block is not None:
+                block.close()
+                block.unlink()
+        self._blocks = [None] * self.slots
+        logger.info("Detection worker stopped")
+
+    def subscribe(self,callback):
+        '''
+            Appelle callback(event) pour chaque MarkerEvent, depuis le thread de réception
+        '''
+        with self._lock:
+            self.subscribers = self.subscribers + [callback]
+        return callback
+
+    def unsubscribe(self,callback):
+        with self._lock:
+            self.subscribers = [s for s in self.subscribers if s is not callback]
+
+    def track(self,marker):
+        '''
+            Suit la balise marker sur les images suivantes
+
+            arguments
+                marker:  balise renvoyée par la détection, None pour arrêter le suivi
+        '''
+        if marker is None:
+            self.tracker.stop()
+        else:
+            self.tracker.follow(marker)
+
+    def submit(self,frame):
+        '''
+            Abonné du FrameBus : confie l'image au processus si un bloc est libre
+
+            arguments
+                frame:  image publiée par le bus (Frame)
+        '''
+        if self._process is None:
+            return False
+        raw = np.ascontiguousarray(frame.raw)
+        with self._lock:
+            if not self._free:
+                self.frames_skipped += 1
+                return False
+            slot = self._free.pop()
+        block = self._blocks[slot]
+        if block is None or block.size < raw.nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=raw.nbytes)
+            self._blocks[slot] = block
+        np.ndarray(raw.shape, dtype=raw.dtype, buffer=block.buf)[...] = raw
+        self.frames_submitted += 1
+        region = self.tracker.region(raw.shape[1])
+        self._tasks.put((slot, frame.seq, frame.timestamp, block.name, raw.shape, raw.dtype.str, tuple(region) if region is not None else None))
+        return True
+
+    def _read_results(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            slot, seq, timestamp, detected_at, duration, markers, mode = result
+            # les mesures du processus fils sont enregistrées ici, côté parent
+            DETECT_WORKER[mode].observe(duration)
+            DETECT_DELAY.observe(max(0.0, detected_at - timestamp))
+            with self._lock:
+                self._free.append(slot)
+                subscribers = self.subscribers
+            self.tracker.update(markers, mode)
+            if mode == MODE_FULL:
+                self.cache.store(seq, markers)  # une zone ne dit rien des balises hors de la zone
+            event = MarkerEvent(seq, timestamp, detected_at, markers, mode)
+            for callback in subscribers:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"Marker event subscriber {callback} failed: {e}", exc_info=True)
+
+    def stats(self):
+        return {
+            "frames_submitted": self.frames_submitted,
+            "frames_skipped": self.frames_skipped,
+            "tracking": self.tracker.stats(),
+        }
@@ -0,0 +1,385 @@
+'''
+Pilotage des moteurs en mode manuel
+
+Les commandes joystick ne touchent jamais le matériel depuis la boucle asyncio :
+elles sont déposées dans un emplacement par robot (seule la dernière consigne compte)
+qu'un thread commun à tous les robots applique, au plus CONTROL_RATE fois par seconde.
+DeadmanWatchdog arrête le robot quand plus aucune commande n'arrive.
+'''
+import threading
+import time
+import logging
+import metrics
+from log_config import HOT
+
+logger = logging.getLogger(__name__)
+
+CONTROL_RATE = 50.0  # consignes appliquées par seconde au maximum
+DEADMAN_TIMEOUT = 5.0  # arrêt du robot après ce délai sans commande (s)
+DEFAULT_ROBOT = "default"  # nom du robot quand le processus n'en pilote qu'un
+
+COMMAND_LATENCY = metrics.histogram("motor_command_latency_seconds", "Joystick command to move_custom/stop applied")
+
+
+class _Motors():
+    '''
+        Moteurs d'un robot du MotorDispatcher : consigne en attente et statistiques
+
+        Sert aussi de poignée à la session du robot (move, stop, stats sans nom de robot).
+    '''
+    def __init__(self,dispatcher,name,robot):
+        self.dispatcher = dispatcher
+        self.name = name
+        self.robot = robot
+        self.slot = None    # (mouvement, instant de dépôt)
+        self.stop_at = None # instant de dépôt d'un arrêt pas encore appliqué
+        self.next_at = 0.0  # prochaine application possible d'un mouvement
+        self.submitted = 0
+        self.applied = 0
+        self.coalesced = 0  # consignes remplacées avant d'avoir été appliquées
+        self.failures = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_latency = 0.0
+
+    def move(self,mg,md):
+        self.dispatcher.move(mg, md, self.name)
+
+    def stop(self):
+        self.dispatcher.stop(self.name)
+
+    def stats(self):
+        return self.dispatcher.stats(self.name)
+
+
+class MotorDispatcher():
+    '''
+        Applique à chaque robot sa consigne la plus récente, depuis un seul thread
+
+        Une rafale de commandes reçue entre deux applications est fusionnée : seule la
+        dernière est envoyée aux moteurs. Un arrêt est appliqué sans attendre la période
+        et n'est jamais remplacé : un mouvement qui le suit part après lui. Le même thread pilote tous les robots (attach), chacun avec sa propre période ;
+        robot, s'il est fourni, est attaché sous le nom DEFAULT_ROBOT.
+
+        arguments
+            robot:  robot à piloter (move_custom, stop)
+            rate:  nombre maximal de consignes appliquées par seconde et par robot FLOAT
+    '''
+    def __init__(self,robot=None,rate=CONTROL_RATE):
+        self.period = 1.0 / rate
+        self._condition = threading.Condition()
+        self._motors = {}  # robot -> _Motors
+        self._stopped = False
+        self._thread = None
+        if robot is not None:
+            self.attach(DEFAULT_ROBOT, robot)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def attach(self,name,robot):
+        '''
+            Pilote un robot de plus
+
+            arguments
+                name:  nom du robot STRING
+                robot:  robot à piloter (move_custom, stop)
+
+            retourne la poignée des moteurs de ce robot (_Motors)
+        '''
+        with self._condition:
+            motors = self._motors[name] = _Motors(self, name, robot)
+            return motors
+
+    def detach(self,name):
+        with self._condition:
+            self._motors.pop(name, None)
+
+    def move(self,mg,md,robot=DEFAULT_ROBOT):
+        '''
+            Consigne de vitesse des roues gauche (mg) et droite (md)
+        '''
+        self._submit(robot, ("move", mg, md))
+
+    def stop(self,robot=DEFAULT_ROBOT):
+        '''
+            Arrêt du robot, appliqué dès que possible
+        '''
+        self._submit(robot, ("stop",))
+
+    def _submit(self,robot,command):
+        with self._condition:
+            motors = self._motors[robot]
+            now = time.monotonic()
+            if motors.slot is not None:
+                motors.coalesced += 1
+                motors.slot = None
+            if command[0] == "stop":
+                if motors.stop_at is not None:
+                    motors.coalesced += 1
+                else:
+                    motors.stop_at = now
+            else:
+                motors.slot = (command, now)
+            motors.submitted += 1
+            self._condition.notify()
+
+    def _ready(self,now):
+        '''
+            Consignes à appliquer maintenant, et délai avant la suivante ; sous self._condition
+        '''
+        ready = []
+        wait = None
+        for motors in self._motors.values():
+            if motors.stop_at is not None:
+                ready.append((motors, (("stop",), motors.stop_at)))
+                motors.stop_at = None
+                continue  # un mouvement déposé après l'arrêt attend la période suivante
+            if motors.slot is None:
+                continue
+            # laisse les commandes suivantes remplacer celle-ci jusqu'à la prochaine période
+            if now >= motors.next_at:
+                ready.append((motors, motors.slot))
+                motors.slot = None
+            else:
+                wait = min(wait, motors.next_at - now) if wait is not None else motors.next_at - now
+        return ready, wait
+
+    def run(self):
+        logger.info(f"Motor dispatcher started - rate: {1.0 / self.period:.0f} Hz per robot")
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    ready, wait = self._ready(time.monotonic())
+                    if ready:
+                        break
+                    self._condition.wait(wait)
+                if self._stopped:
+                    break
+            for motors, (command, submitted_at) in ready:
+                self.apply(motors, command, submitted_at)
+                motors.next_at = time.monotonic() + self.period
+        stats = {name: self.stats(name) for name in list(self._motors)}
+        logger.info(f"Motor dispatcher stopped - stats: {stats}")
+
+    def apply(self,motors,command,submitted_at):
+        try:
+            if command[0] == "move":
+                motors.robot.move_custom(command[1], command[2])
+            else:
+                motors.robot.stop()
+        except Exception as e:
+            motors.failures += 1
+            logger.error(f"Motor command {command} failed for robot {motors.name}: {e}", exc_info=True)
+            return
+        latency = time.monotonic() - submitted_at
+        motors.applied += 1
+        motors.last_latency = latency
+        motors.latency_total += latency
+        motors.latency_max = max(motors.latency_max, latency)
+        COMMAND_LATENCY.observe(latency)
+        logger.debug("Motor command %s applied to %s - latency: %.1f ms", command, motors.name, latency * 1000, extra=HOT)
+
+    def stats(self,robot=DEFAULT_ROBOT):
+        motors = self._motors[robot]
+        return {
+            "submitted": motors.submitted,
+            "applied": motors.applied,
+            "coalesced": motors.coalesced,
+            "failures": motors.failures,
+            "latency_avg": motors.latency_total / motors.applied if motors.applied else 0.0,
+            "latency_max": motors.latency_max,
+            "latency_last": motors.last_latency,
+        }
+
+
+class _Watch():
+    '''
+        État de surveillance d'un robot du DeadmanWatchdog
+    '''
+    def __init__(self,stop,on_trip):
+        self.stop = stop
+        self.on_trip = on_trip
+        self.last_command = {}  # client -> instant de sa dernière commande
+        self.armed = False
+        self.trips = 0
+        self.last_trip = None
+
+    def deadline(self,timeout):
+        return max(self.last_command.values(), default=0.0) + timeout
+
+
+class DeadmanWatchdog():
+    '''
+        Homme mort : arrête le robot si aucune commande n'a été reçue depuis timeout secondes
+
+        Un seul thread attend l'échéance ; chaque commande ne fait que noter l'heure.
+        Avec plusieurs clients, le robot continue tant que l'un d'eux envoie des commandes ;
+        la déconnexion du dernier client actif déclenche l'arrêt immédiatement.
+        Après un déclenchement, la surveillance reprend à la commande suivante.
+
+        Le même thread peut surveiller plusieurs robots (watch), chacun avec ses clients,
+        son échéance et sa fonction d'arrêt ; stop, s'il est fourni, est celle de DEFAULT_ROBOT.
+
+        arguments
+            stop:  fonction qui arrête le robot
+            timeout:  délai sans commande avant l'arrêt en secondes FLOAT
+            on_trip:  fonction appelée avec un DICTIONNAIRE décrivant chaque déclenchement
+    '''
+    def __init__(self,stop=None,timeout=DEADMAN_TIMEOUT,on_trip=None):
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._watches = {}  # robot -> _Watch
+        self._stopped = False
+        self._thread = None
+        if stop is not None:
+            self.watch(DEFAULT_ROBOT, stop, on_trip)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def watch(self,robot,stop,on_trip=None):
+        '''
+            Surveille un robot de plus
+
+            arguments
+                robot:  nom du robot STRING
+                stop:  fonction qui arrête ce robot
+                on_trip:  fonction appelée avec un DICTIONNAIRE décrivant chaque déclenchement
+        '''
+        with self._condition:
+            self._watches[robot] = _Watch(stop, on_trip)
+
+    def unwatch(self,robot):
+        with self._condition:
+            self._watches.pop(robot, None)
+            self._condition.notify_all()
+
+    def feed(self,client,moving=True,robot=DEFAULT_ROBOT):
+        '''
+            Note une commande reçue du client
+
+            arguments
+                client:  identifiant du client
+                moving:  False pour une commande d'arrêt (joystick au neutre) BOOL
+                robot:  nom du robot commandé STRING
+        '''
+        with self._condition:
+            watch = self._watches[robot]
+            if not moving:
+                # le robot est déjà à l'arrêt : plus rien à surveiller pour ce client
+                watch.last_command.pop(client, None)
+                if not watch.last_command:
+                    watch.armed = False
+                return
+            watch.last_command[client] = time.monotonic()
+            if not watch.armed:
+                watch.armed = True
+                self._condition.notify_all()
+
+    def forget(self,client,robot=DEFAULT_ROBOT):
+        '''
+            Oublie un client déconnecté ; s'il était le seul actif, l'arrêt est immédiat
+        '''
+        event = None
+        with self._condition:
+            watch = self._watches.get(robot)
+            last = watch.last_command.pop(client, None) if watch is not None else None
+            if last is not None and watch.armed:
+                now = time.monotonic()
+                if not any(now - t < self.timeout for t in watch.last_command.values()):
+                    event = self._trip(watch, now - last, "disconnect")
+                    self._condition.notify_all()
+        if event is not None:
+            self._fire(robot, watch, event)
+
+    def _trip(self,watch,idle,reason):
+        '''
+            Désarme un robot et décrit le déclenchement ; appelé sous self._condition
+
+            arguments
+                watch:  robot surveillé (_Watch)
+                idle:  temps écoulé depuis la dernière commande en secondes FLOAT
+                reason:  "timeout" ou "disconnect" STRING
+
+            retourne le DICTIONNAIRE passé à on_trip
+        '''
+        watch.armed = False
+        watch.last_command.clear()
+        watch.trips += 1
+        event = {"reason": reason, "idle": idle, "timeout": self.timeout, "trips": watch.trips, "time": time.time()}
+        watch.last_trip = event
+        return event
+
+    def _fire(self,robot,watch,event):
+        '''
+            Arrête le robot et prévient on_trip, hors du verrou
+        '''
+        if event["reason"] == "disconnect":
+            logger.warning(f"Deadman watchdog tripped - last active client disconnected after {event['idle']:.1f}s idle, stopping robot {robot}")
+        else:
+            logger.warning(f"Deadman watchdog tripped - no command for {event['idle']:.1f}s, stopping robot {robot}")
+        try:
+            watch.stop()
+        except Exception as e:
+            logger.error(f"Deadman watchdog failed to stop robot {robot}: {e}", exc_info=True)
+        if watch.on_trip is not None:
+            watch.on_trip(event)
+
+    def _next_deadline(self):
+        return min((w.deadline(self.timeout) for w in self._watches.values() if w.armed), default=None)
+
+    def run(self):
+        logger.info(f"Deadman watchdog started - timeout: {self.timeout}s")
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    deadline = self._next_deadline()
+                    if deadline is None:
+                        self._condition.wait()
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopped:
+                    break
+                now = time.monotonic()
+                tripped = []
+                for robot, watch in self._watches.items():
+                    if not watch.armed or watch.deadline(self.timeout) > now:
+                        continue
+                    idle = now - max(watch.last_command.values(), default=now)
+                    tripped.append((robot, watch, self._trip(watch, idle, "timeout")))
+            for robot, watch, event in tripped:
+                self._fire(robot, watch, event)
+        logger.info("Deadman watchdog stopped")
+
+    def stats(self,robot=DEFAULT_ROBOT):
+        with self._condition:
+            watch = self._watches[robot]
+            return {
+                "armed": watch.armed,
+                "timeout": self.timeout,
+                "clients": len(watch.last_command),
+                "trips": watch.trips,
+                "last_trip": watch.last_trip,
+            }
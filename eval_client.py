@@ -0,0 +1,299 @@
+'''
+Client du serveur d'évaluation (http://proj103.r2.enst.fr/api)
+
+Toutes les requêtes passent par une seule session HTTP (connexions gardées
+ouvertes et réutilisées) et sont envoyées par un petit pool de threads :
+chaque appel renvoie immédiatement un Future, l'appelant n'attend la réponse
+que s'il en a besoin. LocalEvalServer imite le serveur d'évaluation en local.
+'''
+import json
+import threading
+import time
+import logging
+from math import dist
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EVAL_SERVER_URL = "http://proj103.r2.enst.fr/api"
+REQUEST_TIMEOUT = (2.0, 5.0)  # (connexion, lecture) en secondes
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.2           # 0.2 s, 0.4 s, ... entre deux essais
+POOL_SIZE = 4
+POSITION_PERIOD = 1.0       # période d'envoi de la position (s)
+POSITION_MIN_REFRESH = 5.0  # une position inchangée est tout de même renvoyée après ce délai (s)
+POSITION_EPSILON = 0.5      # déplacement en dessous duquel la position est considérée inchangée (cm)
+
+
+class EvalClient():
+    '''
+        Client à connexions persistantes pour le serveur d'évaluation
+
+        Les erreurs de connexion sont réessayées pour toutes les requêtes. Les GET sont
+        aussi réessayés sur délai de lecture dépassé ou 502/504 ; un POST déjà reçu par
+        le serveur n'est jamais renvoyé (valider deux fois une balise n'est pas neutre).
+
+        arguments
+            base_url:  adresse de l'API STRING
+            timeout:  délai (connexion, lecture) en secondes
+            retries:  nombre maximal de nouveaux essais INT
+            backoff:  facteur d'attente exponentielle entre essais FLOAT
+            workers:  nombre de requêtes envoyées en parallèle INT
+    '''
+    def __init__(self,base_url=EVAL_SERVER_URL,timeout=REQUEST_TIMEOUT,retries=MAX_RETRIES,backoff=RETRY_BACKOFF,workers=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval-client")
+
+    def request(self,method,path,params=None):
+        '''
+            Envoie la requête et attend la réponse (requests.Response)
+        '''
+        with metrics.timed("eval_request_seconds", "Evaluation server round trip", method=method, path=path):
+            return self.session.request(method, f"{self.base_url}{path}", params=params, timeout=self.timeout)
+
+    def submit(self,method,path,params=None):
+        '''
+            Envoie la requête en arrière-plan
+
+            retourne un Future dont le résultat est la requests.Response
+        '''
+        return self.executor.submit(self.request, method, path, params)
+
+    def post_position(self,x,y):
+        '''
+            Position du robot en cm
+        '''
+        return self.submit("POST", "/pos", {"x": x, "y": y})
+
+    def post_marker(self,marker_id,sector,inner):
+        return self.submit("POST", "/marker", {"id": marker_id, "sector": sector, "inner": 1 if inner else 0})
+
+    def get_status(self):
+        return self.submit("GET", "/status")
+
+    def get_list(self):
+        return self.submit("GET", "/list")
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+class PositionReporter():
+    '''
+        Envoi périodique de la position au serveur d'évaluation
+
+        Les échéances sont calculées à partir de l'horloge monotone (période fixe, sans
+        dérive) et l'envoi ne bloque jamais la boucle : si la requête précédente est encore
+        en cours, la position est simplement envoyée à l'échéance suivante. Une position qui
+        n'a pas bougé de plus de epsilon n'est renvoyée qu'après min_refresh secondes.
+
+        arguments
+            client:  EvalClient utilisé pour l'envoi
+            get_position:  fonction renvoyant la position (x, y) en cm
+            running:  fonction indiquant si l'envoi doit continuer (toujours vrai par défaut)
+            period:  période d'envoi en secondes FLOAT
+            min_refresh:  délai maximal entre deux envois en secondes FLOAT
+            epsilon:  seuil de changement de position en cm FLOAT
+    '''
+    def __init__(self,client,get_position,running=None,period=POSITION_PERIOD,min_refresh=POSITION_MIN_REFRESH,epsilon=POSITION_EPSILON):
+        self.client = client
+        self.get_position = get_position
+        self.running = running if running is not None else (lambda: True)
+        self.period = period
+        self.min_refresh = min_refresh
+        self.epsilon = epsilon
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = None
+        self.last_sent = None      # dernière position envoyée (x, y)
+        self.last_sent_at = None
+        self.sent = 0
+        self.failures = 0
+        self.unchanged = 0         # ticks sautés car la position n'a pas bougé
+        self.coalesced = 0         # ticks sautés car l'envoi précédent était en cours
+        self.missed_deadlines = 0  # échéances manquées (boucle en retard)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        logger.info(f"Position reporter started - period: {self.period}s, min refresh: {self.min_refresh}s")
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set() and self.running():
+            late = time.monotonic() - next_tick
+            if late >= self.period:
+                missed = int(late // self.period)
+                self.missed_deadlines += missed
+                next_tick += missed * self.period
+            self.tick()
+            next_tick += self.period
+            self.stop_event.wait(max(0.0, next_tick - time.monotonic()))
+        logger.info(f"Position reporter stopped - stats: {self.stats()}")
+
+    def tick(self):
+        '''
+            Envoie la position courante si nécessaire, sans attendre la réponse
+        '''
+        x, y = self.get_position()
+        now = time.monotonic()
+        with self.lock:
+            if self.pending is not None and not self.pending.done():
+                self.coalesced += 1
+                return
+            if (self.last_sent is not None
+                    and dist(self.last_sent, (x, y)) < self.epsilon
+                    and now - self.last_sent_at < self.min_refresh):
+                self.unchanged += 1
+                return
+            self.last_sent = (x, y)
+            self.last_sent_at = now
+            self.pending = self.client.post_position(x, y)
+        self.pending.add_done_callback(lambda future: self._done(future, now))
+
+    def _done(self,future,started):
+        latency = time.monotonic() - started
+        try:
+            response = future.result()
+            ok = response.status_code == 200
+        except Exception as e:
+            logger.error(f"Failed to send position to server: {e}")
+            ok = False
+        with self.lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failures += 1
+                self.last_sent = None  # à renvoyer dès la prochaine échéance
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def stats(self):
+        with self.lock:
+            done = self.sent + self.failures
+            return {
+                "sent": self.sent,
+                "failures": self.failures,
+                "unchanged": self.unchanged,
+                "coalesced": self.coalesced,
+                "missed_deadlines": self.missed_deadlines,
+                "latency_avg": self.latency_total / done if done else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+class LocalEvalServer():
+    '''
+        Serveur d'évaluation local pour les essais sans accès à proj103.r2.enst.fr
+
+        Garde les requêtes reçues dans requests, valide toute balise de todo
+        (200 puis 503 si déjà validée) et peut simuler un réseau lent avec latency.
+
+        arguments
+            todo:  identifiants des balises à capturer, dans l'ordre LIST
+            latency:  délai ajouté à chaque réponse en secondes FLOAT
+    '''
+    def __init__(self,todo=(),latency=0.0,host="127.0.0.1",port=0):
+        self.todo = list(todo)
+        self.validated = []
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self,method,path,params):
+        '''
+            Renvoie (code HTTP, corps DICTIONNAIRE) pour une requête
+        '''
+        with self.lock:
+            self.requests.append((method, path, params))
+            if path == "/api/pos" and method == "POST":
+                return 200, {}
+            if path == "/api/marker" and method == "POST":
+                marker_id = int(params.get("id", -1))
+                if marker_id in self.validated:
+                    return 503, {"error": "already validated"}
+                if marker_id in self.todo:
+                    self.todo.remove(marker_id)
+                    self.validated.append(marker_id)
+                    return 200, {}
+                return 400, {"error": "unknown marker"}
+            if path == "/api/status" and method == "GET":
+                return 200, {"markers": [{"id": m} for m in self.validated]}
+            if path == "/api/list" and method == "GET":
+                return 200, {"markers": list(self.todo)}
+        return 404, {"error": "not found"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # connexions persistantes, comme le vrai serveur
+
+            def _reply(self,method):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+                code, body = server.handle(method, url.path, params)
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply("GET")
+
+            def do_POST(self):
+                self._reply("POST")
+
+            def log_message(self,format,*args):
+                logger.debug("Local eval server: " + format, *args)
+
+        return Handler
@@ -0,0 +1,239 @@
+'''
+Bus d'images partagé entre le flux web (remake.py) et le mode automatique (auto.py)
+
+Une seule boucle lit la caméra et publie chaque nouvelle image une fois à tous
+les abonnés. Les encodages (JPEG à chaque résolution/qualité, base64) sont
+calculés à la première demande puis gardés sur l'image : une image n'est encodée
+qu'une fois par format, quel que soit le nombre de consommateurs.
+
+La capture suit la demande : un consommateur qui a besoin d'images (client web
+authentifié, mode auto) appelle acquire() puis release() ; sans demande, la boucle
+de capture s'endort sans lire la caméra et repart dès le prochain acquire().
+'''
+import zlib
+import base64
+import threading
+from collections import Counter
+import time
+import logging
+import cv2
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 80
+CAPTURE_INTERVAL = 0.02  # secondes entre deux lectures de la caméra
+
+
+class Frame():
+    '''
+        Image capturée, avec ses encodages calculés à la demande
+
+        attributs
+            seq:  numéro de séquence attribué par le bus INT
+            timestamp:  instant de capture en secondes FLOAT
+            raw:  image brute renvoyée par la caméra
+    '''
+    def __init__(self,seq,timestamp,raw):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.raw = raw
+        self._lock = threading.RLock()  # un encodage peut en demander un autre (paquet -> JPEG)
+        self._cache = {}
+
+    def memo(self,key,compute):
+        '''
+            Renvoie compute(self), calculé une seule fois par image pour une clé donnée
+        '''
+        if key in self._cache:
+            return self._cache[key]
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compute(self)
+            return self._cache[key]
+
+    def cached(self,key):
+        '''
+            Renvoie la valeur déjà calculée par memo pour cette clé, None sinon (sans rien calculer)
+        '''
+        return self._cache.get(key)
+
+    def jpeg(self,quality=JPEG_QUALITY,scale=1.0):
+        '''
+            Renvoie l'image encodée en JPEG (BYTES), ou None si l'encodage échoue
+
+            arguments
+                quality:  qualité JPEG (0-100) INT
+                scale:  facteur de réduction de la résolution FLOAT
+        '''
+        return self.memo(("jpeg", quality, scale), lambda frame: _encode_jpeg(frame.raw, quality, scale))
+
+    def base64(self):
+        '''
+            Renvoie le JPEG de l'image encodé en base64 (STRING), ou None
+        '''
+        def encode(frame):
+            data = frame.jpeg()
+            return base64.b64encode(data).decode("ascii") if data is not None else None
+        return self.memo("base64", encode)
+
+
+def _encode_jpeg(raw,quality,scale):
+    if scale != 1.0:
+        raw = cv2.resize(raw, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", raw, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ok else None
+
+
+def frame_checksum(raw):
+    '''
+        Somme de contrôle du contenu d'une image brute (adler32, ~0.4 ms en 640x480)
+    '''
+    return zlib.adler32(raw if raw.flags.c_contiguous else raw.tobytes())
+
+
+class FrameBus():
+    '''
+        Producteur unique d'images : lit la caméra dans son propre thread et
+        publie chaque nouvelle image aux abonnés
+
+        arguments
+            source:  fonction renvoyant l'image brute courante (camera.get_camera_frame par défaut)
+            interval:  délai entre deux lectures en secondes FLOAT
+    '''
+    def __init__(self,source=None,interval=CAPTURE_INTERVAL):
+        if source is None:
+            import beacon_detection.camera_Api as camera  # matériel : importé seulement s'il sert
+            source = camera.get_camera_frame
+        self.source = source
+        self.interval = interval
+        self.latest = None
+        self.subscribers = []
+        self.demand = Counter()  # consommateur -> nombre d'acquire() en cours
+        self.pauses = 0
+        self.duplicates = 0      # lectures identiques à l'image précédente, non publiées
+        self.stop_event = threading.Event()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._seq = 0
+
+    def subscribe(self,callback):
+        '''
+            Appelle callback(frame) pour chaque nouvelle image, depuis le thread de capture
+        '''
+        with self._condition:
+            self.subscribers = self.subscribers + [callback]
+        return callback
+
+    def unsubscribe(self,callback):
+        with self._condition:
+            self.subscribers = [s for s in self.subscribers if s is not callback]
+
+    @property
+    def active(self):
+        return bool(self.demand)
+
+    def acquire(self,owner):
+        '''
+            Demande des images pour owner : la capture reprend aussitôt si elle était en pause
+
+            arguments
+                owner:  consommateur, pour les journaux et stats() (STRING)
+        '''
+        with self._condition:
+            resumed = not self.demand
+            self.demand[owner] += 1
+            self._condition.notify_all()
+        if resumed:
+            logger.info(f"Frame bus capture resumed - requested by {owner}")
+        return owner
+
+    def release(self,owner):
+        '''
+            Fin de la demande de owner ; sans autre demande, la capture se met en pause
+        '''
+        with self._condition:
+            if self.demand[owner] <= 1:
+                del self.demand[owner]
+            else:
+                self.demand[owner] -= 1
+            idle = not self.demand
+        if idle:
+            logger.info(f"Frame bus capture idle - released by {owner}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.stop_event.clear()
+        self._thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        with self._condition:
+            self._condition.notify_all()  # réveille une capture en pause
+
+    def wait_for_frame(self,after_seq=0,timeout=None):
+        '''
+            Attend une image plus récente que after_seq
+
+            retourne la dernière image (Frame), ou None si le délai expire
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self.latest is not None and self.latest.seq > after_seq, timeout)
+            frame = self.latest
+        return frame if frame is not None and frame.seq > after_seq else None
+
+    def publish(self,raw,timestamp=None):
+        '''
+            Publie une image brute à tous les abonnés et la renvoie sous forme de Frame
+        '''
+        with self._condition:
+            self._seq += 1
+            frame = Frame(self._seq, timestamp if timestamp is not None else time.time(), raw)
+            self.latest = frame
+            subscribers = self.subscribers
+            self._condition.notify_all()
+        for callback in subscribers:
+            try:
+                callback(frame)
+            except Exception as e:
+                logger.error(f"Frame subscriber {callback} failed: {e}", exc_info=True)
+        return frame
+
+    def wait_for_demand(self):
+        '''
+            Bloque la capture tant que personne ne demande d'images
+
+            La dernière image est oubliée pendant la pause : un consommateur qui reprend
+            attend une image fraîche plutôt que celle d'avant la pause.
+        '''
+        with self._condition:
+            if self.demand or self.stop_event.is_set():
+                return
+            self.latest = None
+            self.pauses += 1
+            self._condition.wait_for(lambda: self.demand or self.stop_event.is_set())
+
+    def capture_loop(self):
+        logger.info("Frame bus capture loop started")
+        last = None
+        while not self.stop_event.is_set():
+            self.wait_for_demand()
+            if self.stop_event.is_set():
+                break
+            raw = self.source()
+            if raw is not None:
+                # une caméra lue plus vite qu'elle ne produit renvoie la même image dans un
+                # nouveau tableau : seul un contenu différent fait une nouvelle image
+                checksum = frame_checksum(raw)
+                if checksum != last:
+                    last = checksum
+                    self.publish(raw)
+                else:
+                    self.duplicates += 1
+            self.stop_event.wait(self.interval)
+        logger.info(f"Frame bus capture loop stopped - total frames: {self._seq}")
+
+    def stats(self):
+        with self._condition:
+            return {"frames": self._seq, "active": bool(self.demand), "demand": sorted(map(str, self.demand)), "pauses": self.pauses, "duplicates": self.duplicates}
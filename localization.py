@@ -0,0 +1,243 @@
+'''
+Estimation continue de la pose du robot (filtre de Kalman étendu)
+
+L'état (x mm, y mm, theta rad) est prédit à chaque rotation ou déplacement commandé,
+puis corrigé par chaque observation d'une balise fixe (distance et angle mesurés par
+la caméra), y compris celles vues en passant. Toutes les balises d'une image sont
+fusionnées en une seule mise à jour vectorisée ; une observation incohérente avec
+la pose estimée (test du khi-deux) est écartée.
+
+Tant que l'incertitude reste sous LOCALIZATION_MAX_STD, le balayage de recalage
+de AutoProgramme.update_pos n'est plus nécessaire.
+'''
+import os
+import time
+import threading
+import logging
+from math import cos, sin, radians, sqrt
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Balises fixes du terrain (mm) : pos1..pos3 de auto.py. La position de la balise 4 n'est
+# pas connue : elle n'entre dans le filtre que si ARTEFACT_BEACONS la donne ("4=x:y,...")
+BEACON_MAP = {
+    1: (0.0, 1500.0),
+    2: (1500.0, 0.0),
+    3: (0.0, -1500.0),
+}
+INITIAL_STD = (50.0, 50.0, radians(5))  # incertitude de la pose de départ (mm, mm, rad)
+MOVE_NOISE = 0.05             # écart type du déplacement, par mm parcouru
+MOVE_DRIFT = radians(2) / 1000  # écart type de cap ajouté par mm parcouru (rad)
+TURN_NOISE = 0.02             # écart type de la rotation, par rad tourné
+RANGE_NOISE = (20.0, 0.05)    # écart type de la distance mesurée : constante (mm) + part de la distance
+BEARING_NOISE = radians(2)    # écart type de l'angle mesuré (rad)
+GATE = 9.21                   # seuil du khi-deux à 2 degrés de liberté (99 %)
+LOCALIZATION_MAX_STD = 100.0  # incertitude de position en dessous de laquelle la pose est sûre (mm)
+LOCALIZATION_MAX_HEADING_STD = radians(5)
+
+
+def parse_beacons(spec):
+    '''
+        "4=-1500:0,5=0:750" -> {4: (-1500.0, 0.0), 5: (0.0, 750.0)}
+
+        lève ValueError si une entrée est mal formée
+    '''
+    beacons = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        marker_id, _, position = item.partition("=")
+        x, _, y = position.partition(":")
+        beacons[int(marker_id)] = (float(x), float(y))
+    return beacons
+
+
+BEACON_MAP.update(parse_beacons(os.environ.get("ARTEFACT_BEACONS", "")))
+
+
+def _wrap(angle):
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+class PoseFilter():
+    '''
+        Filtre de Kalman étendu sur la pose (x, y, theta)
+
+        arguments
+            beacons:  position des balises fixes {id: (x, y)} en mm DICTIONNAIRE
+    '''
+    def __init__(self,beacons=BEACON_MAP):
+        self.beacons = dict(beacons)
+        self._lock = threading.Lock()
+        self.state = np.zeros(3)
+        self.covariance = np.diag(np.square(INITIAL_STD))
+        self.settled_at = 0.0   # fin du dernier mouvement : les images plus anciennes sont ignorées
+        self.moving = False
+        self.last_seq = 0
+        self.updates = 0
+        self.observations = 0
+        self.rejected = 0
+
+    def reset(self,x,y,theta,std=INITIAL_STD):
+        with self._lock:
+            self.state = np.array([x, y, theta], dtype=float)
+            self.covariance = np.diag(np.square(std))
+            self.settled_at = time.time()
+
+    def pose(self):
+        '''
+            Pose estimée (x mm, y mm, theta rad)
+        '''
+        with self._lock:
+            x, y, theta = self.state
+        return float(x), float(y), float(theta)
+
+    def std(self):
+        '''
+            (écart type de position en mm sur l'axe le plus incertain, écart type de cap en rad)
+        '''
+        with self._lock:
+            position = np.linalg.eigvalsh(self.covariance[:2, :2])[-1]
+            heading = self.covariance[2, 2]
+        return sqrt(max(position, 0.0)), sqrt(max(heading, 0.0))
+
+    def confident(self,max_std=LOCALIZATION_MAX_STD,max_heading_std=LOCALIZATION_MAX_HEADING_STD):
+        position, heading = self.std()
+        return position <= max_std and heading <= max_heading_std
+
+    def begin_motion(self):
+        '''
+            Le robot se met en mouvement : les observations sont suspendues jusqu'à la prédiction
+        '''
+        with self._lock:
+            self.moving = True
+
+    def predict_turn(self,angle):
+        with self._lock:
+            self._turn(angle)
+            self._settle()
+
+    def predict_move(self,distance):
+        with self._lock:
+            self._move(distance)
+            self._settle()
+
+    def predict_arc(self,angle,radius):
+        '''
+            Arc de cercle : équivaut à une demi-rotation, la corde, puis l'autre demi-rotation
+        '''
+        with self._lock:
+            self._turn(angle / 2)
+            self._move(2 * radius * sin(abs(angle) / 2))
+            self._turn(angle / 2)
+            self._settle()
+
+    def _turn(self,angle):
+        self.state[2] = _wrap(self.state[2] + angle)
+        self.covariance[2, 2] += (TURN_NOISE * angle) ** 2
+
+    def _move(self,distance):
+        theta = self.state[2]
+        c, s = cos(theta), sin(theta)
+        self.state[0] += distance * c
+        self.state[1] += distance * s
+        jacobian = np.array([[1.0, 0.0, -distance * s], [0.0, 1.0, distance * c], [0.0, 0.0, 1.0]])
+        along = (MOVE_NOISE * distance) ** 2
+        noise = np.array([[along * c * c, along * c * s, 0.0], [along * c * s, along * s * s, 0.0], [0.0, 0.0, (MOVE_DRIFT * distance) ** 2]])
+        self.covariance = jacobian @ self.covariance @ jacobian.T + noise
+
+    def _settle(self):
+        self.moving = False
+        self.settled_at = time.time()
+
+    def fix(self,x,y,theta,std=INITIAL_STD):
+        '''
+            Fusionne une pose complète calculée ailleurs (triangulation du système de positionnement)
+        '''
+        with self._lock:
+            noise = np.diag(np.square(std))
+            innovation = np.array([x, y, theta]) - self.state
+            innovation[2] = _wrap(innovation[2])
+            gain = self.covariance @ np.linalg.inv(self.covariance + noise)
+            self.state = self.state + gain @ innovation
+            self.state[2] = _wrap(self.state[2])
+            self.covariance = (np.eye(3) - gain) @ self.covariance
+
+    def observe(self,markers,timestamp=None,seq=None):
+        '''
+            Corrige la pose avec les balises fixes visibles sur une image
+
+            arguments
+                markers:  balises renvoyées par camera.detect_markers LIST
+                timestamp:  instant de capture de l'image FLOAT
+                seq:  numéro de l'image, pour ne pas fusionner deux fois la même INT
+
+            retourne le nombre d'observations utilisées
+        '''
+        with self._lock:
+            if self.moving or (timestamp is not None and timestamp < self.settled_at):
+                return 0  # image prise pendant un mouvement : pose inconnue à cet instant
+            if seq is not None:
+                if seq <= self.last_seq:
+                    return 0
+                self.last_seq = seq
+            known = [m for m in markers if m['id'] in self.beacons]
+            if not known:
+                return 0
+            return self._update(known)
+
+    def _update(self,markers):
+        beacons = np.array([self.beacons[m['id']] for m in markers])
+        measured = np.array([[m['distance'] * 10, -radians(m['horizontal_angle'])] for m in markers])
+        x, y, theta = self.state
+        dx = beacons[:, 0] - x
+        dy = beacons[:, 1] - y
+        q = np.maximum(dx * dx + dy * dy, 1e-6)
+        r = np.sqrt(q)
+        innovation = measured - np.column_stack([r, np.arctan2(dy, dx) - theta])
+        innovation[:, 1] = _wrap(innovation[:, 1])
+        # jacobiennes (n, 2, 3) et bruits (n, 2, 2) de toutes les observations
+        H = np.zeros((len(markers), 2, 3))
+        H[:, 0, 0] = -dx / r
+        H[:, 0, 1] = -dy / r
+        H[:, 1, 0] = dy / q
+        H[:, 1, 1] = -dx / q
+        H[:, 1, 2] = -1.0
+        R = np.zeros((len(markers), 2, 2))
+        R[:, 0, 0] = (RANGE_NOISE[0] + RANGE_NOISE[1] * measured[:, 0]) ** 2
+        R[:, 1, 1] = BEARING_NOISE ** 2
+        # test du khi-deux de chaque observation prise seule
+        S = H @ self.covariance @ H.transpose(0, 2, 1) + R
+        distance = np.einsum("ni,ni->n", innovation, np.linalg.solve(S, innovation[:, :, None])[:, :, 0])
+        accepted = distance < GATE
+        self.observations += len(markers)
+        self.rejected += int((~accepted).sum())
+        if not accepted.any():
+            return 0
+        # une seule mise à jour pour toutes les observations retenues
+        H = H[accepted].reshape(-1, 3)
+        innovation = innovation[accepted].reshape(-1)
+        noise = np.zeros((len(innovation), len(innovation)))
+        for i, block in enumerate(R[accepted]):
+            noise[2 * i:2 * i + 2, 2 * i:2 * i + 2] = block
+        S = H @ self.covariance @ H.T + noise
+        gain = self.covariance @ H.T @ np.linalg.inv(S)
+        self.state = self.state + gain @ innovation
+        self.state[2] = _wrap(self.state[2])
+        identity = np.eye(3)
+        # forme de Joseph : la covariance reste symétrique et positive
+        self.covariance = (identity - gain @ H) @ self.covariance @ (identity - gain @ H).T + gain @ noise @ gain.T
+        self.updates += 1
+        return int(accepted.sum())
+
+    def stats(self):
+        position, heading = self.std()
+        return {
+            "pose": self.pose(),
+            "position_std": position,
+            "heading_std": heading,
+            "updates": self.updates,
+            "observations": self.observations,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,145 @@
+'''
+Configuration commune des logs de remake.py et auto.py
+
+Les enregistrements sont confiés à une file et écrits par un thread dédié : le
+formatage des messages (arguments %s) et l'écriture sur la sortie ne se font
+jamais dans le thread qui logue. Les niveaux se règlent par sous-système depuis
+l'environnement :
+
+    ARTEFACT_LOG_LEVEL=INFO                          niveau par défaut (DEBUG)
+    ARTEFACT_LOG_LEVELS="remake=DEBUG,frame_bus=WARNING"  niveaux par logger
+    ARTEFACT_LOG_RATE=2                              messages/s par ligne pour les logs marqués HOT
+
+Sur les chemins fréquents (commande joystick, boucles de recherche), loguer avec
+des arguments plutôt qu'une f-string et marquer le message HOT :
+
+    logger.debug("Command parameters - angle: %s", angle, extra=HOT)
+'''
+import os
+import time
+import queue
+import atexit
+import threading
+import logging
+import logging.handlers
+from contextlib import contextmanager
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_LEVEL = "DEBUG"
+DEFAULT_RATE = 2.0  # messages HOT par seconde et par ligne de code
+
+# Bibliothèques trop bavardes (trames caméra, pool HTTP), réglables comme les autres
+DEFAULT_LEVELS = {
+    "websockets.server": "WARNING",
+    "websockets.protocol": "WARNING",
+    "urllib3.connectionpool": "WARNING",
+}
+
+# extra= pour les messages émis à haute fréquence : limités à ARTEFACT_LOG_RATE par seconde
+HOT = {"rate_limited": True}
+
+_listener = None
+_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    '''
+        Laisse passer au plus rate messages HOT par seconde pour chaque ligne de code
+
+        Le nombre de messages écartés est ajouté au suivant qui passe ; les messages
+        non marqués HOT ne sont jamais filtrés.
+    '''
+    def __init__(self,rate=DEFAULT_RATE):
+        super().__init__()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.last = {}        # (logger, ligne) -> instant du dernier message accepté
+        self.suppressed = {}  # (logger, ligne) -> messages écartés depuis
+
+    def filter(self,record):
+        if not getattr(record, "rate_limited", False):
+            return True
+        key = (record.name, record.lineno)
+        now = time.monotonic()
+        if now - self.last.get(key, -self.interval) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.last[key] = now
+        skipped = self.suppressed.pop(key, 0)
+        if skipped:
+            record.msg = f"{record.msg} [{skipped} similar messages suppressed]"
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+        QueueHandler qui laisse le formatage au thread d'écriture
+
+        (QueueHandler.prepare formate le message dans le thread appelant.)
+    '''
+    def prepare(self,record):
+        return record
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level=None,levels=None,rate=None):
+    '''
+        Installe la file de logs et le thread d'écriture (une seule fois par processus)
+
+        arguments
+            level:  niveau par défaut STRING (sinon ARTEFACT_LOG_LEVEL, sinon DEBUG)
+            levels:  niveaux par logger DICTIONNAIRE (complété par ARTEFACT_LOG_LEVELS)
+            rate:  messages HOT par seconde FLOAT (sinon ARTEFACT_LOG_RATE)
+    '''
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        level = level or os.environ.get("ARTEFACT_LOG_LEVEL", DEFAULT_LEVEL)
+        rate = rate if rate is not None else float(os.environ.get("ARTEFACT_LOG_RATE", DEFAULT_RATE))
+        per_logger = dict(DEFAULT_LEVELS)
+        per_logger.update(levels or {})
+        per_logger.update(_parse_levels(os.environ.get("ARTEFACT_LOG_LEVELS", "")))
+
+        stream = logging.StreamHandler()
+        stream.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        records = queue.SimpleQueue()
+        handler = DeferredQueueHandler(records)
+        handler.addFilter(RateLimitFilter(rate))
+
+        root = logging.getLogger()
+        root.handlers[:] = [handler]
+        root.setLevel(level.upper())
+        for name, value in per_logger.items():
+            logging.getLogger(name).setLevel(value)
+
+        _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+@contextmanager
+def paused():
+    '''
+        Arrête le thread d'écriture le temps d'un fork, pour que le processus fils n'hérite
+        pas d'un verrou tenu par un thread qu'il n'a pas ; les messages logués entre-temps
+        attendent dans la file et sont écrits à la reprise
+    '''
+    with _lock:
+        listener = _listener
+    if listener is None or listener._thread is None:
+        yield
+        return
+    listener.stop()  # écrit ce qui est déjà dans la file puis attend la fin du thread
+    try:
+        yield
+    finally:
+        listener.start()
@@ -0,0 +1,207 @@
+'''
+Mesures de performance communes à remake.py et auto.py
+
+Compteurs, jauges et histogrammes à seaux fixes, assez légers pour rester actifs
+en production (une recherche dichotomique et une addition sous verrou par mesure).
+Le contenu est lisible en texte Prometheus (render_prometheus, servi sur /metrics)
+ou en DICTIONNAIRE (snapshot, envoyé dans le message WebSocket "stats").
+
+    FRAME_LATENCY = metrics.histogram("frame_send_latency_seconds", "Capture to WebSocket send")
+    FRAME_LATENCY.observe(0.012)
+    with metrics.timed("auto_phase_seconds", phase="update_pos"):
+        ...
+'''
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seaux par défaut, en secondes : de 0.5 ms à 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter():
+    def __init__(self,name,help,labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self,amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def summary(self):
+        return self.value
+
+
+class Gauge():
+    def __init__(self,name,help,labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self,value):
+        self.value = value
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def summary(self):
+        return self.value
+
+
+class Histogram():
+    '''
+        Histogramme à seaux fixes (bornes supérieures en secondes)
+    '''
+    def __init__(self,name,help,labels=(),buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # le dernier seau est +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self,value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self,q):
+        '''
+            Estimation d'un quantile : borne supérieure du seau qui le contient
+        '''
+        with self._lock:
+            counts, count, largest = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets + (largest,), counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, largest)
+        return largest
+
+    def samples(self):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        result = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            result.append((f"{self.name}_bucket", self.labels + (("le", le),), cumulative))
+        result.append((f"{self.name}_count", self.labels, count))
+        result.append((f"{self.name}_sum", self.labels, total))
+        return result
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class Registry():
+    '''
+        Ensemble des mesures, une par (nom, étiquettes)
+    '''
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self,cls,name,help,labels,**kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, help, key[1], **kwargs)
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self,name,help="",**labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self,name,help="",**labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self,name,help="",buckets=DEFAULT_BUCKETS,**labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def remove(self,name,**labels):
+        with self._lock:
+            self._metrics.pop((name, tuple(sorted(labels.items()))), None)
+
+    def render_prometheus(self):
+        '''
+            Renvoie toutes les mesures au format texte de Prometheus (STRING)
+        '''
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+        lines = []
+        described = set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        '''
+            Renvoie un résumé des mesures (DICTIONNAIRE), clé "nom{étiquettes}"
+        '''
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {f"{m.name}{_label_text(m.labels)}": m.summary() for m in metrics}
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+remove = REGISTRY.remove
+render_prometheus = REGISTRY.render_prometheus
+snapshot = REGISTRY.snapshot
+
+
+@contextmanager
+def timed(name,help="",**labels):
+    '''
+        Mesure la durée du bloc dans l'histogramme name
+    '''
+    metric = histogram(name, help, **labels)
+    started = time.perf_counter()
+    try:
+        yield metric
+    finally:
+        metric.observe(time.perf_counter() - started)
@@ -0,0 +1,243 @@
+'''
+Graphe de tâches pour enchaîner des étapes qui peuvent se recouvrir
+
+Chaque étape est une fonction lancée dans le pool du Pipeline dès que les étapes dont
+elle dépend (after) sont terminées. Le graphe peut grandir pendant l'exécution : on
+ajoute une étape quand on sait qu'elle sera utile, éventuellement de façon spéculative,
+et on l'annule si la suite montre qu'elle ne l'est pas. L'annulation est coopérative :
+la fonction reçoit un threading.Event qu'elle consulte pour s'arrêter au plus tôt.
+
+Chaque étape est chronométrée ; describe() et critical_path() permettent de voir, après
+coup, quelles étapes se sont recouvertes et lesquelles ont fixé la durée totale.
+'''
+import time
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_WORKERS = 4  # étapes exécutées en même temps au plus
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class StageCancelled(Exception):
+    '''
+        Résultat d'une étape annulée, ou sautée car une étape dont elle dépend n'a pas abouti
+    '''
+
+
+class Stage():
+    '''
+        Étape du Pipeline
+
+        arguments
+            name:  nom unique de l'étape STRING
+            fn:  fonction appelée avec l'Event d'annulation, sa valeur de retour est le résultat
+            after:  noms des étapes à attendre LIST
+            speculative:  l'étape peut être annulée si la suite ne la confirme pas BOOL
+    '''
+    def __init__(self,name,fn,after=(),speculative=False):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.speculative = speculative
+        self.state = PENDING
+        self.future = Future()
+        self.cancel_event = threading.Event()
+        self.started = None
+        self.finished = None
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+    def result(self,timeout=None):
+        '''
+            Attend la fin de l'étape et renvoie son résultat (lève StageCancelled si elle n'a pas eu lieu)
+        '''
+        return self.future.result(timeout)
+
+    def done(self):
+        return self.future.done()
+
+
+class Pipeline():
+    '''
+        Graphe de tâches exécuté sur un pool de threads
+
+        arguments
+            name:  nom du pipeline, pour les journaux et les métriques STRING
+            workers:  nombre d'étapes exécutées en même temps INT
+            timer:  fonction name -> gestionnaire de contexte qui chronomètre une étape ;
+                    par défaut l'histogramme pipeline_stage_seconds
+    '''
+    def __init__(self,name="pipeline",workers=PIPELINE_WORKERS,timer=None):
+        self.name = name
+        self.timer = timer if timer is not None else (lambda stage: metrics.timed("pipeline_stage_seconds", "Pipeline stage duration", pipeline=name, stage=stage))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-stage")
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def add(self,name,fn,after=(),speculative=False):
+        '''
+            Ajoute une étape, lancée dès que toutes les étapes after sont terminées
+
+            retourne la Stage
+        '''
+        stage = Stage(name, fn, after, speculative)
+        with self.lock:
+            if name in self.stages:
+                raise ValueError(f"Duplicate stage: {name}")
+            missing = [dep for dep in stage.after if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+            self.stages[name] = stage
+        logger.debug("Pipeline %s - added stage %s after %s%s", self.name, name, list(stage.after), " (speculative)" if speculative else "")
+        self._schedule(stage)
+        return stage
+
+    def __getitem__(self,name):
+        return self.stages[name]
+
+    def cancel(self,name):
+        '''
+            Annule une étape : sautée si elle n'a pas commencé, prévenue sinon
+
+            retourne la Stage
+        '''
+        stage = self.stages[name]
+        stage.cancel_event.set()
+        with self.lock:
+            pending = stage.state == PENDING
+            if pending:
+                stage.state = CANCELLED
+        if pending:
+            logger.info("Pipeline %s - stage %s cancelled before start", self.name, name)
+            stage.future.set_exception(StageCancelled(name))
+            self._release(stage)
+        else:
+            logger.info("Pipeline %s - cancelling running stage %s", self.name, name)
+        return stage
+
+    def _schedule(self,stage):
+        with self.lock:
+            if stage.state != PENDING:
+                return
+            deps = [self.stages[dep] for dep in stage.after]
+            if not all(dep.done() for dep in deps):
+                return
+            failed = [dep.name for dep in deps if dep.state != DONE]
+            stage.state = CANCELLED if failed else RUNNING
+        if failed:
+            logger.info("Pipeline %s - stage %s skipped, %s did not complete", self.name, stage.name, failed)
+            stage.future.set_exception(StageCancelled(f"{stage.name}: {failed} did not complete"))
+            self._release(stage)
+            return
+        self.executor.submit(self._run, stage)
+
+    def _run(self,stage):
+        stage.started = time.monotonic()
+        try:
+            with self.timer(stage.name):
+                result = stage.fn(stage.cancel_event)
+        except BaseException as e:
+            stage.finished = time.monotonic()
+            if stage.cancel_event.is_set():
+                stage.state = CANCELLED
+                stage.future.set_exception(StageCancelled(stage.name))
+            else:
+                stage.state = FAILED
+                logger.error("Pipeline %s - stage %s failed: %s", self.name, stage.name, e, exc_info=True)
+                stage.future.set_exception(e)
+        else:
+            stage.finished = time.monotonic()
+            if stage.cancel_event.is_set():
+                # un résultat obtenu après annulation n'est pas fiable (balayage interrompu...)
+                stage.state = CANCELLED
+                stage.future.set_exception(StageCancelled(stage.name))
+            else:
+                stage.state = DONE
+                stage.future.set_result(result)
+            logger.debug("Pipeline %s - stage %s %s in %.3fs", self.name, stage.name, stage.state, stage.duration)
+        self._release(stage)
+
+    def _release(self,stage):
+        '''
+            Lance les étapes qui n'attendaient plus que stage
+        '''
+        with self.lock:
+            waiting = [s for s in self.stages.values() if s.state == PENDING and stage.name in s.after]
+        for waiter in waiting:
+            self._schedule(waiter)
+
+    def close(self):
+        '''
+            Annule les étapes spéculatives ou pas encore lancées et attend celles en cours
+        '''
+        for stage in list(self.stages.values()):
+            if stage.state == PENDING or (stage.speculative and stage.state == RUNNING):
+                self.cancel(stage.name)
+        self.executor.shutdown(wait=True)
+
+    def describe(self):
+        '''
+            État de chaque étape, instants relatifs au lancement du pipeline (s)
+
+            retourne une liste de dictionnaires, dans l'ordre d'ajout
+        '''
+        rel = lambda t: round(t - self.started, 3) if t is not None else None
+        return [{
+            "name": stage.name,
+            "after": list(stage.after),
+            "speculative": stage.speculative,
+            "state": stage.state,
+            "start": rel(stage.started),
+            "end": rel(stage.finished),
+            "duration": round(stage.duration, 3) if stage.duration is not None else None,
+        } for stage in self.stages.values()]
+
+    def critical_path(self):
+        '''
+            Chaîne d'étapes qui a fixé la durée totale : en partant de la dernière étape
+            terminée, on remonte à chaque fois vers la dépendance finie le plus tard
+
+            retourne la liste des noms, de la première à la dernière étape
+        '''
+        finished = [s for s in self.stages.values() if s.finished is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: s.finished)
+        path = [stage.name]
+        while True:
+            deps = [self.stages[dep] for dep in stage.after if self.stages[dep].finished is not None]
+            if not deps:
+                break
+            stage = max(deps, key=lambda s: s.finished)
+            path.append(stage.name)
+        return path[::-1]
+
+    def summary(self):
+        '''
+            Texte lisible du plan exécuté, pour les journaux
+        '''
+        lines = [f"Pipeline {self.name} - {time.monotonic() - self.started:.2f}s, critical path: {' -> '.join(self.critical_path())}"]
+        for s in self.describe():
+            timing = f"{s['start']:7.2f}s -> {s['end']:7.2f}s ({s['duration']:.2f}s)" if s["end"] is not None else "not run"
+            lines.append(f"  {s['name']:<16} {s['state']:<9} {timing}{'  speculative' if s['speculative'] else ''}{'  after ' + ', '.join(s['after']) if s['after'] else ''}")
+        return "\n".join(lines)
@@ -0,0 +1,143 @@
+'''
+Planification des trajectoires du mode auto
+
+plan() part de la pose courante et d'un but (un point, avec éventuellement un cap
+d'arrivée ou une distance d'arrêt devant le point) et renvoie la suite de primitives
+la plus rapide compte tenu des limites du robot : rotation puis ligne droite, marche
+arrière, ou arc de cercle quand le robot sait en suivre un (move_arc). Les rotations
+consécutives sont fusionnées, ramenées dans [-pi, pi] et les mouvements négligeables
+supprimés : aucune rotation inutile n'est envoyée au robot.
+'''
+from math import atan2, cos, sin, pi, hypot
+from collections import namedtuple
+
+LINEAR_SPEED = 300.0     # vitesse maximale en ligne droite (mm/s)
+ANGULAR_SPEED = pi       # vitesse maximale de rotation sur place (rad/s)
+WHEEL_BASE = 150.0       # écart entre les roues (mm)
+MIN_TURN = 0.02          # rotation en dessous de laquelle on ne tourne pas (rad, ~1 degré)
+MIN_MOVE = 10.0          # déplacement en dessous duquel on ne bouge pas (mm)
+MIN_ARC_RADIUS = 150.0   # rayon minimal d'un arc (mm)
+
+# Limites du robot utilisées pour estimer la durée des primitives
+Limits = namedtuple("Limits", "linear_speed angular_speed wheel_base arcs")
+DEFAULT_LIMITS = Limits(LINEAR_SPEED, ANGULAR_SPEED, WHEEL_BASE, False)
+
+# Primitive de mouvement : ("turn", angle rad) ; ("move", distance mm) ; ("arc", angle rad, rayon mm)
+Motion = namedtuple("Motion", "kind value radius")
+
+
+def turn(angle):
+    return Motion("turn", angle, None)
+
+
+def move(distance):
+    return Motion("move", distance, None)
+
+
+def arc(angle,radius):
+    return Motion("arc", angle, radius)
+
+
+def normalize(angle):
+    return (angle + pi) % (2 * pi) - pi
+
+
+def arc_speed(radius,limits=DEFAULT_LIMITS):
+    '''
+        Vitesse maximale sur un arc : la roue extérieure ne dépasse pas linear_speed
+    '''
+    return min(limits.linear_speed / (1 + limits.wheel_base / (2 * radius)), limits.angular_speed * radius)
+
+
+def duration(motion,limits=DEFAULT_LIMITS):
+    '''
+        Durée estimée d'une primitive (s)
+    '''
+    if motion.kind == "turn":
+        return abs(motion.value) / limits.angular_speed
+    if motion.kind == "move":
+        return abs(motion.value) / limits.linear_speed
+    return abs(motion.value) * motion.radius / arc_speed(motion.radius, limits)
+
+
+def plan_duration(plan,limits=DEFAULT_LIMITS):
+    return sum(duration(m, limits) for m in plan)
+
+
+def simplify(plan):
+    '''
+        Fusionne les rotations consécutives, les ramène dans [-pi, pi] et supprime
+        les primitives négligeables
+    '''
+    result = []
+    for motion in plan:
+        if motion.kind == "turn" and result and result[-1].kind == "turn":
+            motion = turn(result.pop().value + motion.value)
+        elif motion.kind == "move" and result and result[-1].kind == "move":
+            motion = move(result.pop().value + motion.value)
+        if motion.kind == "turn":
+            motion = turn(normalize(motion.value))
+        result.append(motion)
+    return [m for m in result if not (
+        (m.kind == "turn" and abs(m.value) < MIN_TURN)
+        or (m.kind == "move" and abs(m.value) < MIN_MOVE)
+        or (m.kind == "arc" and abs(m.value) < MIN_TURN))]
+
+
+def end_pose(pose,plan):
+    '''
+        Pose atteinte après avoir suivi le plan
+    '''
+    x, y, theta = pose
+    for motion in plan:
+        if motion.kind == "turn":
+            theta = normalize(theta + motion.value)
+        elif motion.kind == "move":
+            x, y = x + motion.value * cos(theta), y + motion.value * sin(theta)
+        else:
+            # un arc équivaut à : demi-rotation, corde, demi-rotation
+            chord = 2 * motion.radius * sin(abs(motion.value) / 2)
+            heading = theta + motion.value / 2
+            x, y = x + chord * cos(heading), y + chord * sin(heading)
+            theta = normalize(theta + motion.value)
+    return x, y, theta
+
+
+def plan(pose,goal,heading=None,standoff=0.0,reverse=False,limits=DEFAULT_LIMITS):
+    '''
+        Plan le plus rapide de pose vers goal
+
+        arguments
+            pose:  pose courante (x mm, y mm, theta rad)
+            goal:  point visé (x mm, y mm)
+            heading:  cap final imposé (rad), ou None si indifférent
+            standoff:  distance à laquelle s'arrêter devant goal (mm)
+            reverse:  autorise la marche arrière BOOL
+            limits:  limites du robot (Limits)
+
+        retourne une liste de primitives (Motion)
+    '''
+    x, y, theta = pose
+    dx, dy = goal[0] - x, goal[1] - y
+    distance = hypot(dx, dy)
+    bearing = normalize(atan2(dy, dx) - theta)
+    travel = distance - standoff
+    candidates = []
+    if abs(travel) < MIN_MOVE:
+        candidates.append([])
+    else:
+        # le point d'arrêt est sur la droite robot -> but : s'y rendre, face au but
+        candidates.append([turn(bearing), move(travel)])
+        if reverse or travel < 0:
+            candidates.append([turn(normalize(bearing + pi)), move(-travel)])
+        if limits.arcs and travel > 0 and MIN_TURN <= abs(bearing) < pi / 2:
+            # arc tangent au cap courant passant par le point d'arrêt
+            radius = travel / (2 * sin(abs(bearing)))
+            if radius >= MIN_ARC_RADIUS:
+                candidates.append([arc(2 * bearing, radius)])
+    plans = []
+    for candidate in candidates:
+        if heading is not None:
+            candidate = candidate + [turn(heading - end_pose(pose, candidate)[2])]
+        plans.append(simplify(candidate))
+    return min(plans, key=lambda p: plan_duration(p, limits))
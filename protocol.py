@@ -0,0 +1,140 @@
+'''
+Protocole binaire compact entre l'interface web et le serveur, en option du JSON
+
+Le client le demande dans le message de clé, le serveur confirme dans sa réponse :
+
+    {"type": "key", "value": "1234", "protocol": "binary", "acks": "batch"}
+    {"type": "connexion", ..., "protocol": "binary", "acks": "batch"}
+
+Un client qui ne demande rien (ou un protocole inconnu) reste en JSON. En binaire, les
+commandes joystick, leurs acquittements et les deltas de télémétrie sont des paquets à
+disposition fixe (little-endian), dont le premier octet donne le type ; les autres
+messages (démarrage du mode auto, stats...) restent en JSON.
+
+    commande (client -> serveur, 12 octets) :
+        type u8, mode u8, séquence u16, angle u16 (degrés), distance u16,
+        x i16, y i16 (millièmes)
+    acquittement (serveur -> client, 5 octets) :
+        type u8, dernière séquence u16, commandes acquittées u16
+    télémétrie (serveur -> client, 31 octets) :
+        type u8, séquence u32, champs présents u16 (TELEMETRY_GROUPS),
+        batterie u8, drapeaux u8 (auto actif, watchdog armé), captures u8,
+        déclenchements du watchdog u16, pose x, y (mm), theta (rad) f32,
+        clients u8, images/s u16 (dixièmes), palier u8, file u8, latence u16 (dixièmes de ms)
+
+Les groupes JSON_GROUPS changent rarement mais portent plus que le paquet : ils partent
+aussi dans un message "telemetry" JSON de même séquence, juste avant le paquet.
+
+Acquittements : "each" (un par commande), "batch" (un seul par tick de télémétrie pour
+toutes les commandes reçues depuis) ou "none".
+'''
+import struct
+from collections import namedtuple
+
+PROTOCOL_JSON = "json"
+PROTOCOL_BINARY = "binary"
+ACKS_EACH = "each"
+ACKS_BATCH = "batch"
+ACKS_NONE = "none"
+
+# Premier octet des paquets binaires (1 : trame caméra, voir remake.FRAME_HEADER)
+PACKET_COMMAND = 2
+PACKET_ACK = 3
+PACKET_TELEMETRY = 4
+
+COMMAND_PACKET = struct.Struct("<BBHHHhh")
+ACK_PACKET = struct.Struct("<BHH")
+TELEMETRY_PACKET = struct.Struct("<BIHBBBHfffBHBBH")
+
+# Groupes de champs du paquet de télémétrie, bit par bit
+TELEMETRY_GROUPS = ("battery", "auto", "watchdog", "pose", "link")
+FLAG_AUTO_ACTIVE = 1
+FLAG_WATCHDOG_ARMED = 2
+# Groupes dont le détail n'a pas sa place dans le paquet (étapes du mode auto, dernier
+# déclenchement du watchdog) : envoyés aussi en JSON, juste avant le paquet, même séquence
+JSON_GROUPS = ("auto", "watchdog")
+
+Command = namedtuple("Command", "seq angle distance x y mode")
+
+
+def negotiate(data):
+    '''
+        Protocole et acquittements demandés dans le message de clé
+
+        retourne (protocole, acquittements)
+    '''
+    if data.get("protocol") != PROTOCOL_BINARY:
+        return PROTOCOL_JSON, ACKS_EACH
+    acks = data.get("acks", ACKS_BATCH)
+    return PROTOCOL_BINARY, acks if acks in (ACKS_EACH, ACKS_BATCH, ACKS_NONE) else ACKS_BATCH
+
+
+def encode_command(seq,angle,distance,x,y,mode=1):
+    return COMMAND_PACKET.pack(PACKET_COMMAND, mode, seq & 0xFFFF, int(angle) % 360, int(distance),
+                               _milli(x), _milli(y))
+
+
+def decode_command(data):
+    '''
+        Paquet de commande joystick -> Command (mêmes unités que le message JSON "command")
+
+        lève ValueError si le paquet n'est pas une commande
+    '''
+    if len(data) != COMMAND_PACKET.size or data[0] != PACKET_COMMAND:
+        raise ValueError(f"Not a command packet ({len(data)} bytes)")
+    kind, mode, seq, angle, distance, x, y = COMMAND_PACKET.unpack(data)
+    return Command(seq, angle, distance, x / 1000, y / 1000, mode)
+
+
+def encode_ack(seq,count):
+    return ACK_PACKET.pack(PACKET_ACK, seq & 0xFFFF, min(count, 0xFFFF))
+
+
+def _milli(value):
+    return max(-32768, min(32767, round(value * 1000)))
+
+
+def _clamp(value,high):
+    return max(0, min(high, int(round(value))))
+
+
+def encode_telemetry(seq,fields):
+    '''
+        Delta de télémétrie -> paquet binaire ; les groupes absents de fields valent zéro
+
+        Les champs sans place dans le paquet (JSON_GROUPS) restent à envoyer en JSON.
+    '''
+    present = 0
+    for bit, group in enumerate(TELEMETRY_GROUPS):
+        if group in fields:
+            present |= 1 << bit
+    auto = fields.get("auto", {})
+    watchdog = fields.get("watchdog", {})
+    link = fields.get("link", {})
+    x, y, theta = fields.get("pose", (0.0, 0.0, 0.0))
+    flags = (FLAG_AUTO_ACTIVE if auto.get("active") else 0) | (FLAG_WATCHDOG_ARMED if watchdog.get("armed") else 0)
+    return TELEMETRY_PACKET.pack(
+        PACKET_TELEMETRY, seq & 0xFFFFFFFF, present,
+        _clamp(fields.get("battery", 0), 255), flags, _clamp(auto.get("captures", 0), 255),
+        _clamp(watchdog.get("trips", 0), 0xFFFF),
+        x, y, theta,
+        _clamp(link.get("clients", 0), 255), _clamp(link.get("fps", 0) * 10, 0xFFFF),
+        _clamp(link.get("tier", 0), 255), _clamp(link.get("queue", 0), 255),
+        _clamp(link.get("latency", 0) * 10000, 0xFFFF),
+    )
+
+
+def decode_telemetry(data):
+    '''
+        Paquet de télémétrie -> (séquence, champs présents DICTIONNAIRE)
+    '''
+    (kind, seq, present, battery, flags, captures, trips, x, y, theta,
+     clients, fps, tier, queue, latency) = TELEMETRY_PACKET.unpack(data)
+    groups = {
+        "battery": battery,
+        "auto": {"active": bool(flags & FLAG_AUTO_ACTIVE), "captures": captures},
+        "watchdog": {"armed": bool(flags & FLAG_WATCHDOG_ARMED), "trips": trips},
+        "pose": (x, y, theta),
+        "link": {"clients": clients, "fps": fps / 10, "tier": tier, "queue": queue, "latency": latency / 10000},
+    }
+    return seq, {group: groups[group] for bit, group in enumerate(TELEMETRY_GROUPS) if present & (1 << bit)}
@@ -0,0 +1,436 @@
+'''
+Enregistrement et rejeu des images, détections, odométrie et commandes du robot
+
+Recorder écrit dans un fichier en ajout seul depuis son propre thread : le thread de
+capture ne fait que déposer l'image dans une file bornée (une image est perdue plutôt
+que de ralentir la capture). Chaque enregistrement est un en-tête RECORD_HEADER suivi
+de sa charge utile : JPEG pour les images, JSON pour le reste.
+
+Le rejeu (ReplayCamera, ReplayRobot) a la même interface que camera_Api et
+MovementControl : les images sont rendues aussi vite que possible, tranche par tranche,
+chaque rotation ou déplacement demandé par le mode auto passant à la tranche suivante.
+
+    ARTEFACT_RECORD=course.rec python remake.py
+    python recording.py course.rec --todo 7 9
+'''
+import os
+import sys
+import json
+import time
+import base64
+import queue
+import struct
+import argparse
+import threading
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+import numpy as np
+import cv2
+from simulation import tag_frame, read_tag
+from detection import Region, to_region
+
+logger = logging.getLogger(__name__)
+
+# En-tête de chaque enregistrement (little-endian) : type (u8), horodatage (f64), taille (u32)
+RECORD_HEADER = struct.Struct("<BdI")
+FRAME_SEQ = struct.Struct("<I")  # numéro de l'image, en tête de la charge utile JPEG
+RECORD_FRAME = 1
+RECORD_MARKERS = 2
+RECORD_COMMAND = 3
+RECORD_POSE = 4
+RECORD_JPEG_QUALITY = 95
+RECORD_MAX_PENDING = 16  # enregistrements en attente d'écriture avant d'en perdre (images brutes en mémoire)
+MOTION_COMMANDS = ("turn_precise", "move_precise", "move_arc")  # commandes qui délimitent les tranches du rejeu
+
+Record = namedtuple("Record", "kind timestamp data")
+
+
+class Recorder():
+    '''
+        Enregistreur en ajout seul, écrit par un thread dédié
+
+        arguments
+            path:  fichier d'enregistrement STRING
+            quality:  qualité JPEG des images enregistrées INT
+            max_pending:  taille de la file d'écriture INT
+    '''
+    def __init__(self,path,quality=RECORD_JPEG_QUALITY,max_pending=RECORD_MAX_PENDING):
+        self.path = path
+        self.quality = quality
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self.records = 0
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        logger.info(f"Recording to {self.path}")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Recording stopped - stats: {self.stats()}")
+
+    def _put(self,item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def on_frame(self,frame):
+        '''
+            Abonné du FrameBus : l'encodage JPEG se fait dans le thread d'écriture
+        '''
+        self._put((RECORD_FRAME, frame.timestamp, frame))
+
+    def on_markers(self,event):
+        '''
+            Abonné du DetectionWorker
+        '''
+        self._put((RECORD_MARKERS, event.detected_at, {"seq": event.seq, "markers": event.markers, "mode": event.mode}))
+
+    def command(self,name,*args):
+        self._put((RECORD_COMMAND, time.time(), {"name": name, "args": args}))
+
+    def pose(self,x,y,theta):
+        self._put((RECORD_POSE, time.time(), {"x": x, "y": y, "theta": theta}))
+
+    def _payload(self,kind,data):
+        if kind == RECORD_FRAME:
+            jpeg = data.jpeg(self.quality)
+            return FRAME_SEQ.pack(data.seq & 0xFFFFFFFF) + jpeg if jpeg is not None else None
+        # les détecteurs peuvent renvoyer des types numpy
+        return json.dumps(data, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o)).encode()
+
+    def run(self):
+        with open(self.path, "ab") as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                kind, timestamp, data = item
+                try:
+                    payload = self._payload(kind, data)
+                except Exception as e:
+                    logger.error(f"Failed to encode record {kind}: {e}")
+                    continue
+                if payload is None:
+                    continue
+                f.write(RECORD_HEADER.pack(kind, timestamp, len(payload)) + payload)
+                self.records += 1
+                self.frames += kind == RECORD_FRAME
+                self.bytes += RECORD_HEADER.size + len(payload)
+                if self._queue.empty():
+                    f.flush()  # écritures groupées tant que la file n'est pas vide
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "bytes": self.bytes,
+        }
+
+
+class _RecordingPositioning():
+    def __init__(self,positioning,recorder):
+        self._positioning = positioning
+        self._recorder = recorder
+
+    def __getattr__(self,name):
+        return getattr(self._positioning, name)
+
+    def set_position(self,x,y,theta):
+        self._positioning.set_position(x, y, theta)
+        self._recorder.pose(x, y, theta)
+
+    def find_target(self,targets):
+        result = self._positioning.find_target(targets)
+        self._recorder.pose(*self._positioning.get_position())
+        return result
+
+
+class RecordingRobot():
+    '''
+        Enveloppe d'un robot qui enregistre chaque commande et la pose qui en résulte
+
+        arguments
+            robot:  robot à piloter (MovementControl ou SimulatedRobot)
+            recorder:  Recorder
+    '''
+    def __init__(self,robot,recorder):
+        self._robot = robot
+        self._recorder = recorder
+        self._positioning = _RecordingPositioning(robot.get_positioning_system(), recorder)
+
+    def __getattr__(self,name):
+        attribute = getattr(self._robot, name)
+        if name == "move_arc":
+            # présent seulement si le robot enveloppé sait suivre un arc
+            return lambda *args: self._precise(name, *args)
+        return attribute
+
+    def _precise(self,name,*args):
+        self._recorder.command(name, *args)
+        result = getattr(self._robot, name)(*args)
+        self._recorder.pose(*self._positioning.get_position())
+        return result
+
+    def turn_precise(self,angle):
+        return self._precise("turn_precise", angle)
+
+    def move_precise(self,distance):
+        return self._precise("move_precise", distance)
+
+    def move_custom(self,mg,md):
+        self._recorder.command("move_custom", mg, md)
+        return self._robot.move_custom(mg, md)
+
+    def stop(self):
+        self._recorder.command("stop")
+        return self._robot.stop()
+
+    def get_positioning_system(self):
+        return self._positioning
+
+
+def read_records(path):
+    '''
+        Parcourt les enregistrements d'un fichier (Record) ; un dernier enregistrement
+        tronqué (arrêt brutal pendant l'écriture) est ignoré
+    '''
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, timestamp, size = RECORD_HEADER.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            if kind == RECORD_FRAME:
+                (seq,) = FRAME_SEQ.unpack_from(payload)
+                yield Record(kind, timestamp, (seq, payload[FRAME_SEQ.size:]))
+            else:
+                yield Record(kind, timestamp, json.loads(payload))
+
+
+class Replay():
+    '''
+        Contenu d'un enregistrement, découpé en tranches : la tranche k contient les images
+        capturées après la k-ième rotation ou le k-ième déplacement précis
+
+        arguments
+            path:  fichier produit par Recorder STRING
+    '''
+    def __init__(self,path):
+        self.frames = []            # (seq, timestamp, jpeg)
+        self.markers = {}           # seq -> balises détectées
+        self.segments = [0]         # indice de la première image de chaque tranche
+        self.poses = [None]         # dernière pose enregistrée dans chaque tranche
+        self.commands = 0
+        for record in read_records(path):
+            if record.kind == RECORD_FRAME:
+                seq, jpeg = record.data
+                self.frames.append((seq, record.timestamp, jpeg))
+            elif record.kind == RECORD_MARKERS:
+                self.markers[record.data["seq"]] = record.data["markers"]
+            elif record.kind == RECORD_COMMAND:
+                self.commands += 1
+                if record.data["name"] in MOTION_COMMANDS:
+                    self.segments.append(len(self.frames))
+                    self.poses.append(None)
+            elif record.kind == RECORD_POSE:
+                self.poses[-1] = (record.data["x"], record.data["y"], record.data["theta"])
+        self.marker_seqs = sorted(self.markers)
+        logger.info(f"Replay loaded from {path} - frames: {len(self.frames)}, detections: {len(self.markers)}, segments: {len(self.segments)}")
+
+    def segment_end(self,segment):
+        return self.segments[segment + 1] if segment + 1 < len(self.segments) else len(self.frames)
+
+    def markers_for(self,seq):
+        '''
+            Détection enregistrée pour l'image, ou la plus récente avant elle
+        '''
+        index = bisect_right(self.marker_seqs, seq)
+        return self.markers[self.marker_seqs[index - 1]] if index else []
+
+
+class ReplayCamera():
+    '''
+        Caméra rejouée, même interface que beacon_detection.camera_Api
+
+        Les images de la tranche courante sont rendues sans attendre ; à la fin de la tranche
+        la dernière image est répétée jusqu'à la commande suivante du robot. L'indice de
+        l'image est inscrit dans ses premières lignes (simulation.tag_frame) pour que
+        detect_markers retrouve la détection enregistrée, y compris dans le processus de
+        détection et sur une bande découpée par le suivi de balise.
+
+        arguments
+            replay:  Replay
+            detector:  détecteur réel à utiliser à la place des détections enregistrées
+    '''
+    def __init__(self,replay,detector=None):
+        self.replay = replay
+        self.detector = detector
+        self.segment = 0
+        self.cursor = 0
+        self._last = None
+        self._index = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def advance(self):
+        '''
+            Passe à la tranche suivante (appelé à chaque rotation ou déplacement précis)
+        '''
+        with self._lock:
+            if self.segment + 1 < len(self.replay.segments):
+                self.segment += 1
+                self.cursor = max(self.cursor, self.replay.segments[self.segment])
+
+    def get_camera_frame(self):
+        with self._lock:
+            if self.cursor < self.replay.segment_end(self.segment):
+                index = self.cursor
+                self.cursor += 1
+                self._last = cv2.imdecode(np.frombuffer(self.replay.frames[index][2], dtype=np.uint8), cv2.IMREAD_COLOR)
+                self._index = index
+            elif self._last is None:
+                return None
+            # chaque lecture est une nouvelle image, même répétée en fin de tranche : le compteur
+            # de lectures change son contenu pour que le FrameBus la publie
+            self.reads += 1
+            return tag_frame(self._last.copy(), np.array([self._index, self.reads], dtype=np.int64).tobytes())
+
+    def get_camera_frame_base64(self):
+        raw = self.get_camera_frame()
+        if raw is None:
+            return None
+        ok, buffer = cv2.imencode(".jpg", raw)
+        return base64.b64encode(buffer.tobytes()).decode("ascii") if ok else None
+
+    def detect_markers(self,frame):
+        if self.detector is not None:
+            return self.detector(frame)
+        payload, region, width = read_tag(frame, 16)
+        index = int(np.frombuffer(payload, dtype=np.int64)[0])
+        markers = self.replay.markers_for(self.replay.frames[index][0])
+        if region == Region(0, width, 1.0):
+            return markers
+        return to_region(markers, region, width)
+
+
+class ReplayPositioning():
+    def __init__(self,camera):
+        self.camera = camera
+        self.position = (0.0, 0.0, 0.0)
+
+    def set_position(self,x,y,theta):
+        self.position = (x, y, theta)
+
+    def get_position(self):
+        return self.position
+
+    def find_target(self,targets):
+        # le recalage rejoué est celui obtenu pendant l'enregistrement
+        pose = self.camera.replay.poses[self.camera.segment]
+        if pose is not None:
+            self.position = pose
+
+
+class ReplayRobot():
+    '''
+        Robot rejoué : les mouvements sont instantanés et font avancer la caméra rejouée
+    '''
+    def __init__(self,camera):
+        self.camera = camera
+        self.positioning = ReplayPositioning(camera)
+        self.commands = []
+
+    def turn_precise(self,angle):
+        self.commands.append(("turn_precise", angle))
+        self.camera.advance()
+
+    def move_precise(self,distance):
+        self.commands.append(("move_precise", distance))
+        self.camera.advance()
+
+    def move_arc(self,angle,radius):
+        self.commands.append(("move_arc", angle, radius))
+        self.camera.advance()
+
+    def move_custom(self,mg,md):
+        self.commands.append(("move_custom", mg, md))
+
+    def stop(self):
+        self.commands.append(("stop",))
+
+    def get_positioning_system(self):
+        return self.positioning
+
+
+def main(argv=None):
+    '''
+        Rejoue un enregistrement à travers run_second_algo, aussi vite que possible
+    '''
+    from log_config import setup_logging
+    setup_logging(os.environ.get("ARTEFACT_LOG_LEVEL", "INFO"))
+    import metrics
+    # le rejeu ne pilote aucun matériel : positionnement de la simulation
+    os.environ.setdefault("ARTEFACT_BACKEND", "sim")
+    try:
+        import control_logic_tracking.auto as auto
+    except ModuleNotFoundError as e:
+        if e.name != "control_logic_tracking":
+            raise
+        import auto  # arbre de ce dépôt seul : auto.py est à la racine
+    from frame_bus import FrameBus
+    from detection import DetectionWorker
+    from eval_client import EvalClient, LocalEvalServer
+
+    parser = argparse.ArgumentParser(description="Replay a recorded course through the auto mode")
+    parser.add_argument("path", help="file written by Recorder")
+    parser.add_argument("--todo", type=int, nargs="*", default=[], help="markers accepted by the local evaluation server")
+    parser.add_argument("--x", type=float, default=0.0, help="initial x position (mm)")
+    parser.add_argument("--y", type=float, default=0.0, help="initial y position (mm)")
+    args = parser.parse_args(argv)
+
+    camera = ReplayCamera(Replay(args.path))
+    robot = ReplayRobot(camera)
+    worker = DetectionWorker(camera.detect_markers)
+    worker.start()
+    eval_server = LocalEvalServer(todo=args.todo).start()
+    client = EvalClient(eval_server.url)
+    bus = FrameBus(camera.get_camera_frame, interval=0.005)
+    bus.start()
+    messages = []
+    started = time.perf_counter()
+    try:
+        auto.run_second_algo(messages.append, args.x, args.y, robot, bus, worker, client)
+    finally:
+        bus.stop()
+        worker.stop()
+        client.close()
+        eval_server.stop()
+    print(json.dumps({
+        "duration": time.perf_counter() - started,
+        "validated": eval_server.validated,
+        "commands": robot.commands,
+        "messages": messages,
+        "phases": {key: value for key, value in metrics.snapshot().items() if key.startswith("auto_phase_seconds")},
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
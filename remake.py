@@ -7,39 +7,315 @@ import time
 import secrets
 import threading
 import logging
-from queue import Queue
-from movement_control.mouvement_control import MovementControl
-import beacon_detection.camera_Api as camera
-import control_logic_tracking.auto as auto
-import web_control_interface.HTTP_server as http_srv
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+import struct
+import http
+from collections import deque, namedtuple
+from frame_bus import FrameBus, Frame
+from detection import DetectionWorker
+from eval_client import EvalClient
+from drive import MotorDispatcher, DeadmanWatchdog, DEADMAN_TIMEOUT, DEFAULT_ROBOT
+from simulation import load_backends, backend_name
+from recording import Recorder, RecordingRobot
+from web_assets import WebAssets
+from telemetry import Telemetry, TELEMETRY_PERIOD
+from protocol import PROTOCOL_JSON, PROTOCOL_BINARY, ACKS_EACH, ACKS_BATCH, negotiate, decode_command, encode_ack, encode_telemetry, JSON_GROUPS
+from log_config import setup_logging, HOT
+import metrics
+
+# Configure logging (background writer, levels from ARTEFACT_LOG_LEVEL / ARTEFACT_LOG_LEVELS)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Suppress websockets library DEBUG logs to avoid camera frame spam
-logging.getLogger('websockets.server').setLevel(logging.WARNING)
-logging.getLogger('websockets.protocol').setLevel(logging.WARNING)
+try:
+    import control_logic_tracking.auto as auto
+except ModuleNotFoundError as e:
+    if e.name != "control_logic_tracking":
+        raise  # dépendance manquante dans le paquet lui-même : ne pas la masquer
+    logger.warning("control_logic_tracking not installed - using auto.py from %s", os.path.dirname(os.path.abspath(__file__)))
+    import auto
+
+# En-tête des trames caméra binaires (little-endian) :
+#   type (u8), numéro de séquence (u32), horodatage de capture en secondes (f64), taille du JPEG (u32)
+FRAME_HEADER = struct.Struct("<BIdI")
+FRAME_KIND_JPEG = 1
+
+# Paliers du flux caméra, du meilleur au plus économe : résolution relative, qualité JPEG, images/s max
+StreamTier = namedtuple("StreamTier", "name scale quality max_fps")
+STREAM_TIERS = [
+    StreamTier("high", 1.0, 80, 25),
+    StreamTier("medium", 0.75, 65, 15),
+    StreamTier("low", 0.5, 50, 10),
+    StreamTier("minimal", 0.5, 35, 5),
+]
+STREAM_START_TIER = 1
+ADAPT_INTERVAL = 1.0        # période de réévaluation du palier de chaque client (s)
+ADAPT_UPGRADE_AFTER = 3     # réévaluations sans retard avant de monter d'un palier
+ADAPT_BUSY_RATIO = 0.5      # part du temps passé à envoyer au-delà de laquelle on descend d'un palier
+ADAPT_IDLE_RATIO = 0.2      # part en dessous de laquelle on peut remonter
+
+
+def encode_frame_packet(frame,tier=STREAM_TIERS[0]):
+    '''
+        Préfixe le JPEG d'une image du bus de l'en-tête binaire
 
+        Le paquet est gardé en cache sur l'image : un palier n'est encodé qu'une fois
+        par image, quel que soit le nombre de clients qui le reçoivent.
 
-class Server():
-    def __init__(self,robot):
-        logger.info("Initializing Server instance")
-        self.latest_frame=None
-        self.stop_event =threading.Event() #élément asyncio pour vérifier s il faut arrêter le serveur
-        self.connected_clients = set()
+        arguments
+            frame:  image publiée par le FrameBus (Frame)
+            tier:  palier de qualité du flux (StreamTier)
+
+        retourne les octets à envoyer tels quels sur la WebSocket, ou None si l'encodage échoue
+    '''
+    def build(frame):
+        payload = frame.jpeg(tier.quality, tier.scale)
+        if payload is None:
+            return None
+        return FRAME_HEADER.pack(FRAME_KIND_JPEG, frame.seq & 0xFFFFFFFF, frame.timestamp, len(payload)) + payload
+    return frame.memo(("packet", tier), build)
+
+
+# Nombre maximal de messages de contrôle en attente pour un client avant de le considérer bloqué
+CLIENT_MAX_PENDING = 256
+
+FRAME_LATENCY = metrics.histogram("frame_send_latency_seconds", "Camera capture to WebSocket send")
+METRICS_PATH = "/metrics"  # texte Prometheus, servi sur le port de la WebSocket
+WS_HOST = "0.0.0.0"
+WS_PORT = 8765
+ROBOT_PATH = "/robot"  # chemin WebSocket des sessions : /robot/<nom>
+BATTERY_PERIOD = 1.0  # période de relevé de la batterie (s)
+
+
+class ClientChannel():
+    '''
+        File d'envoi propre à un client WebSocket, vidée par sa propre tâche d'envoi
+
+        Les messages de contrôle (DICTIONNAIRE) ne sont jamais perdus et partent dans l'ordre.
+        Une seule image caméra (Frame) reste en attente : une image plus récente remplace
+        celle qui n'a pas encore été envoyée, si bien qu'un client lent ne retarde que lui-même.
+
+        Le palier du flux (STREAM_TIERS) s'adapte au client : le canal mesure le débit obtenu,
+        le temps passé à envoyer et les images perdues, descend d'un palier quand le lien
+        sature et remonte quand il reste de la marge.
+    '''
+    def __init__(self,websocket,protocol=PROTOCOL_JSON,acks=ACKS_EACH):
+        self.websocket = websocket
+        self.protocol = protocol      # PROTOCOL_JSON ou PROTOCOL_BINARY (commandes, acquittements, télémétrie)
+        self.acks = acks              # acquittement des commandes binaires
+        self.ack_seq = None           # dernière commande binaire reçue et pas encore acquittée
+        self.unacked = 0
+        self.address = websocket.remote_address
+        self.label = ":".join(map(str, self.address[:2])) if self.address else "unknown"  # étiquette des mesures
+        self.pending = deque()        # messages de contrôle en attente
+        self.pending_frame = None     # dernière image caméra en attente (Frame, paquet déjà encodé)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.closed = False
+        self.messages_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0       # images remplacées avant d'avoir pu partir
+        self.frames_throttled = 0     # images ignorées pour respecter la cadence du palier
+        self.tier_index = STREAM_START_TIER
+        self.last_frame_at = 0.0
+        self.throughput = 0.0         # débit mesuré en octets/s
+        self.fps = 0.0                # images envoyées par seconde sur la dernière fenêtre
+        self._fps_gauge = metrics.gauge("client_fps", "Frames sent per second", client=self.label)
+        self._depth_gauge = metrics.gauge("client_queue_depth", "Peak send queue depth over the last window", client=self.label)
+        self._window_start = time.monotonic()
+        self._window_busy = 0.0
+        self._window_bytes = 0
+        self._window_dropped = 0
+        self._window_frames = 0
+        self._window_depth = 0
+        self._good_windows = 0
+
+    @property
+    def tier(self):
+        return STREAM_TIERS[self.tier_index]
+
+    @property
+    def queue_depth(self):
+        return len(self.pending) + (self.pending_frame is not None)
+
+    def start(self):
+        self.task = asyncio.create_task(self.sender())
+
+    def wants_frame(self,now):
+        return now - self.last_frame_at >= 1.0 / self.tier.max_fps
+
+    def push(self,msg):
+        '''
+            Ajoute un message à la file du client sans jamais attendre le réseau
+
+            arguments
+                msg:  message DICTIONNAIRE, paquet binaire BYTES ou image caméra (Frame)
+        '''
+        if self.closed:
+            return
+        if isinstance(msg, Frame):
+            if not self.wants_frame(time.monotonic()):
+                self.frames_throttled += 1
+                return
+            # paquet encodé par RobotSession.on_frame sur le thread de capture, au palier courant
+            packet = msg.cached(("packet", self.tier))
+            if packet is None:
+                self.frames_throttled += 1  # palier pas encore demandé pour cette image : la suivante le sera
+                return
+            if self.pending_frame is not None:
+                self.frames_dropped += 1
+                self._window_dropped += 1
+            self.pending_frame = (msg, packet)
+        else:
+            if len(self.pending) >= CLIENT_MAX_PENDING:
+                logger.warning("Client %s stalled with %d pending messages - closing connection", self.address, len(self.pending))
+                self.closed = True
+                asyncio.ensure_future(self.websocket.close(code=1008, reason="client too slow"))
+                return
+            self.pending.append(msg)
+        self._window_depth = max(self._window_depth, self.queue_depth)
+        self.wakeup.set()
+
+    async def sender(self):
+        '''
+            Envoie les messages en attente, les messages de contrôle passant avant les images
+        '''
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.pending or self.pending_frame is not None:
+                    if self.pending:
+                        msg = self.pending.popleft()
+                        await self.websocket.send(msg if isinstance(msg, bytes) else json.dumps(msg))
+                        self.messages_sent += 1
+                    else:
+                        (frame, packet), self.pending_frame = self.pending_frame, None
+                        started = time.monotonic()
+                        self.last_frame_at = started
+                        await self.websocket.send(packet)
+                        FRAME_LATENCY.observe(time.time() - frame.timestamp)
+                        self.frames_sent += 1
+                        self._window_frames += 1
+                        self._window_busy += time.monotonic() - started
+                        self._window_bytes += len(packet)
+                    self.adapt()
+        except websockets.ConnectionClosed:
+            logger.debug("Sender stopped for client %s - connection closed", self.address)
+        finally:
+            self.closed = True
+
+    def adapt(self):
+        '''
+            Réévalue le palier du client une fois par ADAPT_INTERVAL
+        '''
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_INTERVAL:
+            return
+        busy = self._window_busy / elapsed
+        self.fps = self._window_frames / elapsed
+        self._fps_gauge.set(self.fps)
+        self._depth_gauge.set(self._window_depth)
+        if self._window_busy > 0:
+            self.throughput = self._window_bytes / self._window_busy
+        previous = self.tier_index
+        if (self._window_dropped or busy > ADAPT_BUSY_RATIO) and self.tier_index < len(STREAM_TIERS) - 1:
+            self.tier_index += 1
+            self._good_windows = 0
+        elif busy < ADAPT_IDLE_RATIO and not self._window_dropped:
+            self._good_windows += 1
+            if self._good_windows >= ADAPT_UPGRADE_AFTER and self.tier_index > 0:
+                self.tier_index -= 1
+                self._good_windows = 0
+        else:
+            self._good_windows = 0
+        if self.tier_index != previous:
+            logger.info("Client %s stream tier %s -> %s (busy: %.0f%%, dropped: %d, throughput: %.0f kB/s)",
+                        self.address, STREAM_TIERS[previous].name, self.tier.name, busy * 100, self._window_dropped, self.throughput / 1000)
+        self._window_start = now
+        self._window_busy = 0.0
+        self._window_bytes = 0
+        self._window_dropped = 0
+        self._window_frames = 0
+        self._window_depth = self.queue_depth
+
+    def acknowledge(self,seq):
+        '''
+            Commande binaire appliquée : acquittée tout de suite, au prochain tick, ou jamais
+        '''
+        if self.acks == ACKS_EACH:
+            self.push(encode_ack(seq, 1))
+        elif self.acks == ACKS_BATCH:
+            self.ack_seq = seq
+            self.unacked += 1
+
+    def flush_acks(self):
+        '''
+            Un seul acquittement pour toutes les commandes reçues depuis le précédent
+        '''
+        if self.unacked:
+            self.push(encode_ack(self.ack_seq, self.unacked))
+            self.unacked = 0
+
+    def close(self):
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+        metrics.remove("client_fps", client=self.label)
+        metrics.remove("client_queue_depth", client=self.label)
+
+    def stats(self):
+        return {
+            "address": str(self.address),
+            "queue_depth": self.queue_depth,
+            "messages_sent": self.messages_sent,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "frames_throttled": self.frames_throttled,
+            "protocol": self.protocol,
+            "tier": self.tier.name,
+            "throughput": self.throughput,
+            "fps": self.fps,
+        }
+
+
+class RobotSession():
+    '''
+        État propre à un robot hébergé par le Server : clients connectés, flux caméra,
+        mode auto, moteurs et batterie
+
+        La boucle asyncio, le serveur HTTP, le watchdog et les connexions au serveur
+        d'évaluation appartiennent au Server et sont partagés par toutes les sessions.
+
+        arguments
+            name:  nom du robot, les clients le rejoignent sur ROBOT_PATH/<name> STRING
+            robot:  robot à piloter
+            frame_bus:  images de la caméra du robot (FrameBus)
+            detection_worker:  détection des balises hors processus pour le mode auto
+    '''
+    def __init__(self,name,robot,frame_bus,detection_worker=None):
+        logger.info(f"Initializing robot session {name}")
+        self.name = name
+        self.server = None  # Server hôte, fixé par Server.add_session
+        self.frame_bus = frame_bus  # source d'images partagée avec le mode auto
+        self.detection_worker = detection_worker  # détection des balises hors processus pour le mode auto
+        self.connected_clients = {}  # websocket -> ClientChannel
         self.robot = robot   #robot a controler
-        self.stop_timer =None
+        self.motors = None  # moteurs du robot sur le MotorDispatcher commun, fixés par Server.add_session
         self.auto_mode_active = False #Vérifie si le robot est en mode automatique
         self.battery =100
-        self.key =1234  #clé de sécurité pour se connecter au serveur
-        self.message_queue = Queue()  # Queue for thread-to-websocket communication
         self.clients_lock = threading.Lock()
-        logger.debug(f"Server initialized - auto_mode_active: {self.auto_mode_active}, battery: {self.battery}")
+        # état diffusé aux clients : un message "telemetry" par tick avec les seuls champs changés
+        self.telemetry = Telemetry()
+        self.telemetry.update(battery=self.battery, auto={"active": False, "stages": [], "captures": 0})
+        self.telemetry.sampler("watchdog", self.watchdog_state)
+        self.telemetry.sampler("link", self.link_state)
+        self.connected_gauge = metrics.gauge("connected_clients", "Authenticated WebSocket clients", robot=name)
+        logger.debug(f"Robot session {name} initialized - auto_mode_active: {self.auto_mode_active}, battery: {self.battery}")
+
+    @property
+    def watchdog(self):
+        return self.server.watchdog
 
     def calibrage_vitesse(self,speed, rapport):
         ms = 0
@@ -51,150 +327,260 @@ class Server():
         else: # ==> mode sport
             ms = 400
         result = ms * speed
-        logger.debug(f"Speed calibration - input: speed={speed}, rapport={rapport}, base_ms={ms}, result={result}")
+        logger.debug("Speed calibration - input: speed=%s, rapport=%s, base_ms=%s, result=%s", speed, rapport, ms, result, extra=HOT)
         return result
 
-    def camera_loop(self):
-        logger.info("Camera loop started")
-        frame_count = 0
-        while True:
-            last = camera.get_camera_frame_base64()
-            if self.stop_event is not None and self.stop_event.is_set():
-                logger.info("Camera loop stop event detected")
-                break
-            if last is not None and last != self.latest_frame:
-                self.latest_frame= last
-                frame_count += 1
-                response = {"type": "camera_frame", "frame": self.latest_frame}
-                self.send_to_all_clients(response)
-            time.sleep(0.02)
-        logger.info("Camera loop stopped")
+    def on_frame(self,frame):
+        '''
+            Abonné du FrameBus : diffuse chaque nouvelle image aux clients connectés
+
+            arguments
+                frame:  image publiée par le bus (Frame)
+        '''
+        now = time.monotonic()
+        with self.clients_lock:
+            tiers = {c.tier for c in self.connected_clients.values() if c.wants_frame(now)}
+        if not tiers:
+            return  # personne n'attend d'image : inutile d'encoder
+        # chaque palier demandé est encodé une fois, ici, pour tous ses clients
+        for tier in tiers:
+            encode_frame_packet(frame, tier)
+        self.send_to_all_clients(frame)
 
 
     def batterie(self):
         '''
-        Récupère la batterie
+        Relève la batterie dans la télémétrie ; appelé par Server.batterie
         '''
-        logger.info("Battery monitoring loop started")
-        while True:
-            if self.stop_event is not None and self.stop_event.is_set():
-                logger.info("Battery loop stop event detected")
-                break
-            # nb = get_battery()
-            nb =1
-            if nb is not None and nb != self.battery:
-                    old_battery = self.battery
-                    self.battery= nb
-                    logger.info(f"Battery level changed: {old_battery} -> {self.battery}")
-                    response = {"type": "battery", "value": self.battery}
-                    self.send_to_all_clients(response)
-            time.sleep(0.1)
-        logger.info("Battery monitoring loop stopped")
-
+        # nb = get_battery()
+        nb =1
+        if nb is not None and nb != self.battery:
+                old_battery = self.battery
+                self.battery= nb
+                logger.info(f"Battery level changed on {self.name}: {old_battery} -> {self.battery}")
+                self.telemetry.update(battery=self.battery)
+
+    def watchdog_state(self):
+        '''
+        Échantillonneur de télémétrie : état du watchdog de ce robot
+        '''
+        stats = self.watchdog.stats(self.name)
+        return {"armed": stats["armed"], "trips": stats["trips"], "last_trip": stats["last_trip"]}
 
-    def stop_after_delay(self):
+    def link_state(self):
         '''
-        Arrête le robot si rien ne se passe après 5 secondes
+        Échantillonneur de télémétrie : état des liens avec les clients (appelé depuis la boucle)
         '''
-        logger.debug("Stop after delay timer started (5s)")
-        time.sleep(5)
-        logger.info("Stop after delay timer expired - stopping robot")
-        self.robot.stop()
+        with self.clients_lock:
+            channels = list(self.connected_clients.values())
+        return {
+            "clients": len(channels),
+            "fps": round(sum(c.fps for c in channels), 1),
+            "tier": max((c.tier_index for c in channels), default=STREAM_START_TIER),
+            "queue": max((c.queue_depth for c in channels), default=0),
+            "latency": FRAME_LATENCY.quantile(0.95),
+        }
+
+    def run_auto(self,x,y):
+        '''
+        Mode auto, dans son propre thread ; le robot repasse en mode manuel à la fin
+        '''
+        try:
+            auto.run_second_algo(self.send_to_all_clients,x,y,self.robot,self.frame_bus,self.detection_worker,self.server.eval_client,self.telemetry)
+        finally:
+            self.auto_mode_active = False
+
 
     def send_to_all_clients(self,msg):
         '''
-            Envoie un message à tous les clients connectés au serveur
+            Envoie un message à tous les clients connectés à ce robot
 
             arguments
-                msg:  message à envoyer DICTIONNAIRE
+                msg:  message à envoyer DICTIONNAIRE (JSON) ou image caméra (Frame)
+
+        '''
+        # Hand the message to the WebSocket loop from whichever thread produced it
+        loop = self.server.loop if self.server is not None else None
+        if loop is None:
+            return  # serveur WebSocket pas encore démarré : aucun client à prévenir
+        try:
+            loop.call_soon_threadsafe(self._push_to_all_clients, msg)
+        except RuntimeError:
+            pass  # boucle fermée pendant l'arrêt du serveur
 
+    def _push_to_all_clients(self,msg):
         '''
-        # Queue message for WebSocket thread to send
-        self.message_queue.put(msg)
+            Runs on the WebSocket loop and hands the message to every client's own send queue
+        '''
+        with self.clients_lock:
+            for channel in self.connected_clients.values():
+                channel.push(msg)
 
-    async def _async_send_to_all_clients(self,msg):
+    def client_stats(self):
         '''
-            Internal async method to actually send to WebSocket clients
+            Renvoie les compteurs d'envoi (file, trames envoyées/perdues) de chaque client connecté
         '''
         with self.clients_lock:
-            if self.connected_clients:
-                data = json.dumps(msg)
-                await asyncio.gather(*(client.send(data) for client in self.connected_clients), return_exceptions=True)
+            return [channel.stats() for channel in self.connected_clients.values()]
 
-    async def control(self,websocket, path):
+    def stats(self):
+        '''
+            Renvoie le message "stats" : mesures de latence et compteurs de tous les sous-systèmes
+        '''
+        return {
+            "type": "stats",
+            "robot": self.name,
+            "metrics": metrics.snapshot(),
+            "clients": self.client_stats(),
+            "motors": self.motors.stats(),
+            "watchdog": self.watchdog.stats(self.name),
+            "detection": self.detection_worker.stats() if self.detection_worker is not None else None,
+            "telemetry": self.telemetry.stats(),
+            "camera": self.frame_bus.stats(),
+            "robots": sorted(self.server.sessions),
+        }
+
+    def command(self,client_addr,angle,speed,x,y,mode):
+        '''
+            Applique une commande joystick, reçue en JSON ou en binaire
+
+            arguments
+                client_addr:  client qui commande (pour le watchdog)
+                angle:  direction du joystick en degrés INT
+                speed:  distance du joystick au centre INT
+                x, y:  position du joystick normalisée FLOAT
+                mode:  rapport de vitesse INT
+
+            retourne la vitesse calibrée, ou None si le mode auto refuse la commande
+        '''
+        logger.debug("Received 'command' message - auto_mode_active: %s", self.auto_mode_active, extra=HOT)
+        if self.auto_mode_active:
+            logger.warning("Command rejected - auto mode is active")
+            return None
+        logger.debug("Command parameters - angle: %s, speed: %s, x: %s, y: %s, mode: %s", angle, speed, x, y, mode, extra=HOT)
+
+        ms = self.calibrage_vitesse(speed, mode)
+        md = 0
+        mg = 0
+        #définit la vitesse à laquelle chaqque roues bouges
+        if angle > 180:
+            angle -= 360
+
+        if angle == 0 and speed == 0: # pas de mouvement si joystick neutre
+            self.motors.stop()
+            self.watchdog.feed(client_addr, moving=False, robot=self.name)
+            return ms  # surtout pas de move() derrière : il écraserait le stop dans le MotorDispatcher
+
+        if -90 < angle < 90 :
+            mx = abs(self.calibrage_vitesse(x, mode))
+            my = abs(self.calibrage_vitesse(y, mode))
+        else :
+            mx = -abs(self.calibrage_vitesse(x, mode))
+            my = -abs(self.calibrage_vitesse(y, mode))
+
+        if 0 < angle < 180 :
+            mg = mx
+            md = my
+        else :
+            mg = my
+            md = mx
+
+        #avance de mx de la roue droite et my de la roue gauche
+        logger.info("Executing robot movement - motor_left: %s, motor_right: %s", mg, md, extra=HOT)
+        self.motors.move(mg,md)
+
+        # Arrête le robot si plus aucune commande n'arrive avant le délai du watchdog
+        self.watchdog.feed(client_addr, moving=True, robot=self.name)
+        return ms
+
+    def binary_command(self,channel,client_addr,packet):
+        '''
+            Paquet de commande du protocole binaire : pas de réponse JSON, seulement
+            l'acquittement choisi par le client (un refus est toujours signalé)
+        '''
+        try:
+            command = decode_command(packet)
+        except ValueError as e:
+            logger.warning(f"Invalid binary packet from {client_addr}: {e}")
+            channel.push({"type": "error", "error": f"Paquet binaire invalide ({len(packet)} octets)"})
+            return
+        if self.command(client_addr, command.angle, command.distance, command.x, command.y, command.mode) is None:
+            channel.push({"type": "error", "error": "Mode auto actif, commandes désactivées", "seq": command.seq})
+            return
+        channel.acknowledge(command.seq)
+
+    def push_telemetry(self,message):
+        '''
+            Diffuse un delta de télémétrie : paquet binaire pour les clients qui l'ont négocié,
+            JSON pour les autres (sur la boucle asyncio)
+        '''
+        packet = None
+        detail = None
+        with self.clients_lock:
+            for channel in self.connected_clients.values():
+                if channel.protocol != PROTOCOL_BINARY:
+                    channel.push(message)
+                    continue
+                if packet is None:
+                    packet = encode_telemetry(message["seq"], message["fields"])
+                if detail is None:
+                    detail = {k: v for k, v in message["fields"].items() if k in JSON_GROUPS}
+                if detail:
+                    channel.push(dict(message, fields=detail))
+                channel.push(packet)
+
+    def flush_acks(self):
+        with self.clients_lock:
+            for channel in self.connected_clients.values():
+                channel.flush_acks()
+
+    async def control(self,websocket, path, protocol=PROTOCOL_JSON, acks=ACKS_EACH):
         '''
             Fournit l'ensemble des commandes sur la durée d'utilisation du serveur par l'utilisateur
 
             arguments
                 websocket:  fournit les méthodes pour envoyer/recevoir des messages
                 path:  le chemin URL du client STRING
+                protocol:  PROTOCOL_JSON ou PROTOCOL_BINARY, négocié avec la clé STRING
+                acks:  acquittement des commandes binaires (ACKS_EACH, ACKS_BATCH, ACKS_NONE) STRING
 
         '''
         client_addr = websocket.remote_address
-        logger.info(f"New client connected to control - address: {client_addr}, path: {path}")
+        logger.info(f"New client connected to control - robot: {self.name}, address: {client_addr}, path: {path}, protocol: {protocol}")
+        channel = ClientChannel(websocket, protocol, acks)
+        channel.start()
+        # les clients déjà là reçoivent les changements en attente, le nouveau l'état complet ;
+        # les ticks suivants n'envoient que les changements, à tous
+        message = self.telemetry.delta()
+        if message is not None:
+            self.push_telemetry(message)
+        channel.push(self.telemetry.snapshot())
         with self.clients_lock:
-            self.connected_clients.add(websocket) # Récupérer l'adresse de l'utilisateur
+            self.connected_clients[websocket] = channel # Récupérer l'adresse de l'utilisateur
+            self.connected_gauge.set(len(self.connected_clients))
             logger.debug(f"Client added to connected_clients - total clients: {len(self.connected_clients)}")
+        # la caméra ne tourne que si quelqu'un regarde
+        camera_owner = self.frame_bus.acquire(f"client {channel.label}")
         try:
             async for message in websocket:
+                if isinstance(message, bytes):
+                    # commande joystick du protocole binaire : acquittée selon channel.acks
+                    self.binary_command(channel, client_addr, message)
+                    continue
                 data = json.loads(message)
                 message_type = data.get("type")
 
                 if message_type == "command":
                     # Déplacements manuel du robot
-                    logger.debug(f"Received 'command' message - auto_mode_active: {self.auto_mode_active}")
-                    if self.auto_mode_active:
-                        logger.warning("Command rejected - auto mode is active")
+                    ms = self.command(client_addr, data.get("angle"), data.get("distance", 100), data.get("x"), data.get("y"), data.get("mode", 1))
+                    if ms is None:
                         response = {"type": "error", "error": "Mode auto actif, commandes désactivées"}
                     else:
-                        angle = data.get("angle")
-                        speed = data.get("distance", 100)
-                        x = data.get("x")
-                        y = data.get("y")
-                        mode = data.get("mode", 1)
-                        logger.debug(f"Command parameters - angle: {angle}, speed: {speed}, x: {x}, y: {y}, mode: {mode}")
-
-                        ms = self.calibrage_vitesse(speed, mode)
-                        md = 0
-                        mg = 0
-                        #définit la vitesse à laquelle chaqque roues bouges
-                        if angle > 180:
-                            angle -= 360
-
-                        if angle == 0 and speed == 0: # pas de mouvement si joystick neutre
-                            self.robot.stop()
-
-                        if -90 < angle < 90 :
-                            mx = abs(self.calibrage_vitesse(x, mode))
-                            my = abs(self.calibrage_vitesse(y, mode))
-                        else :
-                            mx = -abs(self.calibrage_vitesse(x, mode))
-                            my = -abs(self.calibrage_vitesse(y, mode))
-
-                        if 0 < angle < 180 :
-                            mg = mx
-                            md = my
-                        else :
-                            mg = my
-                            md = mx
-
-                        #avance de mx de la roue droite et my de la roue gauche
-                        logger.info(f"Executing robot movement - motor_left: {mg}, motor_right: {md}")
-                        self.robot.move_custom(mg,md)
-
-                        # Arrête le mouvement après 3 itérations si plus de commande reçue
-                        if self.stop_timer is not None:
-                            self.stop_timer.cancel()
-                            logger.debug("Previous stop timer cancelled")
-                        self.stop_timer = threading.Timer(5.0, self.robot.stop)
-                        self.stop_timer.daemon = True
-                        self.stop_timer.start()
-                        logger.debug("New stop timer started (5s)")
                         response = {"type": "command", "status": "command received","speed":ms }
 
                 elif message_type == "start_auto":
                     #Déplacement automatique du robot
-                    logger.info(f"Received 'start_auto' message - current auto_mode_active: {self.auto_mode_active}")
+                    logger.info(f"Received 'start_auto' message - robot: {self.name}, current auto_mode_active: {self.auto_mode_active}")
                     if not self.auto_mode_active:
                         init_pos = data.get("init_pos", {})
                         x = init_pos.get("x", 0)
@@ -204,19 +590,24 @@ class Server():
                         response = {"type": "auto_started", "msg": "Mode auto activé"}
                         # Start auto mode in a separate thread
                         logger.debug("Launching auto mode thread")
-                        auto_thread = threading.Thread(target=auto.run_second_algo, args=(self.send_to_all_clients,x,y,self.robot), daemon=True)
+                        auto_thread = threading.Thread(target=self.run_auto, args=(x,y), daemon=True)
                         auto_thread.start()
                         logger.info("Auto mode thread started successfully")
                     else:
                         logger.warning("Auto mode start rejected - already active")
                         response = {"type": "error", "msg": "Mode auto déjà actif"}
 
+                elif message_type == "stats":
+                    # disponible aussi en mode auto : ne touche pas au robot
+                    response = self.stats()
+
                 elif message_type == "stop_server":
                     logger.warning("Received 'stop_server' message - initiating server shutdown")
                     response = {"type": "server_stopped", "msg": "Serveur arrêté"}
+                    channel.close()
                     await websocket.send(json.dumps(response))
                     logger.info("Stop event set - server will shutdown")
-                    self.stop_event.set()
+                    self.server.stop_event.set()
                     await websocket.close()
                     return
 
@@ -224,20 +615,140 @@ class Server():
                 else:
                     logger.warning(f"Unknown message type received: {message_type}")
                     response = {"type": "error", "error": f"Unknown message type: {message_type}"}
-                await websocket.send(json.dumps(response))
+                channel.push(response)
 
         except websockets.ConnectionClosed:
             logger.info(f"WebSocket connection closed for client: {client_addr}")
         except Exception as e:
             logger.error(f"Error in control loop for client {client_addr}: {e}", exc_info=True)
         finally:
+            self.frame_bus.release(camera_owner)
+            self.watchdog.forget(client_addr, robot=self.name)
+            channel.close()
             with self.clients_lock:
-                self.connected_clients.discard(websocket)
+                self.connected_clients.pop(websocket, None)
+                self.connected_gauge.set(len(self.connected_clients))
                 logger.debug(f"Client removed from connected_clients - remaining: {len(self.connected_clients)}")
 
+
+class Server():
+    '''
+        Passerelle WebSocket hébergeant une ou plusieurs sessions de robot (RobotSession)
+
+        Un client choisit son robot par le chemin (ROBOT_PATH/<nom>) ou par le champ "robot"
+        du message de clé ; sinon il rejoint la première session ajoutée. La boucle asyncio,
+        le port HTTP (/metrics et l'interface web), le watchdog, la surveillance de la batterie
+        et le pool de connexions au serveur d'évaluation sont communs à toutes les sessions.
+
+        arguments
+            eval_client:  connexions au serveur d'évaluation (EvalClient)
+            deadman_timeout:  délai sans commande avant l'arrêt d'un robot en secondes FLOAT
+            assets:  fichiers de l'interface web servis sur le même port (WebAssets)
+    '''
+    def __init__(self,eval_client=None,deadman_timeout=DEADMAN_TIMEOUT,assets=None):
+        logger.info("Initializing Server instance")
+        self.eval_client = eval_client if eval_client is not None else EvalClient()  # connexions au serveur d'évaluation, gardées entre deux runs
+        self.stop_event =threading.Event() #élément asyncio pour vérifier s il faut arrêter le serveur
+        self.watchdog = DeadmanWatchdog(timeout=deadman_timeout)  # un seul thread pour l'arrêt de tous les robots
+        self.motors = MotorDispatcher()  # un seul thread applique les commandes manuelles de tous les robots
+        self.sessions = {}  # nom -> RobotSession, dans l'ordre d'ajout
+        self.key =1234  #clé de sécurité pour se connecter au serveur
+        self.loop = None  # boucle asyncio du serveur WebSocket, fixée au démarrage
+        self.assets = assets  # interface web, servie par process_request
+
+    def add_session(self,session):
+        '''
+            Héberge un robot de plus
+
+            arguments
+                session:  RobotSession
+
+            retourne la session
+        '''
+        if session.name in self.sessions:
+            raise ValueError(f"Robot session already exists: {session.name}")
+        session.server = self
+        session.motors = self.motors.attach(session.name, session.robot)
+        self.watchdog.watch(session.name, session.motors.stop)
+        self.sessions[session.name] = session
+        logger.info(f"Robot session {session.name} added - path: {ROBOT_PATH}/{session.name}")
+        return session
+
+    def session_for(self,path,robot=None):
+        '''
+            Session désignée par le chemin de la WebSocket, sinon par robot, sinon la première
+
+            retourne la RobotSession, ou None si le robot demandé n'existe pas
+        '''
+        if path.startswith(ROBOT_PATH + "/"):
+            robot = path[len(ROBOT_PATH) + 1:].strip("/")
+        if robot is None:
+            return next(iter(self.sessions.values()), None)
+        return self.sessions.get(str(robot))
+
+    def start(self):
+        '''
+            Démarre les threads communs à toutes les sessions (moteurs, watchdog, batterie)
+        '''
+        self.motors.start()
+        self.watchdog.start()
+        battery_thread = threading.Thread(target=self.batterie, daemon=True)
+        battery_thread.start()
+
+    def shutdown(self):
+        self.motors.shutdown()
+        self.watchdog.shutdown()
+
+    def batterie(self):
+        '''
+        Récupère la batterie de tous les robots, dans un seul thread
+        '''
+        logger.info("Battery monitoring loop started")
+        while True:
+            if self.stop_event is not None and self.stop_event.is_set():
+                logger.info("Battery loop stop event detected")
+                break
+            for session in list(self.sessions.values()):
+                session.batterie()
+            self.stop_event.wait(BATTERY_PERIOD)
+        logger.info("Battery monitoring loop stopped")
+
+    async def telemetry_loop(self):
+        '''
+            Tâche de la boucle asyncio : une fois par TELEMETRY_PERIOD, envoie à chaque client
+            les champs de télémétrie de son robot qui ont changé, et les acquittements groupés
+        '''
+        while True:
+            await asyncio.sleep(TELEMETRY_PERIOD)
+            for session in list(self.sessions.values()):
+                if not session.connected_clients:
+                    continue  # personne à prévenir : l'état complet partira à la connexion
+                message = session.telemetry.delta()
+                if message is not None:
+                    session.push_telemetry(message)
+                # acquittements groupés des commandes binaires reçues pendant le tick
+                session.flush_acks()
+
+    async def process_request(self,path,request_headers):
+        '''
+            Répond en HTTP avant la poignée de main WebSocket : METRICS_PATH (format texte
+            Prometheus), puis les fichiers de l'interface web ; les demandes de WebSocket
+            sont laissées à la WebSocket
+        '''
+        if path == METRICS_PATH:
+            body = metrics.render_prometheus().encode()
+            return http.HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")], body
+        if self.assets is None or request_headers.get("Upgrade", "").lower() == "websocket":
+            return None
+        response = self.assets.response(path, request_headers)
+        if response is None:
+            return http.HTTPStatus.NOT_FOUND, [("Content-Type", "text/plain; charset=utf-8")], b"Not found\n"
+        return response
+
     async def handler(self,websocket, path):
         '''
             Vérifie si l'utilisateur transmet bien la clé de sécurité avant de le laisser utiliser les commandes
+            du robot choisi
 
             arguments
                 websocket:  fournit les méthodes pour envoyer/recevoir des messages
@@ -250,16 +761,22 @@ class Server():
         logger.info(f"New connection attempt - client: {client_addr}, path: {path}")
         try:
             async for message in websocket:
-                data = json.loads(message)
+                data = json.loads(message) if isinstance(message, str) else {}  # paquet binaire avant la clé : refusé
                 message_type = data.get("type")
                 if message_type == "key":
                     value = data.get("value")
-                    if value == key:
-                        logger.info(f"Authentication successful for client: {client_addr}")
-                        response = {"type": "connexion", "body": f"bonne cle connexion au serveur"}
+                    session = self.session_for(path, data.get("robot"))
+                    if session is None:
+                        logger.warning(f"Unknown robot requested by client: {client_addr} - path: {path}, robot: {data.get('robot')}")
+                        response = {"type": "error", "error": f"Robot inconnu, disponibles : {sorted(self.sessions)}"}
+                        await websocket.send(json.dumps(response))
+                    elif value == key:
+                        protocol, acks = negotiate(data)
+                        logger.info(f"Authentication successful for client: {client_addr} - robot: {session.name}, protocol: {protocol}")
+                        response = {"type": "connexion", "body": f"bonne cle connexion au serveur", "robot": session.name, "protocol": protocol, "acks": acks}
 
                         await websocket.send(json.dumps(response))
-                        await self.control(websocket, path)
+                        await session.control(websocket, path, protocol, acks)
                     else :
                         logger.warning(f"Authentication failed for client: {client_addr} - incorrect key")
                         response = {"type": "error", "error": f"Mauvaise cle de securite"}
@@ -273,23 +790,9 @@ class Server():
         except Exception as e:
             logger.error(f"Error in handler for client {client_addr}: {e}", exc_info=True)
 
-    async def queue_consumer(self):
-        '''
-            Consumes messages from queue and sends to WebSocket clients
-        '''
-        loop = asyncio.get_event_loop()
-        while not self.stop_event.is_set():
-            try:
-                # Non-blocking get with timeout
-                msg = await loop.run_in_executor(None, self.message_queue.get, True, 0.1)
-                await self._async_send_to_all_clients(msg)
-            except:
-                # Queue empty or timeout
-                await asyncio.sleep(0.01)
 
 
-
-def websocket_server_thread(server):
+def websocket_server_thread(server,host=WS_HOST,port=WS_PORT):
     '''
         Runs the WebSocket server in its own event loop
     '''
@@ -298,43 +801,91 @@ def websocket_server_thread(server):
     asyncio.set_event_loop(loop)
 
     async def run_server():
-        async with websockets.serve(server.handler, "0.0.0.0", 8765):
-            logger.info("WebSocket server listening on 0.0.0.0:8765")
-            # Start queue consumer
-            consumer_task = asyncio.create_task(server.queue_consumer())
-            logger.debug("Queue consumer task created")
-            # Wait for stop event
-            while not server.stop_event.is_set():
-                await asyncio.sleep(0.1)
+        async with websockets.serve(server.handler, host, port, process_request=server.process_request):
+            logger.info(f"WebSocket server listening on {host}:{port} - robots: {[ROBOT_PATH + '/' + name for name in server.sessions]} (web UI on http://{host}:{port}/, metrics on {METRICS_PATH})")
+            # Producer threads can now hand messages straight to this loop
+            server.loop = loop
+            telemetry = asyncio.create_task(server.telemetry_loop())
+            # Wait for stop event without polling
+            await loop.run_in_executor(None, server.stop_event.wait)
             logger.warning("Stop event triggered - shutting down WebSocket server")
-            consumer_task.cancel()
-            logger.debug("Queue consumer task cancelled")
+            telemetry.cancel()
+            server.loop = None
 
     loop.run_until_complete(run_server())
     logger.info("WebSocket server thread ended")
 
 
-def main():
-    logger.info("=== Starting main application ===")
+def robot_names():
+    '''
+        Robots hébergés par le processus : ARTEFACT_ROBOTS="alpha,beta" (un seul robot, DEFAULT_ROBOT, sinon)
+    '''
+    names = [n.strip() for n in os.environ.get("ARTEFACT_ROBOTS", DEFAULT_ROBOT).split(",") if n.strip()]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate robot names in ARTEFACT_ROBOTS: {names}")
+    return names
+
 
-    # Start HTTP server in daemon thread
-    logger.info("Starting HTTP server thread")
-    t = threading.Thread(target=http_srv.start_server, daemon=True)
-    t.start()
+def record_path(path,name,several):
+    '''
+        Fichier d'enregistrement d'un robot : ARTEFACT_RECORD tel quel pour un seul robot,
+        suffixé du nom du robot sinon
+    '''
+    if not several:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{name}{ext}"
 
-    # Create server instance
-    logger.info("Creating Server instance with MovementControl")
-    server = Server(MovementControl())
 
-    # Start camera loop in daemon thread
-    logger.info("Starting camera loop thread")
-    camera_thread = threading.Thread(target=server.camera_loop, daemon=True)
-    camera_thread.start()
+def main():
+    logger.info("=== Starting main application ===")
 
-    # Start battery monitoring in daemon thread
-    logger.info("Starting battery monitoring thread")
-    battery_thread = threading.Thread(target=server.batterie, daemon=True)
-    battery_thread.start()
+    names = robot_names()
+    # Pas encore de backend pour piloter un robot distant : le matériel se limite au robot local
+    if len(names) > 1 and backend_name() != "sim":
+        raise ValueError("Several robots in one process need ARTEFACT_BACKEND=sim: there is no remote-robot backend yet, the hardware backend drives the local robot only")
+
+    # Web UI served by the WebSocket loop, loaded and compressed once at startup
+    server = Server(assets=WebAssets())
+    recorders = []
+    for name in names:
+        # Real hardware, or the simulated robot and camera with ARTEFACT_BACKEND=sim
+        robot, camera = load_backends()
+
+        # Optional recording of frames, detections, odometry and commands for offline replay
+        recorder = None
+        if os.environ.get("ARTEFACT_RECORD"):
+            recorder = Recorder(record_path(os.environ["ARTEFACT_RECORD"], name, len(names) > 1))
+            robot = RecordingRobot(robot, recorder)
+
+        # Fork the marker detection process before the camera, motor and server threads
+        # start; the log writer thread is paused around the fork (log_config.paused)
+        logger.info(f"Starting marker detection process for {name}")
+        detection_worker = DetectionWorker(camera.detect_markers)
+        detection_worker.start()
+
+        # One camera producer per robot, shared by its web stream and its auto mode
+        frame_bus = FrameBus(camera.get_camera_frame)
+        logger.info(f"Creating robot session {name} with {type(robot).__name__}")
+        session = server.add_session(RobotSession(name, robot, frame_bus, detection_worker))
+        frame_bus.subscribe(session.on_frame)
+        if recorder is not None:
+            frame_bus.subscribe(recorder.on_frame)
+            detection_worker.subscribe(recorder.on_markers)
+            recorders.append(recorder)
+
+    for recorder in recorders:
+        recorder.start()
+
+    # Start camera capture in its own daemon thread
+    logger.info("Starting frame bus capture threads")
+    for session in server.sessions.values():
+        session.frame_bus.start()
+
+    # One motor dispatcher thread (joystick commands never touch the hardware from the
+    # event loop), the deadman watchdog and battery monitoring, shared by every robot
+    logger.info("Starting motor dispatcher, deadman watchdog and battery monitoring")
+    server.start()
 
     # Start WebSocket server in its own thread (non-daemon to keep main alive)
     logger.info("Starting WebSocket server thread")
@@ -349,6 +900,13 @@ def main():
     # Wait for WebSocket thread to finish
     logger.info("Waiting for WebSocket thread to finish (timeout: 5s)")
     ws_thread.join(timeout=5)
+    for session in server.sessions.values():
+        session.frame_bus.stop()
+    server.shutdown()
+    for session in server.sessions.values():
+        session.detection_worker.stop()
+    for recorder in recorders:
+        recorder.stop()
     logger.info("=== Application shutdown complete ===")
 
 
@@ -23,10 +23,102 @@ let autoFullScreen = false;
     
 
 /************ WEBSOCKET *************/
-const ws = new WebSocket("ws://robotpi-62.enst.fr:8765");
+// Robot piloté : ?robot=<nom> dans l'adresse de la page, sinon le robot par défaut du serveur
+const robotName = new URLSearchParams(window.location.search).get("robot");
+const ws = new WebSocket("ws://robotpi-62.enst.fr:8765" + (robotName ? "/robot/" + encodeURIComponent(robotName) : ""));
 const batteryDisplay = document.getElementById("battery");
 const cameraImg = document.getElementById("camera");
 const status = document.getElementById("status");
+ws.binaryType = "arraybuffer";
+
+// Trame caméra binaire : type (u8), séquence (u32), horodatage (f64), taille (u32), puis le JPEG
+const FRAME_HEADER_SIZE = 17;
+const FRAME_KIND_JPEG = 1;
+let frameUrl = null;
+let lastFrameSeq = -1;
+
+// Protocole binaire compact (voir protocol.py), demandé avec la clé : commandes joystick,
+// acquittements et télémétrie en paquets little-endian dont le premier octet donne le type
+const PACKET_COMMAND = 2;
+const PACKET_ACK = 3;
+const PACKET_TELEMETRY = 4;
+const COMMAND_PACKET_SIZE = 12;
+const TELEMETRY_PACKET_SIZE = 31;
+const TELEMETRY_GROUPS = ["battery", "auto", "watchdog", "pose", "link"];
+let binaryProtocol = false;
+let commandSeq = 0;
+let lastAckSeq = -1;
+
+function encodeCommand(command) {
+    const view = new DataView(new ArrayBuffer(COMMAND_PACKET_SIZE));
+    commandSeq = (commandSeq + 1) & 0xFFFF;
+    view.setUint8(0, PACKET_COMMAND);
+    view.setUint8(1, command.mode);
+    view.setUint16(2, commandSeq, true);
+    view.setUint16(4, command.angle % 360, true);
+    view.setUint16(6, command.distance, true);
+    view.setInt16(8, Math.max(-32768, Math.min(32767, Math.round(command.x * 1000))), true);
+    view.setInt16(10, Math.max(-32768, Math.min(32767, Math.round(command.y * 1000))), true);
+    return view.buffer;
+}
+
+function decodeTelemetry(view) {
+    const present = view.getUint16(5, true);
+    // auto et watchdog : leur détail arrive en JSON juste avant le paquet, même séquence
+    const groups = {
+        battery: view.getUint8(7),
+        pose: [view.getFloat32(12, true), view.getFloat32(16, true), view.getFloat32(20, true)],
+        link: {
+            clients: view.getUint8(24),
+            fps: view.getUint16(25, true) / 10,
+            tier: view.getUint8(27),
+            queue: view.getUint8(28),
+            latency: view.getUint16(29, true) / 10000,
+        },
+    };
+    const fields = {};
+    TELEMETRY_GROUPS.forEach((group, bit) => {
+        if ((present & (1 << bit)) && group in groups) fields[group] = groups[group];
+    });
+    return { type: "telemetry", seq: view.getUint32(1, true), full: false, fields };
+}
+
+function onBinaryMessage(buffer) {
+    if (buffer.byteLength < 1) return;
+    const view = new DataView(buffer);
+    switch (view.getUint8(0)) {
+        case FRAME_KIND_JPEG:
+            return showCameraFrame(view);
+        case PACKET_TELEMETRY:
+            if (buffer.byteLength === TELEMETRY_PACKET_SIZE) applyTelemetry(decodeTelemetry(view));
+            return;
+        case PACKET_ACK:
+            lastAckSeq = view.getUint16(1, true);
+            return;
+    }
+}
+
+function showCameraFrame(view) {
+    const buffer = view.buffer;
+    if (buffer.byteLength < FRAME_HEADER_SIZE) return;
+    const seq = view.getUint32(1, true);
+    const size = view.getUint32(13, true);
+    if (seq === lastFrameSeq) return;
+    lastFrameSeq = seq;
+
+    if (size === 0) {
+        cameraImg.src = getRandomFallbackImage();
+        return;
+    }
+    const blob = new Blob([new Uint8Array(buffer, FRAME_HEADER_SIZE, size)], { type: "image/jpeg" });
+    const previous = frameUrl;
+    frameUrl = URL.createObjectURL(blob);
+    cameraImg.src = frameUrl;
+    if (autoFullScreen) {
+        fullPage.style.backgroundImage = `url(${frameUrl})`;
+    }
+    if (previous) URL.revokeObjectURL(previous);
+}
 
 ws.onopen = () => {
     status.textContent = "Connecté ";
@@ -40,29 +132,55 @@ ws.onerror = () => {
     status.textContent = "Erreur ";
     serverLog("Erreur WebSocket");
 };
+// État du robot reconstitué à partir des messages "telemetry" : l'état complet à la
+// connexion, puis seulement les champs qui ont changé
+const telemetry = {};
+let telemetrySeq = -1;
+let watchdogTrips = -1;  // déclenchements déjà signalés (-1 : pas encore d'état)
+
+function applyTelemetry(message) {
+    // un paquet binaire suit le message JSON de même séquence (auto, watchdog)
+    if (!message.full && message.seq < telemetrySeq) return;
+    telemetrySeq = message.seq;
+    Object.assign(telemetry, message.fields);
+    const fields = message.fields;
+
+    if ("battery" in fields)
+        batteryDisplay.textContent = "Batterie: " + fields.battery + "%";
+
+    if ("auto" in fields) {
+        const auto = fields.auto;
+        if (!auto.active) autoBtn.classList.remove("auto-active");
+        if (auto.active && auto.stages.length)
+            status.textContent = "Auto : " + auto.stages.join(", ") + " (" + auto.captures + "/2)";
+        else if (ws.readyState === WebSocket.OPEN)
+            status.textContent = "Connecté ";
+    }
+
+    if ("watchdog" in fields && fields.watchdog.trips > watchdogTrips) {
+        if (watchdogTrips >= 0) {
+            const trip = fields.watchdog.last_trip;
+            if (trip.reason === "disconnect")
+                serverLog("Arrêt de sécurité : dernier client actif déconnecté");
+            else
+                serverLog("Arrêt de sécurité : aucune commande depuis " + trip.idle.toFixed(1) + " s");
+        }
+        watchdogTrips = fields.watchdog.trips;
+    }
+}
+
 ws.onmessage = event => {
+    if (event.data instanceof ArrayBuffer) return onBinaryMessage(event.data);
+
     let data;
     try { data = JSON.parse(event.data); }
     catch { return serverLog("JSON invalide"); }
 
-    if (data.type !== "camera_frame") {
-        serverLog("Réception : " + event.data);
-    }
+    if (data.type === "telemetry") return applyTelemetry(data);
 
-    if (data.type === "battery")
-        batteryDisplay.textContent = "Batterie: " + data.level + "%";
+    serverLog("Réception : " + event.data);
 
-    if (data.type === "camera_frame"){
-       if (data.frame) {
-           cameraImg.src = "data:image/jpeg;base64," + data.frame;
-       }else{
-           const fallback = getRandomFallbackImage();
-            cameraImg.src = fallback;
-       }
-    if (autoFullScreen) {
-            fullPage.style.backgroundImage = `url(${cameraImg.src})`;
-        }
-    }
+    if (data.type === "connexion") binaryProtocol = data.protocol === "binary";
 
     if (data.type === "auto_started") {
         // Passage en mode plein écran caméra après confirmation serveur idée de ouf
@@ -129,7 +247,7 @@ connectBTN.onclick = () => {
     const text = document.getElementById("key").value;
 
     serverLog("Envoi clef" );
-    ws.send(JSON.stringify({ type: "key",value:text}));
+    ws.send(JSON.stringify({ type: "key",value:text, protocol: "binary", acks: "batch" }));
 };
 
 document.getElementById('closeFullscreen').onclick = () => {
@@ -238,7 +356,7 @@ setInterval(() => {
         current.x !== lastSent.x ||
         current.y !== lastSent.y
     ) {
-        ws.send(JSON.stringify(current));
+        ws.send(binaryProtocol ? encodeCommand(current) : JSON.stringify(current));
 
         lastSent.angle = current.angle;
         lastSent.distance = current.distance;
@@ -0,0 +1,339 @@
+'''
+Robot et caméra simulés, pour faire tourner le serveur et le mode auto sans matériel
+
+SimulatedRobot reproduit l'interface de MovementControl (turn_precise, move_precise,
+move_custom, stop, get_positioning_system) avec une cinématique de robot différentiel :
+les mouvements précis bloquent pendant leur durée réelle (multipliée par time_scale)
+et la pose évolue continûment pendant le mouvement. SimulatedCamera reproduit
+l'interface de camera_Api : chaque image est dessinée d'après la pose du robot et
+porte cette pose dans ses premières lignes (tag_frame), ce qui permet à detect_markers de
+retrouver les balises visibles, y compris dans le processus de détection et sur une bande
+découpée par le suivi de balise.
+
+Le choix du matériel se fait avec load_backends, ou depuis l'environnement :
+
+    ARTEFACT_BACKEND=sim python remake.py
+'''
+import os
+import time
+import base64
+import threading
+import logging
+from math import atan2, cos, sin, pi, hypot, degrees, radians
+import numpy as np
+import cv2
+from localization import BEACON_MAP
+from detection import Region, column, to_region
+from planning import LINEAR_SPEED, ANGULAR_SPEED, WHEEL_BASE, arc_speed, Limits
+
+logger = logging.getLogger(__name__)
+
+CAMERA_FOV = 62.0        # champ horizontal de la caméra (degrés)
+CAMERA_RANGE = 4000.0    # distance maximale de détection (mm)
+FRAME_SIZE = (640, 480)  # (largeur, hauteur) des images simulées
+MIN_MARKER_PIXELS = 12   # côté minimal d'une balise détectée dans une image réduite (px)
+TAG_MAGIC = bytes((0xA5, 0x5A))  # début du bandeau de tag_frame
+
+# Balises du terrain simulé (mm) : les balises fixes de la localisation, puis celles à capturer
+SIM_MARKERS = {
+    **BEACON_MAP,
+    7: (1800.0, 600.0),
+    9: (500.0, -800.0),
+}
+SIM_TARGETS = [7, 9]  # ordre de capture attendu par le serveur d'évaluation simulé
+
+
+def _normalize(angle):
+    return (angle + pi) % (2 * pi) - pi
+
+
+def tag_frame(raw,payload):
+    '''
+        Inscrit payload (BYTES) dans les premières lignes de l'image, pour les détecteurs simulés
+        et rejoués
+
+        Chaque octet occupe deux lignes et chaque colonne porte aussi son indice (par paires) :
+        une bande découpée par le DetectionWorker, réduite de moitié ou non, garde le bandeau
+        et dit d'où elle vient (read_tag).
+    '''
+    height, width = raw.shape[:2]
+    header = np.frombuffer(TAG_MAGIC + np.uint16(width).tobytes(), dtype=np.uint8)
+    columns = (np.arange(width) // 2 * 2).astype("<u2").view(np.uint8).reshape(width, 2).T
+    rows = np.vstack([
+        np.repeat(header[:, None], width, axis=1),
+        columns,
+        np.repeat(np.frombuffer(payload, dtype=np.uint8)[:, None], width, axis=1),
+    ])
+    band = np.repeat(rows, 2, axis=0)
+    raw[:band.shape[0]] = band[..., None] if raw.ndim == 3 else band
+    return raw
+
+
+def read_tag(raw,size):
+    '''
+        Relit le bandeau de tag_frame
+
+        retourne (payload BYTES de size octets, Region de l'image entière couverte par raw, largeur de l'image entière)
+    '''
+    first = raw[:, 0, 0] if raw.ndim == 3 else raw[:, 0]
+    step = 1 if first[1] == TAG_MAGIC[1] else 2  # une ligne par octet : image réduite de moitié
+    data = first[::step][:6 + size].tobytes()
+    if data[:2] != TAG_MAGIC:
+        raise ValueError("Frame has no simulation tag")
+    width = int.from_bytes(data[2:4], "little")
+    x0 = int.from_bytes(data[4:6], "little")
+    scale = 1.0 if step == 2 else 0.5
+    return data[6:], Region(x0, x0 + round(raw.shape[1] / scale), scale), width
+
+
+class TargetDistance():
+    '''
+        Balise vue pour un recalage, même interface que movement_control.positioning_system
+    '''
+    def __init__(self,id,distance,facing):
+        self.id = id
+        self.distance = distance
+        self.facing = facing
+
+
+class SimulatedPositioning():
+    '''
+        Système de positionnement du robot simulé : l'odométrie est exacte,
+        find_target ne fait donc que compter les recalages demandés
+
+        set_position ne déplace pas le robot (la pose vraie reste celle de la cinématique),
+        sauf avant son premier mouvement, pour fixer la pose de départ.
+    '''
+    def __init__(self,robot):
+        self.robot = robot
+        self.fixes = 0
+
+    def set_position(self,x,y,theta):
+        if not (self.robot.turns or self.robot.moves or self.robot.arcs or self.robot.custom):
+            self.robot.set_pose(x, y, theta)
+
+    def get_position(self):
+        return self.robot.pose()
+
+    def find_target(self,targets):
+        self.fixes += 1
+        logger.debug("Simulated position fix from beacons %s", [t.id for t in targets])
+
+
+class SimulatedRobot():
+    '''
+        Robot différentiel simulé
+
+        Le mouvement en cours est décrit par (pose de départ, instant de départ, vitesse
+        linéaire, vitesse angulaire, durée) : la pose est calculée à la demande, sans thread.
+
+        arguments
+            x, y, theta:  pose initiale (mm, mm, rad)
+            time_scale:  facteur appliqué aux durées réelles (0.1 = dix fois plus rapide) FLOAT
+            linear_speed:  vitesse des move_precise (mm/s) FLOAT
+            angular_speed:  vitesse des turn_precise (rad/s) FLOAT
+    '''
+    def __init__(self,x=0.0,y=0.0,theta=0.0,time_scale=1.0,linear_speed=LINEAR_SPEED,angular_speed=ANGULAR_SPEED):
+        self.time_scale = time_scale
+        self.linear_speed = linear_speed
+        self.angular_speed = angular_speed
+        self._lock = threading.Lock()
+        self._motion = ((x, y, theta), time.monotonic(), 0.0, 0.0, None)
+        self.positioning = SimulatedPositioning(self)
+        self.turns = 0
+        self.moves = 0
+        self.custom = 0
+        self.arcs = 0
+        self.rotation = 0.0   # rotation totale demandée (rad)
+        self.distance = 0.0   # distance totale demandée (mm)
+
+    def _pose_at(self,motion,now):
+        (x, y, theta), started, v, w, duration = motion
+        dt = (now - started) / self.time_scale
+        if duration is not None:
+            dt = min(dt, duration)
+        if abs(w) < 1e-9:
+            return x + v * dt * cos(theta), y + v * dt * sin(theta), theta
+        r = v / w
+        end = theta + w * dt
+        return x + r * (sin(end) - sin(theta)), y - r * (cos(end) - cos(theta)), _normalize(end)
+
+    def pose(self):
+        '''
+            Pose courante (x mm, y mm, theta rad)
+        '''
+        with self._lock:
+            return self._pose_at(self._motion, time.monotonic())
+
+    def set_pose(self,x,y,theta):
+        with self._lock:
+            self._motion = ((x, y, theta), time.monotonic(), 0.0, 0.0, None)
+
+    def _start(self,v,w,duration):
+        now = time.monotonic()
+        with self._lock:
+            motion = (self._pose_at(self._motion, now), now, v, w, duration)
+            self._motion = motion
+        return motion
+
+    def _run(self,v,w,duration):
+        motion = self._start(v, w, duration)
+        time.sleep(duration * self.time_scale)
+        with self._lock:
+            if self._motion is motion:
+                # fin exacte du mouvement, sans l'erreur du sommeil
+                self._motion = (self._pose_at(motion, float("inf")), time.monotonic(), 0.0, 0.0, None)
+
+    def turn_precise(self,angle):
+        self.turns += 1
+        self.rotation += abs(angle)
+        self._run(0.0, self.angular_speed if angle >= 0 else -self.angular_speed, abs(angle) / self.angular_speed)
+
+    def move_precise(self,distance):
+        self.moves += 1
+        self.distance += abs(distance)
+        self._run(self.linear_speed if distance >= 0 else -self.linear_speed, 0.0, abs(distance) / self.linear_speed)
+
+    def move_arc(self,angle,radius):
+        '''
+            Avance sur un arc de cercle de rayon radius (mm) en tournant de angle (rad),
+            à la vitesse maximale permise par la roue extérieure
+        '''
+        self.arcs += 1
+        self.rotation += abs(angle)
+        self.distance += abs(angle) * radius
+        speed = arc_speed(radius, Limits(self.linear_speed, self.angular_speed, WHEEL_BASE, True))
+        w = speed / radius if angle >= 0 else -speed / radius
+        self._run(speed, w, abs(angle) * radius / speed)
+
+    def move_custom(self,mg,md):
+        '''
+            Vitesse des roues gauche (mg) et droite (md) en mm/s, jusqu'à la commande suivante
+        '''
+        self.custom += 1
+        self._start((mg + md) / 2, (md - mg) / WHEEL_BASE, None)
+
+    def stop(self):
+        self._start(0.0, 0.0, None)
+
+    def get_positioning_system(self):
+        return self.positioning
+
+    def stats(self):
+        x, y, theta = self.pose()
+        return {
+            "pose": (x, y, theta),
+            "turns": self.turns,
+            "moves": self.moves,
+            "custom": self.custom,
+            "arcs": self.arcs,
+            "rotation": self.rotation,
+            "distance": self.distance,
+            "fixes": self.positioning.fixes,
+        }
+
+
+class SimulatedCamera():
+    '''
+        Caméra simulée, même interface que beacon_detection.camera_Api
+
+        arguments
+            robot:  SimulatedRobot dont la pose détermine l'image
+            markers:  position des balises {id: (x, y)} en mm DICTIONNAIRE
+            fov:  champ horizontal en degrés FLOAT
+            max_range:  distance maximale de détection en mm FLOAT
+            size:  (largeur, hauteur) des images
+            detect_cost:  durée ajoutée à chaque détection, pour imiter le vrai détecteur (s) FLOAT
+    '''
+    def __init__(self,robot,markers=SIM_MARKERS,fov=CAMERA_FOV,max_range=CAMERA_RANGE,size=FRAME_SIZE,detect_cost=0.0):
+        self.robot = robot
+        self.markers = dict(markers)
+        self.half_fov = radians(fov) / 2
+        self.max_range = max_range
+        self.size = size
+        self.detect_cost = detect_cost
+        self.frames = 0
+
+    def visible(self,x,y,theta):
+        '''
+            Balises visibles depuis la pose, au format de camera.detect_markers
+            ('id', 'distance' en cm, 'horizontal_angle' en degrés, positif vers la droite)
+        '''
+        found = []
+        for marker_id, (mx, my) in self.markers.items():
+            distance = hypot(mx - x, my - y)
+            bearing = _normalize(atan2(my - y, mx - x) - theta)
+            if distance <= self.max_range and abs(bearing) <= self.half_fov:
+                found.append({"id": marker_id, "distance": distance / 10, "horizontal_angle": -degrees(bearing)})
+        return found
+
+    def get_camera_frame(self):
+        width, height = self.size
+        x, y, theta = self.robot.pose()
+        frame = np.full((height, width, 3), 40, dtype=np.uint8)
+        for m in self.visible(x, y, theta):
+            u = int(column(m["horizontal_angle"], width, degrees(2 * self.half_fov)))
+            half = marker_half_size(m)
+            cv2.rectangle(frame, (u - half, height // 2 - half), (u + half, height // 2 + half), (255, 255, 255), -1)
+            cv2.putText(frame, str(m["id"]), (u - half, height // 2 - half - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        # pose (3 float64) relue par detect_markers
+        tag_frame(frame, np.array([x, y, theta], dtype=np.float64).tobytes())
+        self.frames += 1
+        return frame
+
+    def get_camera_frame_base64(self):
+        ok, buffer = cv2.imencode(".jpg", self.get_camera_frame())
+        return base64.b64encode(buffer.tobytes()).decode("ascii") if ok else None
+
+    def detect_markers(self,frame):
+        '''
+            Balises visibles sur l'image reçue, vues comme les verrait camera.detect_markers :
+            sur une bande découpée, seules celles qui y sont, mesurées depuis le centre de la
+            bande (detection.to_region), et assez grandes si la bande est réduite. Le coût
+            simulé est proportionnel au nombre de pixels reçus.
+        '''
+        width, height = self.size
+        if self.detect_cost:
+            time.sleep(self.detect_cost * frame.shape[0] * frame.shape[1] / (width * height))
+        payload, region, full_width = read_tag(frame, 24)
+        x, y, theta = np.frombuffer(payload, dtype=np.float64)
+        found = self.visible(float(x), float(y), float(theta))
+        if region == Region(0, full_width, 1.0):
+            return found
+        found = [m for m in found if region.scale == 1.0 or 2 * marker_half_size(m) * region.scale >= MIN_MARKER_PIXELS]
+        return to_region(found, region, full_width, degrees(2 * self.half_fov))
+
+
+def marker_half_size(marker):
+    '''
+        Demi-côté (px) d'une balise dessinée par SimulatedCamera
+    '''
+    return max(2, int(2000 / max(marker["distance"], 1)))
+
+
+def backend_name(name=None):
+    '''
+        Backend choisi : name, sinon ARTEFACT_BACKEND, sinon "hardware"
+
+        lève ValueError pour un backend inconnu
+    '''
+    name = name or os.environ.get("ARTEFACT_BACKEND", "hardware")
+    if name not in ("hardware", "sim"):
+        raise ValueError(f"Unknown backend: {name}")
+    return name
+
+
+def load_backends(name=None,time_scale=1.0):
+    '''
+        Renvoie (robot, caméra) : le matériel réel, ou la simulation si name
+        (sinon ARTEFACT_BACKEND) vaut "sim"
+
+        La caméra est un objet ou un module offrant get_camera_frame et detect_markers.
+    '''
+    if backend_name(name) == "sim":
+        robot = SimulatedRobot(time_scale=time_scale)
+        logger.info("Using simulated robot and camera")
+        return robot, SimulatedCamera(robot)
+    from movement_control.mouvement_control import MovementControl
+    import beacon_detection.camera_Api as camera
+    return MovementControl(), camera
@@ -0,0 +1,127 @@
+'''
+Télémétrie d'un robot regroupée en un seul message par tick
+
+Les producteurs (relevé de batterie, mode auto, watchdog, liens des clients) écrivent
+leurs champs dans un Telemetry, depuis n'importe quel thread, sans rien envoyer ; les
+échantillonneurs sont des fonctions peu coûteuses appelées à chaque tick. Une fois par
+tick, delta() renvoie uniquement les champs qui ont changé depuis le dernier envoi, au-delà
+de leur seuil : le client reçoit un message "telemetry" par tick au plus, et rien si rien
+n'a bougé. Un client qui se connecte reçoit d'abord l'état complet (snapshot).
+
+    {"type": "telemetry", "seq": 12, "full": false, "fields": {"battery": 87}}
+'''
+import time
+import threading
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_PERIOD = 0.2  # période d'envoi des deltas (s)
+
+# Variation minimale avant renvoi d'un champ ; un dictionnaire donne les seuils de ses clés,
+# un tuple ceux des éléments d'un tuple. Sans seuil, tout changement est envoyé.
+TELEMETRY_THRESHOLDS = {
+    "battery": 1,
+    "pose": (10.0, 10.0, 0.02),   # mm, mm, rad
+    "link": {"fps": 1.0, "latency": 0.005},
+}
+
+TELEMETRY_FIELDS_SENT = metrics.counter("telemetry_fields_sent_total", "Telemetry fields included in deltas")
+TELEMETRY_MESSAGES = metrics.counter("telemetry_messages_total", "Telemetry delta messages broadcast")
+
+
+def changed(old,new,threshold=None):
+    '''
+        Vrai si new diffère de old d'au moins threshold (récursif sur dictionnaires et tuples)
+    '''
+    if isinstance(new, dict) and isinstance(old, dict):
+        if new.keys() != old.keys():
+            return True
+        thresholds = threshold if isinstance(threshold, dict) else {}
+        return any(changed(old[k], new[k], thresholds.get(k)) for k in new)
+    if isinstance(new, (tuple, list)) and isinstance(old, (tuple, list)):
+        if len(new) != len(old):
+            return True
+        thresholds = threshold if isinstance(threshold, (tuple, list)) else [threshold] * len(new)
+        return any(changed(o, n, t) for o, n, t in zip(old, new, thresholds))
+    if isinstance(new, (int, float)) and isinstance(old, (int, float)) and not isinstance(new, bool) and not isinstance(old, bool):
+        return abs(new - old) >= threshold if threshold else new != old
+    return new != old
+
+
+class Telemetry():
+    '''
+        État courant d'un robot, écrit par les producteurs et diffusé par deltas
+
+        arguments
+            thresholds:  seuils de changement par champ DICTIONNAIRE
+    '''
+    def __init__(self,thresholds=TELEMETRY_THRESHOLDS):
+        self.thresholds = dict(thresholds)
+        self._lock = threading.Lock()
+        self.fields = {}     # dernière valeur écrite
+        self.sent = {}       # dernière valeur diffusée
+        self.samplers = {}   # champ -> fonction appelée à chaque tick
+        self.seq = 0
+        self.updates = 0
+        self.deltas = 0
+
+    def update(self,**fields):
+        '''
+            Écrit des champs ; rien n'est envoyé avant le prochain tick
+        '''
+        with self._lock:
+            self.fields.update(fields)
+            self.updates += 1
+
+    def sampler(self,name,fn):
+        '''
+            Appelle fn() à chaque tick pour le champ name (fn None retire l'échantillonneur)
+        '''
+        with self._lock:
+            if fn is None:
+                self.samplers.pop(name, None)
+            else:
+                self.samplers[name] = fn
+
+    def sample(self):
+        with self._lock:
+            samplers = list(self.samplers.items())
+        values = {}
+        for name, fn in samplers:
+            try:
+                values[name] = fn()
+            except Exception as e:
+                logger.error(f"Telemetry sampler {name} failed: {e}", exc_info=True)
+        if values:
+            self.update(**values)
+
+    def delta(self):
+        '''
+            Échantillonne puis renvoie le message des champs changés depuis le dernier envoi,
+            ou None si aucun n'a dépassé son seuil
+        '''
+        self.sample()
+        with self._lock:
+            fields = {k: v for k, v in self.fields.items() if k not in self.sent or changed(self.sent[k], v, self.thresholds.get(k))}
+            if not fields:
+                return None
+            self.sent.update(fields)
+            self.seq += 1
+            self.deltas += 1
+            seq = self.seq
+        TELEMETRY_MESSAGES.inc()
+        TELEMETRY_FIELDS_SENT.inc(len(fields))
+        return {"type": "telemetry", "seq": seq, "full": False, "time": time.time(), "fields": fields}
+
+    def snapshot(self):
+        '''
+            Message de l'état complet, pour un client qui vient de se connecter
+        '''
+        with self._lock:
+            return {"type": "telemetry", "seq": self.seq, "full": True, "time": time.time(), "fields": dict(self.fields)}
+
+    def stats(self):
+        with self._lock:
+            return {"fields": sorted(self.fields), "updates": self.updates, "deltas": self.deltas, "seq": self.seq}
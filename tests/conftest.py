@@ -0,0 +1,10 @@
+'''
+Les modules du robot sont à la racine du dépôt : les tests les importent directement
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# les tests tournent sur la simulation : auto.py n'a pas besoin de movement_control
+os.environ.setdefault("ARTEFACT_BACKEND", "sim")
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from frame_bus import Frame
+from remake import ClientChannel, encode_frame_packet, CLIENT_MAX_PENDING, STREAM_TIERS, STREAM_START_TIER, ADAPT_INTERVAL, ADAPT_UPGRADE_AFTER
+
+
+class FakeWebSocket():
+    '''
+        WebSocket qui garde les messages envoyés ; send attend gate quand elle est fermée
+    '''
+    def __init__(self):
+        self.remote_address = ("127.0.0.1", 5000)
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.closed_with = None
+
+    async def send(self,data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+    async def close(self,code=1000,reason=""):
+        self.closed_with = (code, reason)
+
+
+def make_frame(channel,seq):
+    frame = Frame(seq, time.time(), np.full((48, 64, 3), seq, np.uint8))
+    encode_frame_packet(frame, channel.tier)  # comme RobotSession.on_frame
+    return frame
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_control_messages_keep_their_order():
+    async def scenario():
+        ws = FakeWebSocket()
+        ws.gate.clear()
+        channel = ClientChannel(ws)
+        channel.start()
+        messages = [{"type": "telemetry", "seq": i} for i in range(5)] + [b"\x03ack"]
+        for msg in messages:
+            channel.push(msg)
+        ws.gate.set()
+        await settle()
+        channel.close()
+        return ws.sent, messages
+
+    sent, messages = asyncio.run(scenario())
+    assert sent == [json.dumps(m) for m in messages[:-1]] + [messages[-1]]
+
+
+def test_only_the_newest_frame_waits():
+    async def scenario():
+        ws = FakeWebSocket()
+        ws.gate.clear()
+        channel = ClientChannel(ws)
+        channel.start()
+        channel.push({"type": "hello"})
+        await settle()  # le sender est bloqué sur l'envoi de hello
+        frames = [make_frame(channel, seq) for seq in (1, 2, 3)]
+        for frame in frames:
+            channel.push(frame)
+        assert channel.queue_depth == 1
+        ws.gate.set()
+        await settle()
+        channel.close()
+        return ws.sent, channel, frames
+
+    sent, channel, frames = asyncio.run(scenario())
+    assert sent == [json.dumps({"type": "hello"}), frames[-1].cached(("packet", channel.tier))]
+    assert channel.frames_dropped == 2
+    assert channel.frames_sent == 1
+
+
+def test_frame_without_packet_for_the_tier_is_skipped():
+    async def scenario():
+        channel = ClientChannel(FakeWebSocket())
+        channel.push(Frame(1, time.time(), np.zeros((48, 64, 3), np.uint8)))
+        return channel
+
+    channel = asyncio.run(scenario())
+    assert channel.pending_frame is None
+    assert channel.frames_throttled == 1
+
+
+def test_stalled_client_is_closed():
+    async def scenario():
+        ws = FakeWebSocket()
+        channel = ClientChannel(ws)  # pas de sender : rien ne part
+        for i in range(CLIENT_MAX_PENDING):
+            channel.push({"seq": i})
+        assert not channel.closed
+        channel.push({"seq": CLIENT_MAX_PENDING})
+        await settle()
+        return ws, channel
+
+    ws, channel = asyncio.run(scenario())
+    assert channel.closed
+    assert ws.closed_with[0] == 1008
+    assert len(channel.pending) == CLIENT_MAX_PENDING
+    channel.push({"seq": "after close"})
+    assert len(channel.pending) == CLIENT_MAX_PENDING
+
+
+def end_window(channel,busy=0.0,dropped=0):
+    channel._window_start = time.monotonic() - ADAPT_INTERVAL
+    channel._window_busy = busy * ADAPT_INTERVAL
+    channel._window_dropped = dropped
+    channel.adapt()
+
+
+def test_tier_drops_on_congestion_and_climbs_back():
+    async def scenario():
+        channel = ClientChannel(FakeWebSocket())
+        assert channel.tier_index == STREAM_START_TIER
+        end_window(channel, dropped=1)
+        assert channel.tier_index == STREAM_START_TIER + 1
+        end_window(channel, busy=0.9)
+        assert channel.tier_index == STREAM_START_TIER + 2
+        for _ in range(ADAPT_UPGRADE_AFTER - 1):
+            end_window(channel)
+            assert channel.tier_index == STREAM_START_TIER + 2
+        end_window(channel)
+        assert channel.tier_index == STREAM_START_TIER + 1
+        # une fenêtre moyenne remet le compte à zéro
+        end_window(channel)
+        end_window(channel, busy=0.3)
+        for _ in range(ADAPT_UPGRADE_AFTER):
+            end_window(channel)
+        assert channel.tier_index == STREAM_START_TIER
+        # jamais au-delà des paliers extrêmes
+        for _ in range(10):
+            end_window(channel, dropped=1)
+        assert channel.tier_index == len(STREAM_TIERS) - 1
+        channel.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+from math import atan, degrees
+
+import numpy as np
+import pytest
+
+from detection import (MarkerTracker, Region, crop, to_frame, to_region, focal, column,
+                       CAMERA_FOV, MARKER_SIZE, MODE_FULL, MODE_ROI, TRACK_LOST_AFTER)
+
+WIDTH, HEIGHT = 640, 480
+F = focal(WIDTH)  # focale de calibration de la caméra, la même pour une image entière ou une bande
+
+
+def square_detector(image):
+    '''
+        Détecteur connu : un carré blanc sur fond noir, mesuré avec le modèle sténopé
+        depuis le centre de l'image reçue, comme le fait camera.detect_markers
+    '''
+    columns = np.flatnonzero(image.max(axis=(0, 2)) > 127)
+    rows = np.flatnonzero(image.max(axis=(1, 2)) > 127)
+    if not len(columns):
+        return []
+    c0, c1, r0, r1 = columns[0], columns[-1] + 1, rows[0], rows[-1] + 1
+    u = (c0 + c1) / 2 - image.shape[1] / 2
+    return [{
+        "id": 7,
+        "horizontal_angle": degrees(atan(u / F)),
+        "distance": F * MARKER_SIZE / (c1 - c0),
+        "corners": [(c0, r0), (c1, r0), (c1, r1), (c0, r1)],
+    }]
+
+
+def scene(left,side):
+    raw = np.zeros((HEIGHT, WIDTH, 3), np.uint8)
+    raw[200:200 + side, left:left + side] = 255
+    return raw
+
+
+@pytest.mark.parametrize("region", [Region(300, 460, 1.0), Region(300, 460, 0.5), Region(0, 200, 0.5)])
+def test_band_detection_matches_full_frame(region):
+    left = region.x0 + 40
+    raw = scene(left, 48)
+    expected = square_detector(raw)[0]
+    band = crop(raw, region)
+    assert band.shape[1] == (region.x1 - region.x0) * region.scale
+    found = to_frame(square_detector(band), region, WIDTH)
+    assert len(found) == 1
+    assert found[0]["horizontal_angle"] == pytest.approx(expected["horizontal_angle"], abs=0.05)
+    assert found[0]["distance"] == pytest.approx(expected["distance"], rel=0.01)
+    assert np.allclose(found[0]["corners"], expected["corners"], atol=1)
+
+
+def test_to_region_inverts_to_frame():
+    markers = [{"id": 3, "horizontal_angle": 12.5, "distance": 80.0}, {"id": 4, "horizontal_angle": -25.0, "distance": 150.0}]
+    region = Region(int(column(5, WIDTH)) // 2 * 2, int(column(20, WIDTH)) // 2 * 2, 0.5)
+    seen = to_region(markers, region, WIDTH)
+    assert [m["id"] for m in seen] == [3]  # la balise 4 est hors de la bande
+    back = to_frame(seen, region, WIDTH)
+    assert back[0]["horizontal_angle"] == pytest.approx(12.5)
+    assert back[0]["distance"] == pytest.approx(80.0)
+
+
+def test_tracking_region_follows_the_marker():
+    tracker = MarkerTracker()
+    assert tracker.region(WIDTH) is None
+    tracker.follow({"id": 7, "horizontal_angle": 10.0, "distance": 100.0})
+    region = tracker.region(WIDTH)
+    assert region is not None
+    assert region.x0 % 2 == 0 and region.x1 % 2 == 0
+    assert region.x0 < column(10.0, WIDTH) < region.x1
+    # rotation du robot vers la balise : la zone se recentre
+    tracker.rotate(-np.radians(10.0))
+    assert tracker.region(WIDTH).x0 < region.x0
+
+
+def test_tracking_falls_back_to_full_frame_when_lost():
+    tracker = MarkerTracker()
+    marker = {"id": 7, "horizontal_angle": 0.0, "distance": 100.0}
+    tracker.follow(marker)
+    for _ in range(TRACK_LOST_AFTER - 1):
+        tracker.update([], MODE_ROI)
+    tracker.update([], MODE_FULL)  # une image entière sans la balise ne compte pas
+    assert tracker.region(WIDTH) is not None
+    tracker.update([{"id": 7, "horizontal_angle": 1.0, "distance": 95.0}], MODE_ROI)  # retrouvée : compteur remis à zéro
+    for _ in range(TRACK_LOST_AFTER - 1):
+        tracker.update([{"id": 9, "horizontal_angle": 0.0, "distance": 50.0}], MODE_ROI)
+    assert tracker.region(WIDTH) is not None
+    tracker.update([], MODE_ROI)
+    assert tracker.region(WIDTH) is None
+    assert tracker.stats()["lost"] == 1
+    assert tracker.stats()["frames"] == {MODE_ROI: 2 * TRACK_LOST_AFTER, MODE_FULL: 1}
@@ -0,0 +1,155 @@
+import threading
+import time
+import types
+
+import remake
+from drive import MotorDispatcher, DeadmanWatchdog
+
+
+def wait_for(condition,timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class FakeRobot():
+    '''
+        Robot qui note les commandes reçues ; move_custom attend release si hold est posé
+    '''
+    def __init__(self,hold=False):
+        self.commands = []
+        self.busy = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def move_custom(self,mg,md):
+        self.busy.set()
+        self.release.wait(2)
+        self.commands.append(("move", mg, md))
+
+    def stop(self):
+        self.commands.append(("stop",))
+
+
+def test_burst_is_coalesced():
+    robot = FakeRobot(hold=True)
+    dispatcher = MotorDispatcher(robot, rate=20)
+    dispatcher.start()
+    try:
+        dispatcher.move(10, 10)
+        assert robot.busy.wait(1)
+        for speed in range(20, 60, 10):
+            dispatcher.move(speed, speed)
+        robot.release.set()
+        assert wait_for(lambda: len(robot.commands) == 2)
+        assert robot.commands == [("move", 10, 10), ("move", 50, 50)]
+        assert dispatcher.stats()["coalesced"] == 3
+    finally:
+        dispatcher.shutdown()
+
+
+def test_stop_is_never_replaced_by_a_later_move():
+    robot = FakeRobot(hold=True)
+    dispatcher = MotorDispatcher(robot)
+    dispatcher.start()
+    try:
+        dispatcher.move(50, 50)
+        assert robot.busy.wait(1)  # le thread applique le mouvement
+        dispatcher.stop()
+        dispatcher.move(0, 0)
+        robot.release.set()
+        assert wait_for(lambda: len(robot.commands) == 3)
+        assert robot.commands == [("move", 50, 50), ("stop",), ("move", 0, 0)]
+    finally:
+        dispatcher.shutdown()
+
+
+def test_robots_share_one_thread():
+    alpha, beta = FakeRobot(), FakeRobot()
+    dispatcher = MotorDispatcher()
+    motors = dispatcher.attach("alpha", alpha), dispatcher.attach("beta", beta)
+    before = set(threading.enumerate())
+    dispatcher.start()
+    try:
+        assert set(threading.enumerate()) - before == {dispatcher._thread}
+        motors[0].move(1, 2)
+        motors[1].stop()
+        assert wait_for(lambda: alpha.commands and beta.commands)
+        assert (alpha.commands, beta.commands) == ([("move", 1, 2)], [("stop",)])
+        assert motors[1].stats()["applied"] == 1
+    finally:
+        dispatcher.shutdown()
+
+
+def test_neutral_joystick_only_stops():
+    calls = []
+    session = remake.RobotSession.__new__(remake.RobotSession)
+    session.name = "test"
+    session.auto_mode_active = False
+    session.motors = types.SimpleNamespace(stop=lambda: calls.append("stop"), move=lambda mg, md: calls.append(("move", mg, md)))
+    session.server = types.SimpleNamespace(watchdog=types.SimpleNamespace(feed=lambda client, moving, robot: calls.append(("feed", moving))))
+    session.command("client", 0, 0, 0.0, 0.0, 1)
+    assert calls == ["stop", ("feed", False)]
+
+
+def watched(timeout):
+    trips = []
+    stops = []
+    watchdog = DeadmanWatchdog(stop=lambda: stops.append(time.monotonic()), timeout=timeout, on_trip=trips.append)
+    watchdog.start()
+    return watchdog, stops, trips
+
+
+def test_watchdog_trips_after_timeout():
+    watchdog, stops, trips = watched(0.1)
+    try:
+        watchdog.feed("a")
+        assert wait_for(lambda: trips)
+        assert trips[0]["reason"] == "timeout"
+        assert trips[0]["idle"] >= 0.1
+        assert len(stops) == 1
+        assert not watchdog.stats()["armed"]
+    finally:
+        watchdog.shutdown()
+
+
+def test_watchdog_keeps_running_while_any_client_commands():
+    watchdog, stops, trips = watched(0.15)
+    try:
+        watchdog.feed("a")
+        for _ in range(8):  # b commande seul pendant 0.4 s, a s'est tu
+            time.sleep(0.05)
+            watchdog.feed("b")
+        assert stops == []
+        # a se déconnecte : b commande encore, le robot continue
+        watchdog.forget("a")
+        assert stops == []
+        assert watchdog.stats()["armed"]
+    finally:
+        watchdog.shutdown()
+
+
+def test_watchdog_trips_at_once_when_the_last_client_leaves():
+    watchdog, stops, trips = watched(5.0)
+    try:
+        watchdog.feed("a")
+        watchdog.feed("b")
+        time.sleep(0.05)
+        watchdog.forget("b")
+        assert stops == []
+        started = time.monotonic()
+        watchdog.forget("a")
+        assert len(stops) == 1 and stops[0] - started < 0.05
+        assert trips[0]["reason"] == "disconnect"
+        assert 0.05 <= trips[0]["idle"] < 1.0  # temps réel depuis la dernière commande, pas le délai
+        # un client qui avait lâché le joystick ne déclenche rien
+        watchdog.feed("c")
+        watchdog.feed("c", moving=False)
+        watchdog.forget("c")
+        assert len(stops) == 1
+    finally:
+        watchdog.shutdown()
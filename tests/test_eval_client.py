@@ -0,0 +1,154 @@
+import time
+
+import pytest
+import requests
+
+from eval_client import EvalClient, PositionReporter, LocalEvalServer
+
+
+def wait_for(condition,timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class FlakyEvalServer(LocalEvalServer):
+    '''
+        Répond 502 aux failures premières requêtes
+    '''
+    def __init__(self,failures,**kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def handle(self,method,path,params):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                self.requests.append((method, path, params))
+                return 502, {"error": "bad gateway"}
+        return super().handle(method, path, params)
+
+
+@pytest.fixture
+def server():
+    server = LocalEvalServer(todo=[5, 7]).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = EvalClient(server.url, timeout=(1.0, 1.0), backoff=0)
+    yield client
+    client.close()
+
+
+def test_requests_reach_the_server(server,client):
+    assert client.get_list().result().json() == {"markers": [5, 7]}
+    assert client.post_marker(5, 1, True).result().status_code == 200
+    assert client.post_marker(5, 1, True).result().status_code == 503
+    assert client.get_status().result().json() == {"markers": [{"id": 5}]}
+    assert ("POST", "/api/marker", {"id": "5", "sector": "1", "inner": "1"}) in server.requests
+
+
+def test_get_is_retried_on_bad_gateway():
+    server = FlakyEvalServer(2, todo=[5]).start()
+    client = EvalClient(server.url, retries=2, backoff=0)
+    try:
+        assert client.get_list().result().json() == {"markers": [5]}
+        assert [r[:2] for r in server.requests] == [("GET", "/api/list")] * 3
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_post_is_never_sent_twice():
+    server = FlakyEvalServer(1, todo=[5]).start()
+    client = EvalClient(server.url, retries=2, backoff=0)
+    try:
+        assert client.post_marker(5, 1, False).result().status_code == 502
+        assert len(server.requests) == 1
+        assert server.validated == []
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_read_timeout():
+    server = LocalEvalServer(latency=0.3).start()
+    client = EvalClient(server.url, timeout=(1.0, 0.1), retries=1, backoff=0)
+    try:
+        with pytest.raises(requests.exceptions.RequestException):
+            client.get_status().result()
+        # le GET est réessayé une fois, le POST jamais
+        assert wait_for(lambda: len(server.requests) == 2)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.post_position(1, 2).result()
+        time.sleep(0.4)
+        assert [r[0] for r in server.requests] == ["GET", "GET", "POST"]
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_reporter_skips_unchanged_positions(server,client):
+    position = [10.0, 20.0]
+    reporter = PositionReporter(client, lambda: tuple(position), min_refresh=60)
+    reporter.tick()
+    assert wait_for(lambda: reporter.stats()["sent"] == 1)
+    position[0] += 0.1
+    reporter.tick()
+    position[0] += 5
+    reporter.tick()
+    assert wait_for(lambda: reporter.stats()["sent"] == 2)
+    assert reporter.stats()["unchanged"] == 1
+    assert [r[2] for r in server.requests] == [{"x": "10.0", "y": "20.0"}, {"x": "15.1", "y": "20.0"}]
+
+
+def test_reporter_coalesces_while_a_request_is_in_flight():
+    server = LocalEvalServer(latency=0.2).start()
+    client = EvalClient(server.url)
+    position = [0.0, 0.0]
+    reporter = PositionReporter(client, lambda: tuple(position))
+    try:
+        reporter.tick()
+        position[0] = 100
+        reporter.tick()
+        assert reporter.stats()["coalesced"] == 1
+        assert wait_for(lambda: reporter.stats()["sent"] == 1)
+        reporter.tick()
+        assert wait_for(lambda: reporter.stats()["sent"] == 2)
+        assert server.requests[-1][2] == {"x": "100", "y": "0.0"}
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_reporter_resends_after_failure(server,client):
+    reporter = PositionReporter(client, lambda: (1.0, 1.0), min_refresh=60)
+    server.stop()
+    reporter.tick()
+    assert wait_for(lambda: reporter.stats()["failures"] == 1)
+    # la position n'a pas bougé mais n'a jamais été reçue : elle repart au tick suivant
+    reporter.tick()
+    assert reporter.stats()["unchanged"] == 0
+    assert wait_for(lambda: reporter.stats()["failures"] == 2)
+
+
+def test_reporter_loop_runs_at_its_period(server,client):
+    position = [0.0, 0.0]
+
+    def moving():
+        position[0] += 10
+        return tuple(position)
+
+    reporter = PositionReporter(client, moving, period=0.05)
+    thread = reporter.start()
+    time.sleep(0.28)
+    reporter.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert 4 <= reporter.stats()["sent"] <= 7
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from frame_bus import FrameBus
+
+
+class FakeCamera():
+    '''
+        Caméra qui compte ses lectures ; renvoie toujours un nouveau tableau, dont le
+        contenu ne change qu'à chaque appel de next()
+    '''
+    def __init__(self):
+        self.reads = 0
+        self.image = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            self.image += 1
+
+    def __call__(self):
+        with self.lock:
+            self.reads += 1
+            return np.full((8, 8, 3), self.image % 256, np.uint8)
+
+
+def wait_for(condition,timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def bus():
+    camera = FakeCamera()
+    bus = FrameBus(camera, interval=0.005)
+    bus.camera = camera
+    yield bus
+    bus.stop()
+
+
+def test_no_reads_without_demand(bus):
+    bus.start()
+    time.sleep(0.1)
+    assert bus.camera.reads == 0
+    assert bus.latest is None
+    assert not bus.active
+    assert bus.stats()["pauses"] == 1
+
+
+def test_acquire_wakes_capture_and_release_pauses_it(bus):
+    frames = []
+    bus.subscribe(frames.append)
+    bus.start()
+    time.sleep(0.05)
+    bus.acquire("client")
+    assert bus.wait_for_frame(timeout=1) is not None
+    assert frames
+    bus.acquire("auto")
+    bus.release("client")
+    assert bus.active  # auto tient encore le bus
+    bus.release("auto")
+    assert not bus.active
+    assert wait_for(lambda: bus.stats()["pauses"] == 2)
+    reads = bus.camera.reads
+    time.sleep(0.1)
+    assert bus.camera.reads == reads
+    assert bus.latest is None  # l'image d'avant la pause n'est plus servie
+
+
+def test_identical_reads_are_counted_not_published(bus):
+    frames = []
+    bus.subscribe(frames.append)
+    bus.acquire("client")
+    bus.start()
+    assert wait_for(lambda: bus.camera.reads >= 10)
+    assert len(frames) == 1
+    assert bus.stats()["duplicates"] >= 9
+    bus.camera.next()
+    assert wait_for(lambda: len(frames) == 2)
+    assert frames[1].seq == 2 and frames[1].raw[0, 0, 0] == 1
+    assert bus.stats()["frames"] == 2
@@ -0,0 +1,104 @@
+import time
+from math import atan2, degrees, hypot, radians
+
+import pytest
+
+from localization import PoseFilter, BEACON_MAP, LOCALIZATION_MAX_STD, parse_beacons
+
+
+def markers_seen_from(pose,beacons=BEACON_MAP):
+    '''
+        Balises fixes telles que les renverrait camera.detect_markers depuis pose
+    '''
+    x, y, theta = pose
+    return [{"id": i, "distance": hypot(bx - x, by - y) / 10, "horizontal_angle": -degrees(atan2(by - y, bx - x) - theta)}
+            for i, (bx, by) in beacons.items()]
+
+
+def settled_filter(x=0.0,y=0.0,theta=0.0,std=(200.0, 200.0, radians(10))):
+    f = PoseFilter()
+    f.reset(x, y, theta, std)
+    return f
+
+
+def test_predictions_move_the_pose_and_grow_uncertainty():
+    f = settled_filter(std=(10.0, 10.0, 0.01))
+    before = f.std()[0]
+    f.predict_turn(radians(90))
+    f.predict_move(1000)
+    x, y, theta = f.pose()
+    assert (x, y, theta) == pytest.approx((0.0, 1000.0, radians(90)), abs=1e-6)
+    assert f.std()[0] > before
+
+
+def test_arc_matches_its_chord():
+    f = settled_filter()
+    f.predict_arc(radians(90), 500)
+    assert f.pose() == pytest.approx((500.0, 500.0, radians(90)), abs=1e-6)
+
+
+def test_observations_correct_the_pose():
+    truth = (300.0, -200.0, 0.4)
+    f = settled_filter(200.0, -100.0, 0.45)
+    assert not f.confident()
+    used = f.observe(markers_seen_from(truth), timestamp=time.time(), seq=1)
+    assert used == len(BEACON_MAP)
+    x, y, theta = f.pose()
+    assert hypot(x - truth[0], y - truth[1]) < 30
+    assert theta == pytest.approx(truth[2], abs=radians(2))
+    assert f.std()[0] < LOCALIZATION_MAX_STD
+    assert f.confident()
+
+
+def test_outlier_is_rejected():
+    f = settled_filter(std=(20.0, 20.0, radians(1)))
+    markers = markers_seen_from((0.0, 0.0, 0.0))
+    markers[0]["distance"] += 100  # 1 m d'erreur sur une balise
+    assert f.observe(markers, seq=1) == len(markers) - 1
+    assert f.rejected == 1
+    assert f.pose()[:2] == pytest.approx((0.0, 0.0), abs=20)
+
+
+def test_frames_during_or_before_motion_are_ignored():
+    f = settled_filter()
+    markers = markers_seen_from((0.0, 0.0, 0.0))
+    stale = time.time() - 1
+    f.begin_motion()
+    assert f.observe(markers) == 0
+    f.predict_move(0)
+    assert f.observe(markers, timestamp=stale) == 0
+    assert f.observe(markers, timestamp=time.time()) == len(markers)
+
+
+def test_same_frame_is_fused_once():
+    f = settled_filter()
+    markers = markers_seen_from((0.0, 0.0, 0.0))
+    assert f.observe(markers, seq=5) > 0
+    assert f.observe(markers, seq=5) == 0
+    assert f.observe(markers, seq=4) == 0
+    assert f.updates == 1
+
+
+def test_unknown_markers_are_not_observations():
+    f = settled_filter()
+    assert f.observe([{"id": 42, "distance": 100, "horizontal_angle": 0}]) == 0
+    assert f.observations == 0
+
+
+def test_fix_pulls_towards_triangulated_pose():
+    f = settled_filter(0.0, 0.0, 0.0, std=(500.0, 500.0, radians(30)))
+    f.fix(400.0, 0.0, 0.2, std=(10.0, 10.0, 0.01))
+    assert f.pose() == pytest.approx((400.0, 0.0, 0.2), abs=5)
+
+
+def test_beacon_4_is_not_assumed():
+    f = settled_filter()
+    assert 4 not in f.beacons
+    assert f.observe([{"id": 4, "distance": 150, "horizontal_angle": 180}]) == 0
+
+
+def test_parse_beacons():
+    assert parse_beacons("4=-1500:0, 5=0:750.5") == {4: (-1500.0, 0.0), 5: (0.0, 750.5)}
+    assert parse_beacons("") == {}
+    with pytest.raises(ValueError):
+        parse_beacons("4=-1500")
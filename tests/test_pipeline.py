@@ -0,0 +1,102 @@
+import threading
+from contextlib import nullcontext
+
+import pytest
+
+from pipeline import Pipeline, StageCancelled, DONE, FAILED, CANCELLED
+
+
+@pytest.fixture
+def pipeline():
+    p = Pipeline("test", timer=lambda stage: nullcontext())
+    yield p
+    p.close()
+
+
+def test_stages_run_after_their_dependencies(pipeline):
+    order = []
+    gate = threading.Event()
+    pipeline.add("a", lambda cancel: gate.wait(1) and order.append("a"))
+    pipeline.add("b", lambda cancel: order.append("b"), after=["a"])
+    c = pipeline.add("c", lambda cancel: order.append("c") or 3, after=["a", "b"])
+    assert order == []
+    gate.set()
+    assert c.result(1) == 3
+    assert order == ["a", "b", "c"]
+    assert pipeline.critical_path() == ["a", "b", "c"]
+
+
+def test_unknown_or_duplicate_stage(pipeline):
+    pipeline.add("a", lambda cancel: None)
+    with pytest.raises(ValueError):
+        pipeline.add("a", lambda cancel: None)
+    with pytest.raises(ValueError):
+        pipeline.add("b", lambda cancel: None, after=["missing"])
+
+
+def test_cancel_pending_stage_skips_dependents(pipeline):
+    gate = threading.Event()
+    pipeline.add("slow", lambda cancel: gate.wait(1))
+    spec = pipeline.add("spec", lambda cancel: "never", after=["slow"], speculative=True)
+    after = pipeline.add("after", lambda cancel: "never", after=["spec"])
+    pipeline.cancel("spec")
+    gate.set()
+    with pytest.raises(StageCancelled):
+        spec.result(1)
+    with pytest.raises(StageCancelled):
+        after.result(1)
+    assert spec.state == after.state == CANCELLED
+
+
+def test_cancel_running_stage_discards_its_result(pipeline):
+    started = threading.Event()
+
+    def search(cancel):
+        started.set()
+        cancel.wait(1)
+        return "partial result"
+
+    stage = pipeline.add("search", search, speculative=True)
+    assert started.wait(1)
+    pipeline.cancel("search")
+    with pytest.raises(StageCancelled):
+        stage.result(1)
+    assert stage.state == CANCELLED
+
+
+def test_speculation_confirmed_keeps_running(pipeline):
+    gate = threading.Event()
+    spec = pipeline.add("locate_next", lambda cancel: gate.wait(1) and "beacon", speculative=True)
+    follow = pipeline.add("approach_next", lambda cancel: spec.result() + " reached", after=["locate_next"])
+    gate.set()
+    assert follow.result(1) == "beacon reached"
+    assert spec.state == DONE
+
+
+def test_failure_skips_dependents(pipeline):
+    def broken(cancel):
+        raise RuntimeError("boom")
+
+    failed = pipeline.add("broken", broken)
+    after = pipeline.add("after", lambda cancel: None, after=["broken"])
+    with pytest.raises(RuntimeError):
+        failed.result(1)
+    with pytest.raises(StageCancelled):
+        after.result(1)
+    assert failed.state == FAILED
+
+
+def test_close_cancels_running_speculation():
+    p = Pipeline("test", timer=lambda stage: nullcontext())
+    started = threading.Event()
+
+    def search(cancel):
+        started.set()
+        return cancel.wait(5)
+
+    spec = p.add("spec", search, speculative=True)
+    assert started.wait(1)
+    p.close()
+    with pytest.raises(StageCancelled):
+        spec.result(0)
+    assert [s["state"] for s in p.describe()] == [CANCELLED]
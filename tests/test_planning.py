@@ -0,0 +1,78 @@
+from math import pi, hypot, radians, atan2
+
+import pytest
+
+import planning
+from planning import plan, simplify, end_pose, normalize, turn, move, arc, Limits, DEFAULT_LIMITS, MIN_MOVE, MIN_TURN
+
+
+def reaches(pose,motions,goal,tolerance=1e-6):
+    x, y, theta = end_pose(pose, motions)
+    return hypot(x - goal[0], y - goal[1]) < tolerance
+
+
+def test_straight_ahead_needs_no_turn():
+    assert plan((0, 0, 0), (500, 0)) == [move(500)]
+
+
+def test_turn_then_move():
+    motions = plan((0, 0, 0), (0, 500))
+    assert [m.kind for m in motions] == ["turn", "move"]
+    assert motions[0].value == pytest.approx(pi / 2)
+    assert reaches((0, 0, 0), motions, (0, 500))
+
+
+def test_reverse_only_when_allowed():
+    assert [m.kind for m in plan((0, 0, 0), (-500, 0))] == ["turn", "move"]
+    assert plan((0, 0, 0), (-500, 0), reverse=True) == [move(-500)]
+
+
+def test_standoff_stops_in_front_of_goal():
+    motions = plan((0, 0, 0), (0, 1000), standoff=300)
+    assert reaches((0, 0, 0), motions, (0, 700))
+    assert end_pose((0, 0, 0), motions)[2] == pytest.approx(pi / 2)
+
+
+def test_standoff_past_goal_backs_up():
+    assert plan((0, 0, 0), (100, 0), standoff=300) == [move(-200)]
+
+
+def test_final_heading():
+    motions = plan((0, 0, 0), (500, 0), heading=pi / 2)
+    assert motions == [move(500), turn(pi / 2)]
+
+
+def test_already_there():
+    assert plan((100, 100, 1.0), (100 + MIN_MOVE / 2, 100)) == []
+    motions = plan((100, 100, 1.0), (100, 100), heading=0.0)
+    assert motions == [turn(-1.0)]
+
+
+def test_arc_used_when_faster():
+    # rotations lentes, cap d'arrivée tangent à l'arc : l'arc évite deux rotations sur place
+    limits = Limits(planning.LINEAR_SPEED, 0.5, planning.WHEEL_BASE, True)
+    pose, goal = (0, 0, 0), (1000, 400)
+    heading = 2 * atan2(400, 1000)
+    motions = plan(pose, goal, heading=heading, limits=limits)
+    assert [m.kind for m in motions] == ["arc"]
+    assert reaches(pose, motions, goal, tolerance=1e-3)
+    assert planning.plan_duration(motions, limits) < planning.plan_duration(plan(pose, goal, heading=heading), limits)
+
+
+def test_no_arc_without_support():
+    assert "arc" not in [m.kind for m in plan((0, 0, 0), (1000, 400), limits=DEFAULT_LIMITS)]
+
+
+def test_simplify_merges_and_normalizes():
+    assert simplify([turn(pi), turn(pi / 2), move(100), move(50)]) == [turn(normalize(1.5 * pi)), move(150)]
+    assert simplify([turn(MIN_TURN / 2), move(MIN_MOVE / 2), arc(MIN_TURN / 2, 200)]) == []
+    assert simplify([turn(radians(30)), turn(radians(-30)), move(200)]) == [move(200)]
+
+
+@pytest.mark.parametrize("pose", [(0, 0, 0), (250, -100, 2.5), (-800, 300, -1.0)])
+@pytest.mark.parametrize("goal", [(0, 0), (900, 900), (-400, 50)])
+def test_plans_reach_their_goal(pose,goal):
+    motions = plan(pose, goal, heading=0.3, reverse=True)
+    x, y, theta = end_pose(pose, motions)
+    assert hypot(x - goal[0], y - goal[1]) < MIN_MOVE
+    assert abs(normalize(theta - 0.3)) < MIN_TURN
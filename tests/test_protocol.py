@@ -0,0 +1,85 @@
+import pytest
+
+from protocol import (PROTOCOL_JSON, PROTOCOL_BINARY, ACKS_EACH, ACKS_BATCH, ACKS_NONE,
+                      PACKET_ACK, COMMAND_PACKET, ACK_PACKET, TELEMETRY_PACKET, TELEMETRY_GROUPS,
+                      negotiate, encode_command, decode_command, encode_ack, encode_telemetry, decode_telemetry)
+
+
+def test_negotiate_defaults_to_json():
+    assert negotiate({}) == (PROTOCOL_JSON, ACKS_EACH)
+    assert negotiate({"protocol": "msgpack", "acks": ACKS_NONE}) == (PROTOCOL_JSON, ACKS_EACH)
+
+
+def test_negotiate_binary_acks():
+    assert negotiate({"protocol": PROTOCOL_BINARY}) == (PROTOCOL_BINARY, ACKS_BATCH)
+    assert negotiate({"protocol": PROTOCOL_BINARY, "acks": ACKS_NONE}) == (PROTOCOL_BINARY, ACKS_NONE)
+    assert negotiate({"protocol": PROTOCOL_BINARY, "acks": "sometimes"}) == (PROTOCOL_BINARY, ACKS_BATCH)
+
+
+def test_command_round_trip():
+    packet = encode_command(42, 135, 80, 0.5, -0.25, mode=2)
+    assert len(packet) == COMMAND_PACKET.size == 12
+    command = decode_command(packet)
+    assert (command.seq, command.angle, command.distance, command.mode) == (42, 135, 80, 2)
+    assert command.x == pytest.approx(0.5)
+    assert command.y == pytest.approx(-0.25)
+
+
+def test_command_wraps_seq_and_angle():
+    command = decode_command(encode_command(0x10001, -90, 0, 0, 0))
+    assert command.seq == 1
+    assert command.angle == 270
+
+
+def test_command_clamps_joystick():
+    command = decode_command(encode_command(1, 0, 100, 40.0, -40.0))
+    assert command.x == pytest.approx(32.767)
+    assert command.y == pytest.approx(-32.768)
+
+
+@pytest.mark.parametrize("data", [b"", encode_command(1, 0, 0, 0, 0)[:-1], encode_ack(1, 1) + bytes(7)])
+def test_decode_command_rejects_other_packets(data):
+    with pytest.raises(ValueError):
+        decode_command(data)
+
+
+def test_ack_clamps_count():
+    kind, seq, count = ACK_PACKET.unpack(encode_ack(0x1FFFF, 70000))
+    assert (kind, seq, count) == (PACKET_ACK, 0xFFFF, 0xFFFF)
+
+
+def test_telemetry_round_trip():
+    fields = {
+        "battery": 87,
+        "auto": {"active": True, "captures": 1, "stages": ["approach_first"]},
+        "watchdog": {"armed": False, "trips": 3},
+        "pose": (120.0, -45.5, 1.25),
+        "link": {"clients": 2, "fps": 11.3, "tier": 1, "queue": 0, "latency": 0.0123},
+    }
+    packet = encode_telemetry(7, fields)
+    assert len(packet) == TELEMETRY_PACKET.size == 31
+    seq, decoded = decode_telemetry(packet)
+    assert seq == 7
+    assert decoded["battery"] == 87
+    assert decoded["auto"] == {"active": True, "captures": 1}
+    assert decoded["watchdog"] == {"armed": False, "trips": 3}
+    assert decoded["pose"] == pytest.approx((120.0, -45.5, 1.25))
+    assert decoded["link"]["fps"] == pytest.approx(11.3)
+    assert decoded["link"]["latency"] == pytest.approx(0.0123)
+
+
+def test_telemetry_keeps_only_present_groups():
+    seq, decoded = decode_telemetry(encode_telemetry(1, {"pose": (1.0, 2.0, 0.0)}))
+    assert list(decoded) == ["pose"]
+    seq, decoded = decode_telemetry(encode_telemetry(2, {}))
+    assert decoded == {}
+    seq, decoded = decode_telemetry(encode_telemetry(3, {"battery": 50, "auto": {}, "watchdog": {}, "link": {}}))
+    assert set(decoded) == set(TELEMETRY_GROUPS) - {"pose"}
+
+
+def test_telemetry_clamps_out_of_range_values():
+    seq, decoded = decode_telemetry(encode_telemetry(2 ** 32 + 5, {"battery": 300, "link": {"fps": -1, "latency": 10.0}}))
+    assert seq == 5
+    assert decoded["battery"] == 255
+    assert decoded["link"]["fps"] == 0
+    assert decoded["link"]["latency"] == pytest.approx(0xFFFF / 10000)
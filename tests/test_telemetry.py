@@ -0,0 +1,67 @@
+from telemetry import Telemetry, changed
+
+
+def test_changed_thresholds():
+    assert not changed(50, 50)
+    assert changed(50, 51)
+    assert not changed(50, 50.5, 1)
+    assert changed(50, 51, 1)
+    assert not changed((0.0, 0.0, 0.0), (5.0, -5.0, 0.01), (10.0, 10.0, 0.02))
+    assert changed((0.0, 0.0, 0.0), (5.0, -5.0, 0.03), (10.0, 10.0, 0.02))
+    assert not changed({"fps": 10.0, "tier": 1}, {"fps": 10.5, "tier": 1}, {"fps": 1.0})
+    assert changed({"fps": 10.0, "tier": 1}, {"fps": 10.5, "tier": 2}, {"fps": 1.0})
+    assert changed({"fps": 10.0}, {"fps": 10.0, "tier": 1})
+    assert changed(True, False)
+    assert changed(False, True, 2)  # un booléen n'a pas de seuil
+
+
+def test_first_delta_sends_everything_then_nothing():
+    t = Telemetry()
+    t.update(battery=80, auto={"active": False})
+    first = t.delta()
+    assert first["seq"] == 1 and not first["full"]
+    assert first["fields"] == {"battery": 80, "auto": {"active": False}}
+    assert t.delta() is None
+    assert t.seq == 1
+
+
+def test_delta_only_sends_changes_beyond_threshold():
+    t = Telemetry()
+    t.update(battery=80, pose=(0.0, 0.0, 0.0))
+    t.delta()
+    t.update(pose=(4.0, 0.0, 0.0))
+    assert t.delta() is None
+    # les petits pas s'accumulent par rapport à la dernière valeur envoyée
+    t.update(pose=(12.0, 0.0, 0.0))
+    assert t.delta()["fields"] == {"pose": (12.0, 0.0, 0.0)}
+    t.update(battery=79)
+    assert t.delta()["fields"] == {"battery": 79}
+
+
+def test_samplers_run_each_tick():
+    t = Telemetry()
+    value = {"battery": 90}
+    t.sampler("battery", lambda: value["battery"])
+    assert t.delta()["fields"] == {"battery": 90}
+    value["battery"] = 70
+    assert t.delta()["fields"] == {"battery": 70}
+    t.sampler("battery", None)
+    value["battery"] = 10
+    assert t.delta() is None
+
+
+def test_failing_sampler_does_not_block_others():
+    t = Telemetry()
+    t.sampler("broken", lambda: 1 / 0)
+    t.sampler("battery", lambda: 55)
+    assert t.delta()["fields"] == {"battery": 55}
+
+
+def test_snapshot_is_full_state():
+    t = Telemetry()
+    t.update(battery=80)
+    t.delta()
+    t.update(battery=80.4)
+    snapshot = t.snapshot()
+    assert snapshot["full"] and snapshot["seq"] == 1
+    assert snapshot["fields"] == {"battery": 80.4}
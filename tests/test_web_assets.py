@@ -0,0 +1,103 @@
+import gzip
+import http
+
+import pytest
+
+import web_assets
+from web_assets import WebAssets, IMMUTABLE, REVALIDATE
+
+SCRIPT = b"function tick() { return 1; }\n" * 50
+STYLE = b"body { margin: 0; }\n" * 50
+INDEX = b'<html><link href="style.css"><script src="script.js"></script><a href="https://example.org/x.js">x</a></html>'
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / "index.html").write_bytes(INDEX)
+    (tmp_path / "script.js").write_bytes(SCRIPT)
+    (tmp_path / "style.css").write_bytes(STYLE)
+    (tmp_path / "remake.py").write_bytes(b"print('secret')\n")
+    (tmp_path / "bench_history.jsonl").write_bytes(b'{"run": 1}\n')
+    (tmp_path / "image").mkdir()
+    (tmp_path / "image" / "logo.png").write_bytes(b"\x89PNG....")
+    return tmp_path
+
+
+@pytest.fixture
+def assets(root):
+    return WebAssets(str(root), ("index.html", "script.js", "style.css", "image"))
+
+
+def header(response,name):
+    return dict(response[1]).get(name)
+
+
+def test_whitelist_hides_code_and_history(assets):
+    assert assets.response("/remake.py", {}) is None
+    assert assets.response("/bench_history.jsonl", {}) is None
+    assert assets.response("/missing.js", {}) is None
+    assert assets.response("/image/logo.png", {})[0] == http.HTTPStatus.OK
+    assert assets.response("/", {})[0] == http.HTTPStatus.OK
+
+
+def test_whole_root_served_without_whitelist(root):
+    assets = WebAssets(str(root), None)
+    assert assets.response("/script.js", {})[0] == http.HTTPStatus.OK
+    assert assets.response("/remake.py", {}) is None  # pas un type servi
+
+
+def test_etag_and_not_modified(assets):
+    status, headers, body = assets.response("/script.js", {})
+    assert (status, body) == (http.HTTPStatus.OK, SCRIPT)
+    etag = dict(headers)["ETag"]
+    assert etag == f'"{assets.assets["/script.js"].etag}"'
+    assert dict(headers)["Cache-Control"] == REVALIDATE
+    for if_none_match in (etag, "*", f'"other", {etag}'):
+        status, headers, body = assets.response("/script.js", {"If-None-Match": if_none_match})
+        assert (status, body) == (http.HTTPStatus.NOT_MODIFIED, b"")
+    assert assets.response("/script.js", {"If-None-Match": '"other"'})[0] == http.HTTPStatus.OK
+
+
+def test_compressed_etag_validates_cache(assets):
+    response = assets.response("/script.js", {"Accept-Encoding": "gzip"})
+    etag = header(response, "ETag")
+    assert etag.endswith('-gzip"')
+    # le navigateur renvoie l'ETag de la version compressée : même contenu, 304
+    assert assets.response("/script.js", {"If-None-Match": etag})[0] == http.HTTPStatus.NOT_MODIFIED
+
+
+def test_accept_encoding_negotiation(assets):
+    response = assets.response("/script.js", {"Accept-Encoding": "gzip, deflate"})
+    assert header(response, "Content-Encoding") == "gzip"
+    assert gzip.decompress(response[2]) == SCRIPT
+    assert header(response, "Vary") == "Accept-Encoding"
+    for refused in ("", "identity", "gzip;q=0", "gzip; q=0.0, deflate", "*;q=0"):
+        response = assets.response("/script.js", {"Accept-Encoding": refused})
+        assert header(response, "Content-Encoding") is None, refused
+        assert response[2] == SCRIPT
+    assert header(assets.response("/script.js", {"Accept-Encoding": "*"}), "Content-Encoding") in ("gzip", "br")
+    # les images ne sont jamais recompressées
+    assert header(assets.response("/image/logo.png", {"Accept-Encoding": "gzip"}), "Content-Encoding") is None
+
+
+@pytest.mark.skipif(web_assets.brotli is None, reason="module brotli absent")
+def test_brotli_preferred(assets):
+    response = assets.response("/script.js", {"Accept-Encoding": "gzip, br"})
+    assert header(response, "Content-Encoding") == "br"
+    response = assets.response("/script.js", {"Accept-Encoding": "gzip, br;q=0"})
+    assert header(response, "Content-Encoding") == "gzip"
+
+
+def test_versioned_urls_are_immutable(assets):
+    etag = assets.assets["/style.css"].etag
+    assert header(assets.response(f"/style.css?v={etag}", {}), "Cache-Control") == IMMUTABLE
+    # une ancienne version demandée n'est pas figée sous ce contenu
+    assert header(assets.response("/style.css?v=0123456789abcdef", {}), "Cache-Control") == REVALIDATE
+    assert header(assets.response("/", {}), "Cache-Control") == REVALIDATE
+
+
+def test_index_references_are_versioned(assets):
+    page = assets.response("/index.html", {})[2].decode("utf-8")
+    assert f'href="style.css?v={assets.assets["/style.css"].etag}"' in page
+    assert f'src="script.js?v={assets.assets["/script.js"].etag}"' in page
+    assert 'href="https://example.org/x.js"' in page  # adresse externe inchangée
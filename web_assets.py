@@ -0,0 +1,195 @@
+'''
+Fichiers de l'interface web (index.html, script.js, style.css, images) servis par la
+boucle asyncio de la WebSocket, depuis Server.process_request
+
+Les fichiers sont lus une fois au démarrage, gardés en mémoire et compressés d'avance
+(gzip, et brotli si le module est installé). Chaque réponse porte un ETag : un navigateur
+qui a déjà le fichier reçoit un 304 vide. index.html est réécrit pour appeler les fichiers
+locaux avec ?v=<etag> ; ces adresses versionnées ne changent jamais de contenu et sont
+mises en cache pour un an, index.html lui-même étant toujours revalidé.
+
+Par défaut la page est à côté du code : seuls les fichiers de STATIC_FILES sont servis.
+Un dossier dédié à l'interface est servi en entier :
+
+    ARTEFACT_WEB_ROOT=/chemin/vers/interface python remake.py
+'''
+import os
+import re
+import gzip
+import hashlib
+import logging
+import http
+from urllib.parse import urlsplit, parse_qs, unquote
+import metrics
+
+try:
+    import brotli
+except ImportError:  # dépendance facultative : gzip seul
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+WEB_ROOT = os.environ.get("ARTEFACT_WEB_ROOT")  # dossier dédié à l'interface, servi en entier
+STATIC_ROOT = WEB_ROOT or os.path.dirname(os.path.abspath(__file__))  # dossier de index.html
+# fichiers et dossiers servis quand la page est à côté du code (jamais les .py, l'historique du banc...)
+STATIC_FILES = None if WEB_ROOT else ("index.html", "script.js", "style.css", "image")
+INDEX = "index.html"
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon",
+}
+COMPRESSIBLE = {".html", ".js", ".css", ".svg"}
+SKIPPED_DIRS = {"__pycache__", "node_modules"}
+IMMUTABLE = "public, max-age=31536000, immutable"  # adresse versionnée : contenu figé
+REVALIDATE = "no-cache"                            # toujours revalidé avec l'ETag
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# références locales de index.html à versionner : src="..." et href="..."
+ASSET_REFERENCE = re.compile(r'((?:src|href)=")([^"?#:]+)(")')
+
+STATIC_RESPONSES = metrics.counter("static_responses_total", "Web UI responses served from the WebSocket loop")
+STATIC_NOT_MODIFIED = metrics.counter("static_not_modified_total", "Web UI requests answered with 304")
+
+
+class Asset():
+    '''
+        Fichier servi : contenu, versions compressées, type et ETag
+
+        arguments
+            path:  chemin URL du fichier ("/script.js") STRING
+            body:  contenu du fichier BYTES
+            content_type:  type MIME STRING
+    '''
+    def __init__(self,path,body,content_type):
+        self.path = path
+        self.content_type = content_type
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        self.encodings = {"identity": body}
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            self._compress("gzip", gzip.compress(body, GZIP_LEVEL, mtime=0))
+            if brotli is not None:
+                self._compress("br", brotli.compress(body, quality=BROTLI_QUALITY))
+
+    def _compress(self,encoding,data):
+        # une compression qui ne fait rien gagner n'est pas gardée
+        if len(data) < len(self.encodings["identity"]):
+            self.encodings[encoding] = data
+
+    def choose(self,accept_encoding):
+        '''
+            Meilleure version acceptée par le client (en-tête Accept-Encoding)
+
+            retourne (encodage, contenu)
+        '''
+        accepted = set()
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and (encoding in accepted or "*" in accepted):
+                return encoding, self.encodings[encoding]
+        return "identity", self.encodings["identity"]
+
+
+class WebAssets():
+    '''
+        Fichiers de l'interface web chargés en mémoire
+
+        arguments
+            root:  dossier contenant index.html STRING
+            files:  fichiers ou dossiers servis, relatifs à root LIST (None : tout root)
+    '''
+    def __init__(self,root=STATIC_ROOT,files=STATIC_FILES):
+        self.root = root
+        self.files = files
+        self.assets = {}  # chemin URL -> Asset
+        self.load()
+
+    def load(self):
+        '''
+            (Re)lit tous les fichiers servis sous root, puis versionne les références de index.html
+        '''
+        assets = {}
+        for entry in (self.files if self.files is not None else ("",)):
+            top = os.path.join(self.root, entry)
+            if os.path.isfile(top):
+                self._add(assets, top)
+            for directory, dirs, files in os.walk(top):
+                dirs[:] = [d for d in dirs if not d.startswith(".") and d not in SKIPPED_DIRS]
+                for name in files:
+                    self._add(assets, os.path.join(directory, name))
+        index = assets.get("/" + INDEX)
+        if index is not None:
+            assets["/" + INDEX] = Asset(index.path, self._version(index.encodings["identity"], assets), index.content_type)
+        self.assets = assets
+        logger.info(f"Web UI assets loaded from {self.root} - {len(assets)} files, brotli: {brotli is not None}")
+        return self
+
+    def _add(self,assets,full):
+        name = os.path.basename(full)
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+        if content_type is None or name.startswith("."):
+            return
+        path = "/" + os.path.relpath(full, self.root).replace(os.sep, "/")
+        with open(full, "rb") as f:
+            assets[path] = Asset(path, f.read(), content_type)
+
+    def _version(self,html,assets):
+        '''
+            Ajoute ?v=<etag> aux fichiers locaux appelés par la page
+        '''
+        def versioned(match):
+            target = match.group(2)
+            asset = assets.get("/" + target.lstrip("./"))
+            if asset is None:
+                return match.group(0)
+            return f"{match.group(1)}{target}?v={asset.etag}{match.group(3)}"
+        return ASSET_REFERENCE.sub(versioned, html.decode("utf-8")).encode("utf-8")
+
+    def response(self,path,request_headers):
+        '''
+            Réponse HTTP pour path, au format de process_request de websockets
+
+            retourne (HTTPStatus, en-têtes, corps), ou None si aucun fichier ne correspond
+        '''
+        url = urlsplit(path)
+        name = unquote(url.path)
+        if name.endswith("/"):
+            name += INDEX
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        version = parse_qs(url.query).get("v", [None])[-1]
+        encoding, body = asset.choose(request_headers.get("Accept-Encoding", ""))
+        # un ETag par représentation ; toutes celles d'un même contenu valident le cache
+        etag = asset.etag if encoding == "identity" else f"{asset.etag}-{encoding}"
+        headers = [
+            ("Cache-Control", IMMUTABLE if version == asset.etag else REVALIDATE),
+            ("ETag", f'"{etag}"'),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if_none_match = request_headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or f'"{asset.etag}' in if_none_match:
+            STATIC_NOT_MODIFIED.inc()
+            return http.HTTPStatus.NOT_MODIFIED, headers, b""
+        headers.append(("Content-Type", asset.content_type))
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        STATIC_RESPONSES.inc()
+        return http.HTTPStatus.OK, headers, body
+
+    def stats(self):
+        return {
+            path: {encoding: len(data) for encoding, data in asset.encodings.items()}
+            for path, asset in self.assets.items()
+        }